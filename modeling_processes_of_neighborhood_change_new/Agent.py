@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import
 from config import EPSILON
+from route_index import RouteIndex, MODE_NAMES, compile_routes
+from sampler import FenwickSampler
 import numpy as np
 
 
@@ -14,17 +16,24 @@ class Agent:
 
         # Step 1: Initialize sampling variables
         self.weights = None
-        self.probabilities = None
-        self.tot_probabilities = None
+        self.sampler = None  # Cumulative distribution over weights (FenwickSampler)
         self.avg_probabilities = None
 
+        # Running sum of probabilities, accumulated lazily: tot_probabilities = tot_base + weights * inv_sum_acc
+        self.tot_base = None
+        self.inv_sum_acc = None
+
         # Step 2: Location tracking
         self.u = None  # Current location
         self.prev_u = None  # Previous location
-        self.routes = None  # Assigned routes
+        self.routes = None  # Assigned route destinations
+        self.route_volumes = None  # Assigned route volumes (weights)
+        self.routes_origin = None  # Origin the assigned routes were looked up for
+        self.routes_index = None  # RouteIndex the assigned routes were looked up in
 
         # Transportation mode (based on car ownership rate)
         self.mode = 'car' if np.random.random() < car_ownership_rate else 'transit'
+        self.mode_code = MODE_NAMES.index(self.mode)  # First axis of the city's travel costs
 
         self.reset()
 
@@ -39,54 +48,59 @@ class Agent:
         self.weights = np.ones(len(self.city.centroids))
         amenity_weights = self.city.amts_dens / np.sum(self.city.amts_dens)
         self.weights = self.weights * amenity_weights
-        self.probabilities = np.array(self.weights / self.weights.sum())
-        self.tot_probabilities = self.probabilities.copy()
+        self.sampler = FenwickSampler(self.weights)
+        self.tot_base = np.zeros_like(self.weights)
+        self.inv_sum_acc = 1.0 / self.sampler.total
 
         # Initialize starting position based on trip generation probabilities
-        self.u = np.random.choice(self.city.n, p=self.probabilities)
-        self.city.inh_array[self.u].add(self)
-
-    def assign_routes(self, assigned_routes):
-        """Step 2: Route modification based on FSM route assignment"""
-        self.routes = []
-        origin_geoid = self.city.centroids[self.u][4]
-
-        # Filter routes for current mode and origin
-        for (o_geoid, d_geoid, mode), volume in assigned_routes.items():
-            if mode == self.mode and o_geoid == origin_geoid:
-                # Convert destination geoid to index
-                dest_idx = next(i for i, c in enumerate(self.city.centroids) if c[4] == d_geoid)
-                # Add route with weight proportional to volume
-                self.routes.extend([dest_idx] * int(volume))
+        self.u = self.sampler.sample()
+        self.city.add_agent(self, self.u)
+
+    @property
+    def probabilities(self):
+        """ Current sampling distribution """
+        return self.weights / self.sampler.total
+
+    @property
+    def tot_probabilities(self):
+        """ Sum of the sampling distribution over all timesteps so far """
+        return self.tot_base + self.weights * self.inv_sum_acc
+
+    def assign_routes(self, route_index):
+        """Step 2: Route modification based on FSM route assignment (RouteIndex lookup)"""
+        # Routes only change when the origin does
+        if self.routes_index is route_index and self.routes_origin == self.u:
+            return
+        self.routes_index = route_index
+        self.routes_origin = self.u
+        self.routes, self.route_volumes = route_index.routes(self.u, self.mode)
 
     def act(self):
         """Step 2: Movement based on FSM distribution and mode"""
         self.prev_u = self.u
-        self.city.inh_array[self.u].remove(self)
 
-        if self.routes:
-            # Weight routes by both FSM assignment and amenity attractiveness
-            route_indices = np.array(self.routes)
-            route_probs = self.probabilities[route_indices] * self.city.amts_dens[route_indices]
+        if self.routes is not None and len(self.routes) > 0:
+            # Weight routes by FSM assignment volume and amenity attractiveness
+            route_indices = self.routes
+            route_probs = self.weights[route_indices] * self.city.amts_dens[route_indices] * self.route_volumes
             route_probs = route_probs / route_probs.sum()  # Normalize
-
-            if len(route_indices) > 0:
-                self.u = np.random.choice(route_indices, p=route_probs)
-            else:
-                self.u = np.random.choice(self.city.n, p=self.probabilities)
+            self.u = np.random.choice(route_indices, p=route_probs)
         else:
-            self.u = np.random.choice(self.city.n, p=self.probabilities)
+            self.u = self.sampler.sample()
 
-        self.city.inh_array[self.u].add(self)
+        self.city.move_agent(self, self.prev_u, self.u)
 
     def learn(self):
         """Step 3: Update based on cost calculation"""
         cost = self.calculateCost(self.u)
+        old_weight = self.weights[self.u]
         self.weights[self.u] *= (1 - EPSILON * cost)
+        self.sampler.add(self.u, self.weights[self.u] - old_weight)
 
-        # Update sampling distribution
-        self.probabilities = self.weights / np.sum(self.weights)
-        self.tot_probabilities += self.probabilities
+        # Update sampling distribution lazily - O(1) instead of two passes over all centroids:
+        # the changed weight's accumulated mass moves to tot_base, then every weight accrues 1 / total
+        self.tot_base[self.u] += (old_weight - self.weights[self.u]) * self.inv_sum_acc
+        self.inv_sum_acc += 1.0 / self.sampler.total
 
     def calculateCost(self, u):
         """Step 3: Cost function with mode-specific adjustments"""
@@ -98,9 +112,7 @@ class Agent:
         beltline = self.city.beltline_score_array[u]                                       # Binary; 0 if not in Beltline
 
         # Mode-specific adjustments
-        base_location_cost = self.city.centroid_distances[self.prev_u, u]               # Normalized distance
-        mode_factor = 1.5 if self.mode == 'transit' else 1.0                            # Mode of transport cost - x1.5 multiplier if public transit vs. personal car
-        location_cost = base_location_cost * mode_factor                                # f(distance, mode_cost)
+        location_cost = self.city.travel_cost(self.mode_code, self.prev_u, u)          # f(distance, mode_cost) - normalized cost of this agent's mode
 
         # Combine costs according to FSM and mode
         cost = 1 - (affordability * upkeep * beltline * location_cost * community_cost * accessibility)
@@ -111,7 +123,7 @@ class Simulation:
     def __init__(self, city, num_agents):
         self.city = city
         self.agents = [Agent(i, np.random.random(), city) for i in range(num_agents)]
-        self.assigned_routes = {}  # Store FSM route assignments
+        self.route_index = RouteIndex.from_assigned_routes({}, city.centroids)  # Compiled FSM route assignments
 
     def step(self):
         """Execute one simulation step"""
@@ -129,15 +141,15 @@ class Simulation:
     def update_routes(self):
         """Update routes based on FSM assignments"""
         for agent in self.agents:
-            agent.assign_routes(self.assigned_routes)
+            agent.assign_routes(self.route_index)
 
     def reset(self):
         """Reset simulation state"""
         for agent in self.agents:
             agent.reset()
-        self.assigned_routes = {}
+        self.route_index = RouteIndex.from_assigned_routes({}, self.city.centroids)
 
     def set_routes(self, fsm_routes):
         """Update routes from FSM"""
-        self.assigned_routes = fsm_routes
+        self.route_index = compile_routes(fsm_routes, self.city.centroids)
         self.update_routes()
\ No newline at end of file
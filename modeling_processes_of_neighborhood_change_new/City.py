@@ -1,8 +1,11 @@
 # City.py
 
+from config import INCREMENTAL_CITY_UPDATE, T_MAX_RANGE, HISTORY_STRIDE, TRANSIT_COST_FACTOR
+from history import HistoryRecorder
+from route_index import MODE_CAR
+from bisect import bisect_left, insort
 import numpy as np
 import pandas as pd
-import osmnx as ox
 
 
 # ==========
@@ -11,11 +14,10 @@ import osmnx as ox
 
 class City:
 
-    def __init__(self, centroids, g, amts_dens, centroid_distances, rho, geo_id_to_income):
+    def __init__(self, centroids, node_array, amts_dens, centroid_distances, rho, geo_id_to_income, t_max=T_MAX_RANGE):
         """ Constructor """
         self.rho = int(rho)  # house capacity
         self.centroids = centroids  # centroids list
-        self.g = g  # OSM graph
         self.n = len(centroids) # num centroids
 
         # STORE ATTRIBUTES OF ALL CENTROIDS
@@ -29,16 +31,37 @@ class City:
         self.dow_thr_array = np.zeros(self.n)  # Endowment threshold
         self.upk_array = np.zeros(self.n, dtype=bool)  # Upkeep score
         self.cmt_array = np.zeros(self.n)  # Community score
+        self.pop_array = np.zeros(self.n, dtype=int)  # Population
+        self.avg_dow_array = np.zeros(self.n)  # Average endowment of inhabitants
 
-        self.pop_hist = [[] for _ in range(self.n)]  # Population history - list of lists
-        self.cmt_hist = [[] for _ in range(self.n)]  # Community score history - list of lists
+        self.history = HistoryRecorder(self.n, t_max, stride=HISTORY_STRIDE)  # Population & community score history
+        self.converged_at = None  # Timestep at which the run converged (early stopping), if it did
 
-        self.node_array = np.array(
-            [ox.nearest_nodes(self.g, lon, lat) for lon, lat in zip(self.lon_array, self.lat_array)])
+        # Incremental update state - only centroids whose inhabitants changed are recomputed
+        self.incremental = INCREMENTAL_CITY_UPDATE
+        self.dirty_array = np.ones(self.n, dtype=bool)  # Centroids entered or left since the last update
+        self.dow_sum_array = np.zeros(self.n)  # Sum of inhabitant endowments (recomputed for updated centroids)
+        self.sorted_dows = [[] for _ in range(self.n)]  # Ascending inhabitant endowments (order statistics)
 
-        # Amenity density and centroid distances
+        # Nearest graph node of each centroid (precomputed once - the graph itself is not stored)
+        self.node_array = np.asarray(node_array)
+
+        # Amenity density and travel costs, looked up by each agent's mode code (see travel_cost)
         self.amts_dens = amts_dens
-        self.centroid_distances = centroid_distances
+        centroid_distances = np.asarray(centroid_distances)  # View - shared (memory-mapped) inputs are not copied
+        if centroid_distances.ndim == 3:
+            # Per-mode cost matrices - (modes x n x n)
+            self.travel_costs = centroid_distances
+            self.centroid_distances = centroid_distances[MODE_CAR]  # Distances between centroids (car costs)
+        else:
+            # Single distance matrix - transit costs TRANSIT_COST_FACTOR x the distance
+            self.travel_costs = None
+            self.centroid_distances = centroid_distances  # Distances between centroids
+        self.mode_factors = np.array([1.0, TRANSIT_COST_FACTOR])  # Cost factor of each mode code (single matrix only)
+
+        # Community score weights inhabitants by (1 - d(index, index)) ** 2 - must not all be zero
+        if np.any(np.diagonal(self.centroid_distances) >= 1):
+            raise ValueError("Centroid distances must be < 1 on the diagonal (a centroid's distance to itself).")
 
         # Map GEO_ID to income
         self.geo_id_to_income = geo_id_to_income
@@ -48,14 +71,66 @@ class City:
         self.agts = agts  # list of agents
         self.agt_dows = np.array([a.dow for a in self.agts])  # array of agent endowments
 
+    def set_population(self, population):
+        """ Initialize vectorized agent population and their endowments """
+        self.agts = population  # AgentPopulation
+        self.agt_dows = population.dows  # array of agent endowments
+
+    def travel_cost(self, mode, u, v):
+        """ Normalized travel cost u -> v for mode code(s) 'mode' (scalars or broadcastable arrays) """
+        if self.travel_costs is None:
+            return self.mode_factors[mode] * self.centroid_distances[u, v]
+        return self.travel_costs[mode, u, v]
+
+    def record_history(self):
+        """ Record the current population and community score of all centroids in bulk """
+        self.history.record(self.pop_array, self.cmt_array)
+
+    # =================
+    # AGENT BOOKKEEPING
+    # =================
+    def add_agent(self, agent, u):
+        """ Place an Agent at centroid u """
+        self.inh_array[u].add(agent)
+        if self.incremental:
+            self._enter(u, agent.dow)
+
+    def move_agent(self, agent, prev_u, u):
+        """ Move an Agent from centroid prev_u to centroid u """
+        if prev_u == u:
+            return
+        self.inh_array[prev_u].remove(agent)
+        self.inh_array[u].add(agent)
+        if self.incremental:
+            self._leave(prev_u, agent.dow)
+            self._enter(u, agent.dow)
+
+    def _enter(self, index, dow):
+        insort(self.sorted_dows[index], dow)
+        self.dirty_array[index] = True
+
+    def _leave(self, index, dow):
+        dows = self.sorted_dows[index]
+        dows.pop(bisect_left(dows, dow))
+        self.dirty_array[index] = True
+
+    # ===============
+    # CENTROID UPDATE
+    # ===============
     def update(self):
         """ Update each centroid's: Population, CMT score, UPK score """
-        
+        if self.incremental:
+            self._update_dirty()
+        else:
+            self._update_all()
+        self.record_history()
+
+    def _update_all(self):
+        """ Recompute every centroid from its inhabitant set """
         for index in range(self.n):  # For each centroid
             inhabitants = self.inh_array[index]  # Centroid inhabitants
             pop = len(inhabitants)
-
-            self.pop_hist[index].append(pop) # Update population history
+            self.pop_array[index] = pop
 
             if pop > 0:  # Inhabited
                 ''' Community Score ''' #(avg inhabitant dows, weighted by distance to other centroids) #TODO: check logic
@@ -64,6 +139,7 @@ class City:
                 weights = (1 - distances) ** 2
 
                 cmt = np.average(inhabitant_dows, weights=weights) #Calculate
+                self.avg_dow_array[index] = inhabitant_dows.mean()
 
                 ''' Upkeep score '''
                 if pop < self.rho:
@@ -75,12 +151,101 @@ class City:
             else:  # If uninhabited
                 self.dow_thr_array[index] = 0.0
                 self.upk_array[index] = 0.0
+                self.avg_dow_array[index] = 0.0
                 cmt = 0.0
 
-            # Update Community history and Community Score (average endowment)
-            self.cmt_hist[index].append(cmt)
+            # Update Community Score (average endowment)
             self.cmt_array[index] = cmt
 
+    def _update_dirty(self):
+        """ Recompute only centroids whose inhabitants changed, from their sorted endowments """
+        # Every inhabitant of a centroid is at that centroid, so the distance weights of the community
+        # score are all (1 - d(index, index)) ** 2 (nonzero - checked in __init__) and the weighted average is the mean
+        for index in np.flatnonzero(self.dirty_array):
+            dows = self.sorted_dows[index]
+            pop = len(dows)
+            self.pop_array[index] = pop
+            self.dow_sum_array[index] = sum(dows)  # Exact for the current inhabitants - no drift over millions of moves
+
+            if pop > 0:  # Inhabited
+                avg = self.dow_sum_array[index] / pop
+                self.avg_dow_array[index] = avg
+                self.cmt_array[index] = avg
+                self.dow_thr_array[index] = dows[-self.rho] if pop >= self.rho else 0.0
+                self.upk_array[index] = 1.0
+            else:  # If uninhabited
+                self.avg_dow_array[index] = 0.0
+                self.cmt_array[index] = 0.0
+                self.dow_thr_array[index] = 0.0
+                self.upk_array[index] = 0.0
+
+        self.dirty_array[:] = False
+
+    def update_from_arrays(self, agt_u, agt_dows, agt_prev_u=None):
+        """ Vectorized update: same as update(), from agent location (and previous location) and endowment arrays """
+        if self.incremental and agt_prev_u is not None:
+            self._update_moves_from_arrays(agt_u, agt_dows, agt_prev_u)
+        else:
+            self._update_all_from_arrays(agt_u, agt_dows)
+        self.record_history()
+
+    def _update_all_from_arrays(self, agt_u, agt_dows):
+        pop = np.bincount(agt_u, minlength=self.n)
+        inhabited = pop > 0
+
+        ''' Community Score ''' # (avg inhabitant dows, weighted by distance to other centroids)
+        weights = (1 - self.centroid_distances[agt_u, agt_u]) ** 2
+        weighted_dows = np.bincount(agt_u, weights=weights * agt_dows, minlength=self.n)
+        weight_sums = np.bincount(agt_u, weights=weights, minlength=self.n)
+        cmt = np.divide(weighted_dows, weight_sums, out=np.zeros(self.n), where=inhabited)
+
+        self.dow_sum_array = np.bincount(agt_u, weights=agt_dows, minlength=self.n)
+        self.avg_dow_array = np.divide(self.dow_sum_array, pop, out=np.zeros(self.n), where=inhabited)
+
+        ''' Upkeep score ''' # rho-th largest endowment of full centroids
+        self.dow_thr_array = np.zeros(self.n)
+        self._update_thresholds(agt_u, agt_dows, pop >= self.rho)
+        self.upk_array = inhabited
+
+        self.pop_array = pop
+        self.cmt_array = cmt
+
+    def _update_moves_from_arrays(self, agt_u, agt_dows, agt_prev_u):
+        """ Apply only the agents that moved since the last update """
+        moved = agt_prev_u != agt_u
+        src, dst = agt_prev_u[moved], agt_u[moved]
+
+        self.pop_array += np.bincount(dst, minlength=self.n) - np.bincount(src, minlength=self.n)
+        # Endowment sums from all agents (one bincount) rather than a running sum that drifts over millions of moves
+        self.dow_sum_array = np.bincount(agt_u, weights=agt_dows, minlength=self.n)
+
+        dirty = np.zeros(self.n, dtype=bool)
+        dirty[src] = True
+        dirty[dst] = True
+        inhabited = self.pop_array > 0
+
+        # Community score is the inhabitants' mean endowment (see _update_dirty)
+        avg = np.divide(self.dow_sum_array, self.pop_array, out=np.zeros(self.n), where=inhabited)
+        self.avg_dow_array[dirty] = avg[dirty]
+        self.cmt_array[dirty] = avg[dirty]
+        self.upk_array[dirty] = inhabited[dirty]
+
+        # Thresholds only for dirty centroids
+        full = self.pop_array >= self.rho
+        self.dow_thr_array[dirty & ~full] = 0.0
+        self._update_thresholds(agt_u, agt_dows, dirty & full)
+
+    def _update_thresholds(self, agt_u, agt_dows, centroid_mask):
+        """ Set dow_thr_array to the rho-th largest inhabitant endowment for the masked centroids """
+        if not centroid_mask.any():
+            return
+        selected = centroid_mask[agt_u]
+        sub_u, sub_dows = agt_u[selected], agt_dows[selected]
+        counts = np.bincount(sub_u, minlength=self.n)
+        order = np.lexsort((-sub_dows, sub_u))  # Sort by centroid, then by descending endowment
+        starts = np.cumsum(counts) - counts
+        self.dow_thr_array[centroid_mask] = sub_dows[order[starts[centroid_mask] + self.rho - 1]]
+
     # =====================
     # SAVE DATA TO CSV FILE
     # =====================
@@ -93,15 +258,7 @@ class City:
         """
         data = []  # Array storing data for each centroid
         
-        avg_incomes = np.zeros(self.n)
-        for index in range(self.n):
-            population = len(self.inh_array[index])
-            # Average Endowment
-            if population > 0:
-                avg_endowment = (np.mean([agent.dow for agent in self.inh_array[index]]))
-            else:
-                avg_endowment = 0.0
-            avg_incomes[index] = avg_endowment
+        avg_incomes = self.avg_dow_array.copy()
 
         # Normalize avg_endowments
         min_val = avg_incomes.min()
@@ -118,7 +275,7 @@ class City:
             centroid_name = self.name_array[index]
 
             # Population
-            population = len(self.inh_array[index])
+            population = self.pop_array[index]
             
             avg_income = avg_incomes[index]
 
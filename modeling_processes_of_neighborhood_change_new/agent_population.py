@@ -0,0 +1,133 @@
+# agent_population.py
+
+from config import EPSILON
+from route_index import MODE_CAR, MODE_TRANSIT
+from sampler import BatchedFenwickSampler, sample_segments
+import numpy as np
+
+
+class AgentPopulation:
+    """ Vectorized (structure-of-arrays) agent engine - same semantics as Agent, for the whole population at once """
+
+    def __init__(self, dows, city, alpha=0.5, car_ownership_rate=0.7):
+        self.dows = np.asarray(dows, dtype=float)  # Endowments
+        self.city = city  # City object
+        self.alpha = alpha  # Weight parameter for cost calculation
+        self.num_agents = len(self.dows)
+
+        # Transportation mode (based on car ownership rate)
+        self.modes = np.where(np.random.random(self.num_agents) < car_ownership_rate, MODE_CAR, MODE_TRANSIT)
+
+        # Sampling variables - weights is an (agents x centroids) float32 matrix
+        self.weights = None
+        self.sampler = None  # Per-agent cumulative distributions (BatchedFenwickSampler)
+        self.avg_probabilities = None
+
+        # Running sum of probabilities, accumulated lazily with one accumulator per agent:
+        # tot_probabilities = tot_base + weights * inv_sum_acc (inv_sum_acc = sum of 1 / weight sum over all steps)
+        self.tot_base = None
+        self.inv_sum_acc = None
+
+        # Location tracking
+        self.u = None  # Current locations
+        self.prev_u = None  # Previous locations
+        self.route_index = None  # Compiled FSM route assignments (RouteIndex)
+
+        self.reset()
+
+    def reset(self):
+        """ Initialize sampling based on amenity densities """
+        # float32 (agents x centroids) state - weights, their Fenwick trees and tot_base - halves memory at 100k+ agents
+        amenity_weights = (self.city.amts_dens / np.sum(self.city.amts_dens)).astype(np.float32)
+        self.weights = np.tile(amenity_weights, (self.num_agents, 1))
+        self.sampler = BatchedFenwickSampler(self.weights)
+
+        self.tot_base = np.zeros_like(self.weights)
+        self.inv_sum_acc = 1.0 / self.weight_sums
+
+        # Initialize starting positions based on trip generation probabilities
+        self.u = self.sampler.sample()
+        self.prev_u = self.u.copy()
+
+    @property
+    def weight_sums(self):
+        """ Sum of every agent's weights """
+        return self.sampler.totals
+
+    @property
+    def probabilities(self):
+        """ Current sampling distribution of every agent """
+        return self.weights / self.weight_sums[:, None]
+
+    @property
+    def tot_probabilities(self):
+        """ Sum of every agent's sampling distribution over all timesteps so far """
+        return self.tot_base + self.weights * self.inv_sum_acc[:, None]
+
+    def average_probabilities(self, timestep):
+        """ Average sampling distribution of every agent after 'timestep' steps """
+        return self.tot_probabilities / timestep
+
+    def set_routes(self, route_index):
+        """ Attach compiled FSM route assignments - assigned_routes does not change during a run """
+        self.route_index = route_index
+
+    def act(self):
+        """ Movement based on FSM distribution and mode, for all agents """
+        self.prev_u = self.u
+
+        routed = None
+        if self.route_index is not None and len(self.route_index) > 0:
+            owners, destinations, volumes, lengths = self.route_index.gather(self.u, self.modes)
+            routed = lengths > 0
+
+        # One RNG call draws for the whole population
+        draws = np.random.random(self.num_agents)
+
+        if routed is None or not routed.any():
+            self.u = self.sampler.sample(draws=draws)
+            return
+
+        # Agents without routes sample from their full distribution
+        new_u = np.empty(self.num_agents, dtype=np.int64)
+        unrouted = np.flatnonzero(~routed)
+        new_u[unrouted] = self.sampler.sample(rows=unrouted, draws=draws[unrouted])
+
+        # Weight routes by both FSM assignment and amenity attractiveness
+        route_weights = self.weights[owners, destinations] * self.city.amts_dens[destinations] * volumes
+        picks = sample_segments(route_weights, lengths[routed], draws=draws[routed])
+        new_u[routed] = destinations[picks]
+        self.u = new_u
+
+    def learn(self):
+        """ Update weights based on cost calculation, for all agents """
+        rows = np.arange(self.num_agents)
+        cost = self.calculate_costs(self.u)
+
+        old_weights = self.weights[rows, self.u]
+        new_weights = (old_weights * (1 - EPSILON * cost)).astype(np.float32)
+
+        # Keep tot_probabilities unchanged by the new weights: the changed entries' accumulated mass moves to tot_base
+        self.tot_base[rows, self.u] += (old_weights - new_weights) * self.inv_sum_acc
+        self.weights[rows, self.u] = new_weights
+        self.sampler.add(rows, self.u, new_weights - old_weights)
+
+        # Update sampling distribution
+        self.inv_sum_acc = self.inv_sum_acc + 1.0 / self.weight_sums
+
+    def calculate_costs(self, u):
+        """ Cost function with mode-specific adjustments, for all agents """
+        city = self.city
+        # Base components
+        affordability = (self.dows >= city.dow_thr_array[u]).astype(float)
+        community_cost = np.exp(-self.alpha * np.abs(self.dows - city.cmt_array[u]))
+        accessibility = np.exp(-(1 - self.alpha) * city.amts_dens[u])
+        upkeep = city.upk_array[u]
+        beltline = city.beltline_score_array[u]
+
+        # Mode-specific adjustments
+        location_cost = city.travel_cost(self.modes, self.prev_u, u)
+
+        # Combine costs according to FSM and mode
+        cost = 1 - (affordability * upkeep * beltline * location_cost * community_cost * accessibility)
+        return cost
@@ -0,0 +1,109 @@
+# amenity_cache.py
+
+from config import AMENITY_CACHE_MAX_MB
+from helper import AMENITY_CACHE_DIR
+from pathlib import Path
+import shapely
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+# =======================
+# CONTENT-ADDRESSED CACHE
+# =======================
+# Amenity results are keyed by what they were computed from - the region geometry (normalized WKB),
+# the tag filters and the amenity source - rather than by GDF row index, so edited or reordered
+# regions never pick up another region's counts and unchanged regions are never fetched again.
+# Entries are written atomically; the least recently used ones are evicted beyond the size bound
+# (tracked as a running total, so the directory is only scanned once and when evicting).
+
+
+class AmenityCache:
+    """ Pickled amenity results keyed by (kind, geometry, tags, source), bounded in size (LRU) """
+
+    def __init__(self, cache_dir=AMENITY_CACHE_DIR, max_mb=AMENITY_CACHE_MAX_MB):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.hits = 0
+        self.misses = 0
+        self.size = None  # Running total of the entries' bytes (scanned on the first put)
+        self.lock = threading.Lock()  # Entries may be read and written from the OSM client's worker threads
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, kind, geometry, tags, source):
+        """ Cache key of a result of 'kind' for this geometry, tag set and source """
+        hasher = hashlib.md5()
+        hasher.update(kind.encode())
+        hasher.update(shapely.normalize(geometry).wkb)  # Same shape -> same key, whatever its vertex order
+        hasher.update(pickle.dumps(sorted((key, values) for key, values in tags.items())))
+        hasher.update(pickle.dumps(source))
+        return f"{kind}_{hasher.hexdigest()}"
+
+    def get(self, key):
+        """ Cached value, or None on a miss; a hit marks the entry as recently used """
+        path = self.cache_dir / f"{key}.pkl"
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        os.utime(path)
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ Store a value (atomically), then evict least recently used entries beyond the size bound """
+        path = self.cache_dir / f"{key}.pkl"
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{key}.", suffix=".tmp")  # Unique per thread
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f)
+        size = os.path.getsize(tmp_path)
+        with self.lock:
+            if self.size is None:
+                self.size = sum(entry_size for _, entry_size, _ in self._entries())
+            try:
+                self.size -= path.stat().st_size  # Replaced entry
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self.size += size
+            if self.size > self.max_bytes:
+                self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """ Remove least recently used entries until the cache fits in max_mb (never 'keep') """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+    def _entries(self):
+        """ (modification time, size, path) of every entry on disk """
+        entries = []
+        for path in self.cache_dir.glob("*.pkl"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def report(self):
+        """ Print hits/misses of this session and the cache's size """
+        sizes = [path.stat().st_size for path in self.cache_dir.glob("*.pkl")]
+        print(f"Amenity cache: {self.hits} hit(s), {self.misses} miss(es); "
+              f"{len(sizes)} entries, {sum(sizes) / 2 ** 20:.1f} / {self.max_bytes / 2 ** 20:.0f} MB")
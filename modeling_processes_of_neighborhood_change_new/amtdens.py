@@ -1,78 +1,176 @@
 # amtsdens.py
 
-from config import viewData
-from helper import AMTS_DENS_CACHE_DIR, CENTROID_DIST_CACHE_DIR
+from config import viewData, AMENITY_FETCH_MODE, AMENITY_SOURCE, OSM_EXTRACT_PATH, AMENITY_WEIGHTS
+from osm_extract import load_osm_amenities
+from amenity_cache import AmenityCache
+from osm_client import OSMClient
 import os
 import osmnx as ox
-import networkx as nx
+import geopandas as gpd
 import numpy as np
-import pickle
-import hashlib
-from tqdm import tqdm
-from joblib import Parallel, delayed
-
-def _hash(*args, **kwargs):
-    """ Hash function """
-    hasher = hashlib.md5()
-    for arg in args:
-        hasher.update(pickle.dumps(arg))
-    for key, value in sorted(kwargs.items()):
-        hasher.update(pickle.dumps((key, value)))
-    return hasher.hexdigest()
-
-def fetch_amenities(region_idx, region_polygon, tags, cache_dir=AMTS_DENS_CACHE_DIR):
-    """ Fetch amenities for a single region. Utilize caching to avoid redundant API calls. """
-    cache_key = f"region_{region_idx}_{_hash(tags=tags)}.npy"
-    cache_path = os.path.join(cache_dir, cache_key)
-    
-    if os.path.exists(cache_path):
-        # Fetch from cache
-        with open(cache_path, 'rb') as f:
-            amenities_count = pickle.load(f)
-        return amenities_count
-    else:
+import pandas as pd
+
+def fetch_amenities(region_idx, region_polygon, tags, cache=None, client=None):
+    """ Fetch amenities for a single region. Utilize caching (keyed by the region's geometry) to avoid redundant API calls. """
+    cache = cache if cache is not None else AmenityCache()
+    client = client if client is not None else OSMClient()
+    cache_key = cache.key('total', region_polygon, tags, _source_key())
+    amenities_count = cache.get(cache_key)
+
+    if amenities_count is None:
         # Calculate from OSM
         try:
-            amenities = ox.features_from_polygon(region_polygon, tags=tags)
-            amenities_count = len(amenities)
-            # Save to cache
-            with open(cache_path, 'wb') as f:
-                pickle.dump(amenities_count, f)
-        except:
-            amenities_count = 0
+            amenities_count = len(client.features_from_polygon(region_polygon, tags))
+        except ox._errors.InsufficientResponseError:
+            amenities_count = 0  # Query succeeded, but no amenities match in this region
+        except Exception as e:
+            raise RuntimeError(f"Amenity query failed for region {region_idx}; not recording 0 amenities.") from e
+        # Save to cache
+        cache.put(cache_key, amenities_count)
     
     return amenities_count
 
-def compute_amts_dens(gdf, tags):
-    
-    amts_dens = np.zeros(len(gdf))
-    amenities_counts = np.zeros(len(gdf))
-    areas_sqkm = gdf['Sqkm'].values
-    region_names = gdf['Simulation_Name'].values
+# ==================
+# BULK AMENITY FETCH
+# ==================
+# One OSM query for the union of all regions, then a single spatial join (STRtree index)
+# assigns every feature to the regions it intersects - the same features a per-region
+# query would return, for one Overpass round trip instead of one per region.
+
+def fetch_amenity_features(polygon, tags, client=None):
+    """ Fetch all amenity features inside 'polygon' with one query (the resulting counts are cached per region) """
+    client = client if client is not None else OSMClient()
+    # Calculate from OSM - keep only the geometry and the filtered tag columns
+    try:
+        features = client.features_from_polygon(polygon, tags)
+    except ox._errors.InsufficientResponseError:
+        features = gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")  # Query succeeded, but no amenities match
+    return features[[key for key in tags if key in features.columns] + ['geometry']].reset_index(drop=True)
+
+def tag_matches(features, tags):
+    """ Boolean DataFrame (features x tag keys): whether each feature matches each tag filter """
+    matches = {}
+    for key, values in tags.items():
+        if key not in features.columns:
+            matches[key] = np.zeros(len(features), dtype=bool)
+        elif values is True:
+            matches[key] = features[key].notna().values
+        else:
+            values = [values] if isinstance(values, str) else list(values)
+            matches[key] = features[key].isin(values).values
+    return pd.DataFrame(matches, index=features.index)
+
+def count_amenities(gdf, features, tags):
+    """ Amenity counts per region (GDF row order): one column per tag key, plus 'Total' (features matching any) """
+    regions = gdf[['geometry']].reset_index(drop=True)
+    features = features.to_crs(regions.crs)
+
+    # Feature -> intersecting regions, vectorized against the regions' spatial index
+    joined = gpd.sjoin(features[['geometry']], regions, how='inner', predicate='intersects')
+    matches = tag_matches(features, tags).loc[joined.index]
+    matches['Total'] = True
+    matches['region'] = joined['index_right'].values
+
+    counts = matches.groupby('region').sum().reindex(range(len(regions)), fill_value=0)
+    return counts.astype(int).set_index(gdf.index)
+
+def amenity_count_matrix(gdf, tags, mode=AMENITY_FETCH_MODE, cache=None, client=None):
+    """ (regions x tag keys) amenity counts plus 'Total' (features matching any key), from one pass over the features """
+    cache = cache if cache is not None else AmenityCache()
+    client = client if client is not None else OSMClient()
 
-    print("Fetching amenities per region...")
+    if AMENITY_SOURCE != 'extract' and mode != 'bulk':
+        # Per-region queries only return totals (each region's query is cached by fetch_amenities), run concurrently
+        print("Fetching amenities per region...")
+        totals = client.map(
+            lambda region: fetch_amenities(region[0], region[1], tags, cache, client),
+            enumerate(gdf.geometry), desc="Regions"
+        )
+        cache.report()
+        return pd.DataFrame({'Total': totals}, index=gdf.index)
 
-    # Fetch amenities per region
-    for idx, row in tqdm(gdf.iterrows(), total=len(gdf), desc="Regions"):
-        region_polygon = row['geometry']
-        amenities_count = fetch_amenities(idx, region_polygon, tags)
-        amenities_counts[idx] = amenities_count
-        if areas_sqkm[idx] > 0:
-            amts_dens[idx] = amenities_count / areas_sqkm[idx]
+    # Counts of every region are cached by its geometry - only new or edited regions are counted
+    source = _source_key()
+    cache_keys = [cache.key('counts', geometry, tags, source) for geometry in gdf.geometry]
+    rows = [cache.get(cache_key) for cache_key in cache_keys]
+    missing = [idx for idx, row in enumerate(rows) if row is None]
+
+    if missing:
+        new_regions = gdf.iloc[missing]
+        if AMENITY_SOURCE == 'extract':
+            # Local OSM extract - no network access needed
+            features = load_osm_amenities(OSM_EXTRACT_PATH, tags, bbox=tuple(new_regions.to_crs("EPSG:4326").total_bounds))
         else:
-            amts_dens[idx] = 0  # Avoid division by zero
+            print(f"Fetching amenities for {len(missing)} region(s)...")
+            features = fetch_amenity_features(new_regions.geometry.union_all(), tags, client)
+        new_counts = count_amenities(new_regions, features, tags)
+        for idx, (_, row) in zip(missing, new_counts.iterrows()):
+            rows[idx] = row.to_dict()
+            cache.put(cache_keys[idx], rows[idx])
+
+    cache.report()
+    return pd.DataFrame(rows, index=gdf.index, columns=list(tags) + ['Total']).astype(int)
+
+def _source_key():
+    """ Identifies the amenity source (the extract file's size and modification time, or live OSM) """
+    if AMENITY_SOURCE == 'extract':
+        stat = os.stat(OSM_EXTRACT_PATH)
+        return ('extract', os.path.basename(OSM_EXTRACT_PATH), stat.st_size, stat.st_mtime_ns)
+    return ('overpass',)
+
+def weighted_amts_dens(counts, areas_sqkm, weights=None):
+    """
+    Normalized amenity density of each region from its count matrix.
+
+    Parameters:
+    counts (pandas.DataFrame): Amenity counts per region (see amenity_count_matrix)
+    areas_sqkm (array): Area of each region (square kilometers)
+    weights (dict or array): Weight of each tag key ({key: weight}, missing keys weigh 1, or one weight per
+        non-'Total' column); None counts every amenity once
+
+    Returns:
+    numpy.ndarray: Densities scaled to [0, 1]
+
+    Weights apply to the per-key counts, so a feature matching several tag keys (e.g. both 'amenity' and
+    'building') adds the weight of each of them: weights of all 1 ({}) are NOT the same as None, which
+    counts such a feature once ('Total'). Densities are scaled by their maximum, so only the ratios of
+    the weights matter.
+    """
+    if weights is None:
+        weighted_counts = counts['Total'].values.astype(float)
+    else:
+        keys = [key for key in counts.columns if key != 'Total']
+        if not keys:
+            raise ValueError("Amenity weights need per-tag counts (AMENITY_FETCH_MODE = 'bulk' or AMENITY_SOURCE = 'extract').")
+        if isinstance(weights, dict):
+            weights = [weights.get(key, 1.0) for key in keys]
+        weighted_counts = counts[keys].values @ np.asarray(weights, dtype=float)
+
+    # Density per square kilometer (0 for regions without area)
+    areas_sqkm = np.asarray(areas_sqkm, dtype=float)
+    amts_dens = np.zeros(len(weighted_counts))
+    np.divide(weighted_counts, areas_sqkm, out=amts_dens, where=areas_sqkm > 0)
 
     # Normalize densities
     max_density = amts_dens.max()
     if max_density > 0:
-        amts_dens /= amts_dens.max()
+        amts_dens /= max_density
+    return amts_dens
+
+def compute_amts_dens(gdf, tags, mode=AMENITY_FETCH_MODE, weights=AMENITY_WEIGHTS):
+    
+    areas_sqkm = gdf['Sqkm'].values
+    region_names = gdf['Simulation_Name'].values
+
+    counts = amenity_count_matrix(gdf, tags, mode)
+    amts_dens = weighted_amts_dens(counts, areas_sqkm, weights)
 
     # View Data?
     if viewData:
         output_lines = [
-            f"{name:<40} {area:>12.2f} {amt:>10}" for name, area, amt in zip(region_names, areas_sqkm, amenities_counts)
+            f"{name:<40} {area:>12.2f} {amt:>10}" for name, area, amt in zip(region_names, areas_sqkm, counts['Total'].values)
         ]
         print(f"{'[Region]':<40} {'[Area (sq km)]':>12} {'[# Amenities]':>10}")
         print("\n".join(output_lines))
 
-    return amts_dens
\ No newline at end of file
+    return amts_dens
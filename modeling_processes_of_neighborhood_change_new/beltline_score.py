@@ -1,62 +1,124 @@
 #in_beltline.py
 
-import requests
 import geopandas as gpd
+from osm_client import OSMClient, OSMQueryError
 from config import HIGH_BLSCORE_METERS, LOW_BLSCORE_METERS
 from shapely.geometry import LineString
 from shapely.ops import unary_union
+import numpy as np
+import shapely
 from config import RELATION_IDS
+from helper import BELTLINE_CACHE_DIR
+from pathlib import Path
+import os
+
+BELTLINE_CACHE_VERSION = 1 # Bump when the cached geometry format changes - older files are then ignored
 
 # Fetch all nodes that belong to relations
-def fetch_beltline_nodes(relation_ids=RELATION_IDS):
+def fetch_beltline_ways(relation_ids=RELATION_IDS, client=None):
+    """ GeoDataFrame of the ways (LineStrings) of the given OSM relations """
     # Custom query based on relation_ids
     query = "[out:json][timeout:180];\n(\n"
     for rel_id in relation_ids:
         query += f"  relation({rel_id});\n"
     query += ");\n(._;>;);\nout body geom;"
 
-    try:
-        response = requests.post("http://overpass-api.de/api/interpreter", data={'data': query}) # Query with query through Overpass API
-    except Exception as e:
-        print(f"Error during Overpass 'Beltline relations' query: {e}")
-        return gpd.GeoDataFrame() # Return an empty GDF if query fails
+    # Query through the shared Overpass client (rate limited, retried; raises OSMQueryError if it keeps failing)
+    client = client if client is not None else OSMClient()
+    data = client.query(query)
 
-    data = response.json()
+    # An Overpass 'remark' means the query did not complete (e.g. timed out) - the elements may be partial
+    if data.get('remark'):
+        raise OSMQueryError(f"Beltline query for relations {list(relation_ids)} incomplete: {data['remark']}")
 
     # Build ways[] array
     ways = [elem for elem in data.get('elements', []) if elem['type'] == 'way']
-    
-    if not ways:
-        print("No ways fetched from OSM")
 
     # Create linestring of coordinates of 'node's within 'way's
-    lines = []
+    way_ids, lines = [], []
     for way in ways:
         if 'geometry' in way:
             coords = [(node['lon'], node['lat']) for node in way['geometry']]
+            way_ids.append(way['id'])
             lines.append(LineString(coords))
         else:
             print(f"Way ID {way.get('id', 'unknown')} missing 'geometry'. Skipping.")
 
-    relations_gdf = gpd.GeoDataFrame(geometry=lines, crs="EPSG:4326")
+    if not lines:
+        raise OSMQueryError(f"No ways fetched from OSM for relations {list(relation_ids)}.")
+
+    relations_gdf = gpd.GeoDataFrame({'way_id': way_ids}, geometry=lines, crs="EPSG:4326")
 
     print(f"[BELTLINE GDF] created w/ {len(relations_gdf)} 'ways'.")
-    
-    # Union of geometries in all 'way's in 'relation's
-    beltline_geom = unary_union(relations_gdf['geometry'])
-    
-    return beltline_geom
-    
-def get_beltline_score(polygon, beltline_geom):
-    """ Returns beltline score of a polygon """
-    polygon_centroid = polygon.centroid
-    dist_meters = polygon_centroid.distance(beltline_geom)
-    
-    if dist_meters <= HIGH_BLSCORE_METERS:
-        return 1.0
-    elif dist_meters >= LOW_BLSCORE_METERS:
-        return 0.1
-    else:
-        score =  1.0 - ((dist_meters - HIGH_BLSCORE_METERS) * 0.9 / (LOW_BLSCORE_METERS-HIGH_BLSCORE_METERS))
-        return score
-    
\ No newline at end of file
+    return relations_gdf
+
+# =======================
+# BELTLINE GEOMETRY CACHE
+# =======================
+# The relation ways are persisted as GeoParquet keyed by the relation IDs and a format version,
+# and are only loaded when a consumer needs the geometry - runs on a valid GDF cache do no network I/O.
+
+def beltline_cache_file(relation_ids=RELATION_IDS, cache_dir=BELTLINE_CACHE_DIR):
+    """ Cache file of the given relations' ways """
+    key = "_".join(str(rel_id) for rel_id in sorted(relation_ids))
+    return Path(cache_dir) / f"beltline_{key}_v{BELTLINE_CACHE_VERSION}.parquet"
+
+def load_beltline_geom(relation_ids=RELATION_IDS, cache_dir=BELTLINE_CACHE_DIR, regenerate=False, client=None):
+    """ Beltline geometry from cache, or fetched from OSM and cached for first time (empty results are never cached) """
+    cache_file = beltline_cache_file(relation_ids, cache_dir)
+
+    relations_gdf = None
+    if cache_file.exists() and not regenerate:
+        print("Loading cached Beltline geometry.")
+        relations_gdf = gpd.read_parquet(cache_file)
+        if relations_gdf.empty:
+            print("Cached Beltline geometry is empty - fetching again.")
+            relations_gdf = None
+
+    if relations_gdf is None:
+        relations_gdf = fetch_beltline_ways(relation_ids, client)  # Raises rather than returning no ways
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        relations_gdf.to_parquet(tmp_file)
+        os.replace(tmp_file, cache_file)
+        print(f"Beltline geometry cached to '{cache_file}'.")
+
+    return unary_union(relations_gdf['geometry'])
+
+class LazyBeltline:
+    """ Beltline geometry loaded on first access (see load_beltline_geom) """
+
+    def __init__(self, relation_ids=RELATION_IDS):
+        self.relation_ids = list(relation_ids)
+        self._geom = None
+
+    @property
+    def geom(self):
+        """ The unioned Beltline geometry (loaded once) """
+        if self._geom is None:
+            self._geom = load_beltline_geom(self.relation_ids)
+        return self._geom
+
+def corridor_scores(polygons, corridor_geom, high_meters=HIGH_BLSCORE_METERS, low_meters=LOW_BLSCORE_METERS, min_score=0.1):
+    """
+    Score of each region by its centroid's distance to a corridor (Beltline, transit lines, other investment corridors).
+
+    Parameters:
+    polygons (array-like): Region geometries (meter-based projection)
+    corridor_geom (geometry or array-like): Corridor geometry/geometries, same projection
+    high_meters, low_meters (float): Full score within 'high_meters', 'min_score' beyond 'low_meters', linear between
+
+    Returns:
+    numpy.ndarray: Score of each polygon's centroid
+    """
+    centroids = shapely.centroid(np.asarray(polygons, dtype=object))
+
+    # Distance to the nearest corridor part - STRtree nearest query instead of distances to the full union
+    parts = shapely.get_parts(np.atleast_1d(np.asarray(corridor_geom, dtype=object)))
+    distances = np.full(len(centroids), np.inf)
+    if len(parts):
+        (inputs, _), nearest = shapely.STRtree(parts).query_nearest(centroids, return_distance=True, all_matches=False)
+        distances[inputs] = nearest
+
+    # Linear ramp from 1 (at high_meters) down to min_score (at low_meters)
+    scores = 1.0 - (distances - high_meters) * (1.0 - min_score) / (low_meters - high_meters)
+    return np.clip(scores, min_score, 1.0)
@@ -1,52 +1,67 @@
 # calibration.py
 
-from simulation import run_single_simulation_calibration
+from simulation import SimulationManager, run_shared_simulation
+from route_index import RouteIndex, compile_routes
+from amtdens import weighted_amts_dens
+from shared_inputs import open_shared
 from config import CTY_KEY, NUM_AGENTS, T_MAX_RANGE, viewData
-from helper import FIGURE_PKL_CACHE_DIR
+from helper import SNAPSHOT_CACHE_DIR
+from snapshot import load_snapshot
 from pymoo.core.problem import Problem
 from pymoo.core.repair import Repair
 from joblib import Parallel, delayed
 import numpy as np
-import pickle
 
 class Calibration(Problem):
     def __init__(
         self, 
         geo_id_to_income,
         centroids,
-        g,
+        centroid_nodes,
         amts_dens,
         centroid_distances,
         assigned_routes,
         endowments,
-        n_jobs=-1
+        n_jobs=-1,
+        amenity_counts=None,
+        areas_sqkm=None
         ):
-        # n_var=2 [Rho, Alpha]
+        # n_var=2 [Rho, Alpha] (+ one weight in [0.05, 20] per amenity tag key but the first if 'amenity_counts' is given)
         # n_obj=1 # one objective: minimize income difference
-        # xl and xu -> lower and upper bounds for each of the 2 variables
+        # xl and xu -> lower and upper bounds for each variable
+        num_keys = 0 if amenity_counts is None else len([key for key in amenity_counts.columns if key != 'Total'])
+        if amenity_counts is not None and num_keys == 0:
+            raise ValueError("Amenity weight calibration needs per-tag counts "
+                             "(AMENITY_FETCH_MODE = 'bulk' or AMENITY_SOURCE = 'extract').")
+        num_weights = max(num_keys - 1, 0)  # The first key's weight is fixed (see amenity_weights)
         super().__init__(
-            n_var=2, 
+            n_var=2 + num_weights, 
             n_obj=1, 
             n_constr=0,
-            xl=np.array([8, 0.1]),
-            xu=np.array([32, 0.9])
+            xl=np.array([8, 0.1] + [0.05] * num_weights),
+            xu=np.array([32, 0.9] + [20.0] * num_weights)
             )
         
         self.geo_id_to_income = geo_id_to_income
         self.centroids = centroids
-        self.g = g
-        self.amts_dens = amts_dens
-        self.centroid_distances = centroid_distances
-        self.assigned_routes = assigned_routes
         self.endowments = endowments
         self.n_jobs = n_jobs
 
+        # Amenity weights are searched without extra I/O: densities are re-weighted from the cached counts
+        self.amenity_counts = amenity_counts
+        self.areas_sqkm = areas_sqkm
+
+        # Large inputs are memory-mapped by workers - dense matrices are never pickled
+        manager = SimulationManager(centroids, centroid_nodes, amts_dens, centroid_distances)
+        route_index = compile_routes(assigned_routes, centroids)
+        self.shared_inputs = manager.share_inputs(route_index)
+
     def _evaluate(self, X, out, *args, **kwargs):
         # X is a 2D array of shape (population_size, 2)
         # We need to evaluate the objective for each row in X.
         
         results = Parallel(n_jobs=self.n_jobs)(
-            delayed(self.get_error)(X[i, 0], X[i, 1], self.geo_id_to_income)
+            delayed(self.get_error)(X[i, 0], X[i, 1], self.geo_id_to_income, amenity_weights(X[i, 2:]) if X.shape[1] > 2 else None)
             for i in range(len(X))
         )
         
@@ -57,31 +72,33 @@ class Calibration(Problem):
         
         out["F"] = np.array(tot_diffs).reshape(-1,1)
     
-    def get_error(self, rho, alpha, geo_id_to_income):
+    def get_error(self, rho, alpha, geo_id_to_income, amenity_weights=None):
         """ Return the total difference between the simulated and expected incomes of each region """
-        figkey = f"{CTY_KEY}_{rho}_{alpha}_{NUM_AGENTS}_{T_MAX_RANGE}"
-        pickle_path = FIGURE_PKL_CACHE_DIR / f"{figkey}.pkl"
-
-        # Check existence
-        if not pickle_path.exists():
-            _ = run_single_simulation_calibration(
-                    rho=rho,
-                    alpha=alpha,
-                    centroids=self.centroids,
-                    g=self.g,
-                    amts_dens=self.amts_dens,
-                    centroid_distances=self.centroid_distances,
-                    assigned_routes=self.assigned_routes,
-                    endowments=self.endowments,
-                    geo_id_to_income=self.geo_id_to_income
-                )
-
-        # Access city object
-        with open(pickle_path, 'rb') as file:
-            city = pickle.load(file)
-
-        # Fetch data
-        df_data = city.get_data()
+        if amenity_weights is not None:
+            # Weighted densities differ per candidate - simulate in memory instead of sharing (rho, alpha) snapshots
+            amts_dens = weighted_amts_dens(self.amenity_counts, self.areas_sqkm, amenity_weights)
+            df_data = run_weighted_simulation(self.shared_inputs, self.centroids, rho, alpha, amts_dens,
+                                              self.endowments, self.geo_id_to_income)
+        else:
+            figkey = f"{CTY_KEY}_{rho}_{alpha}_{NUM_AGENTS}_{T_MAX_RANGE}"
+            snapshot_path = SNAPSHOT_CACHE_DIR / f"{figkey}.npz"
+
+            # Check existence
+            if not snapshot_path.exists():
+                run_shared_simulation(
+                        shared_inputs=self.shared_inputs,
+                        centroids=self.centroids,
+                        rho=rho,
+                        alpha=alpha,
+                        endowments=self.endowments,
+                        geo_id_to_income=self.geo_id_to_income
+                    )
+
+            # Access city state
+            city = load_snapshot(snapshot_path)
+
+            # Fetch data
+            df_data = city.get_data()
         df_data.set_index('Simulation_ID', inplace=True)
         
         # Use only geoid's existing in geo_id_to_income, & keep relevant columns
@@ -109,12 +126,34 @@ class Calibration(Problem):
 
         return tot_difference
 
+def amenity_weights(calibrated_weights):
+    """
+    Weights of all amenity tag keys from the calibrated ones: the first key's weight is fixed at 1.
+
+    Densities are divided by their maximum, so scaling every weight by the same factor gives the same
+    densities - only the weights relative to the first key are identifiable (and calibrated).
+    """
+    return np.concatenate([[1.0], calibrated_weights])
+
+def run_weighted_simulation(shared_inputs, centroids, rho, alpha, amts_dens, endowments, geo_id_to_income):
+    """ One simulation with the given amenity densities (shared inputs otherwise); returns the final centroid data """
+    arrays = open_shared(shared_inputs)
+    manager = SimulationManager(centroids, arrays['node_array'], amts_dens, arrays['centroid_distances'])
+    route_index = RouteIndex(arrays['route_indptr'], arrays['route_destinations'], arrays['route_volumes'],
+                             len(centroids))
+
+    # Same seed as run_single_simulation, so candidates differ only by their amenity weights
+    np.random.seed(int(rho * 1000 + alpha * 100))
+    city = manager.simulate(rho, alpha, route_index, endowments, geo_id_to_income, lambda city, timestep: None)
+    return city.get_data()
+
 class MyRepair(Repair):
     """ Manually choose how to round Rho and Alpha parameters """
 
     def _do(self, problem, X, **kwargs):
         X[:, 0] = np.round(X[:, 0]).astype(int)     # Rho -> nearest integer
         X[:, 1] = np.round(X[:, 1], 2)  # Alpha -> hundredth place
+        X[:, 2:] = np.round(X[:, 2:], 2)  # Amenity weights (if calibrated) -> hundredth place
         return X
 
 #NOTE: Regions with 0 population have simulated_income of 0
\ No newline at end of file
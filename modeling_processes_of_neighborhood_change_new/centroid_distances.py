@@ -1,72 +1,109 @@
 #centroid_distances.py
 
-from config import N_JOBS
-from helper import CENTROID_DIST_CACHE_DIR
+from config import REGION_SAMPLE_K, REGION_DISTANCE_AGGREGATE, TRANSIT_SPEED_KPH, TRANSIT_PENALTY_MINUTES, CAR_FALLBACK_SPEED_KPH
+from helper import CENTROID_DIST_CACHE_DIR, cache_hash
+from graph_handler import compile_graph
+from joblib import Parallel, delayed
 import os
 import osmnx as ox
-import networkx as nx
+import geopandas as gpd
+import pandas as pd
+from pathlib import Path
 import numpy as np
-from joblib import Parallel, delayed
-import hashlib
-import pickle
-
-def _hash(*args, **kwargs):
-    """ Hash function """
-    hasher = hashlib.md5()
-    for arg in args:
-        hasher.update(pickle.dumps(arg))
-    for key, value in sorted(kwargs.items()):
-        hasher.update(pickle.dumps((key, value)))
-    return hasher.hexdigest()
-
-def cached_centroid_distances(centroids, g, cache_dir=CENTROID_DIST_CACHE_DIR):
-    """ Retrieve DISTANCES from cache or calculate for first time """
-    # Create a unique hash for the current inputs
+from scipy.spatial import cKDTree
+import time
+import warnings
+
+def nearest_graph_nodes(g, lons, lats):
+    """ Nearest graph node of each point - one vectorized KD-tree query for all points """
+    nodes = np.array(list(g.nodes))
+    xs = np.array([g.nodes[node]['x'] for node in nodes], dtype=float)
+    ys = np.array([g.nodes[node]['y'] for node in nodes], dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+
+    if ox.projection.is_projected(g.graph.get('crs')):
+        # Planar coordinates - Euclidean nearest neighbour
+        tree = cKDTree(np.column_stack([xs, ys]))
+        _, idx = tree.query(np.column_stack([lons, lats]))
+    else:
+        # Degrees - nearest chord between unit vectors is the nearest great-circle distance
+        tree = cKDTree(_unit_vectors(xs, ys))
+        _, idx = tree.query(_unit_vectors(lons, lats))
+    return nodes[idx]
+
+def _unit_vectors(lons, lats):
+    """ Longitude/latitude (degrees) -> 3D points on the unit sphere """
+    lons, lats = np.radians(lons), np.radians(lats)
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+def cached_centroid_nodes(centroids, g, cache_dir=CENTROID_DIST_CACHE_DIR, compiled_graph=None):
+    """ Retrieve centroid -> nearest graph node mapping from cache or calculate for first time """
+    if compiled_graph is None:
+        compiled_graph = compile_graph(g)
+    # Keyed by the graph too - a regenerated graph may have different nodes near the same centroids
     centroids_coords = [(c[0], c[1]) for c in centroids]
-    cache_key = f"centroid_distances_{_hash(*centroids_coords)}.npy"
+    cache_key = f"centroid_nodes_{cache_hash(compiled_graph.fingerprint(), *centroids_coords)}.npy"
     cache_path = os.path.join(cache_dir, cache_key)
-    
-    print(f"Number of centroids: {len(centroids)}")
 
     if os.path.exists(cache_path):
-        print("Loading cached centroid distances.")
-        distance_matrix = np.load(cache_path)
+        print("Loading cached centroid nodes.")
+        centroid_nodes = np.load(cache_path)
     else:
-        distance_matrix = compute_centroid_distances(centroids, g)
-        np.save(cache_path, distance_matrix)
-        print(f"Centroid distances cached.")
-    
-    return distance_matrix
+        centroid_nodes = nearest_graph_nodes(g, [c[0] for c in centroids], [c[1] for c in centroids])
+        np.save(cache_path, centroid_nodes)
+        print("Centroid nodes cached.")
+
+    return centroid_nodes
+
+def cached_centroid_distances(centroids, g, cache_dir=CENTROID_DIST_CACHE_DIR, compiled_graph=None):
+    """ Retrieve DISTANCES from the per-source row cache, computing only rows of new centroid nodes """
+    print(f"Number of centroids: {len(centroids)}")
+
+    if compiled_graph is None:
+        compiled_graph = compile_graph(g)
+    centroid_nodes = cached_centroid_nodes(centroids, g, cache_dir, compiled_graph=compiled_graph)
+
+    distance_matrix = cached_distance_rows(compiled_graph, centroid_nodes, cache_dir)
+    return normalize_distances(distance_matrix)
+
+def cached_distance_rows(compiled_graph, nodes, cache_dir=CENTROID_DIST_CACHE_DIR, chunk_size=64):
+    """
+    (len(nodes) x len(nodes)) network distances between graph nodes, assembled from cached rows.
+
+    Each row holds the distances from one source node to every graph node (float32), keyed by
+    (graph fingerprint, source node) - so a new centroid only costs its own row, and its column
+    is read from the rows that already exist.
+    """
+    row_dir = Path(cache_dir) / f"rows_{compiled_graph.fingerprint()}"
+    os.makedirs(row_dir, exist_ok=True)
+
+    nodes = np.asarray(nodes)
+    node_indices = compiled_graph.node_indices(nodes)
+    row_paths = [row_dir / f"{node}.npy" for node in nodes.tolist()]
+
+    # Compute missing rows only, a batch of sources at a time
+    missing = sorted({idx for idx, path in zip(node_indices.tolist(), row_paths) if not path.exists()})
+    if missing:
+        print(f"Computing distances from {len(missing)} new centroid node(s); {len(set(row_paths)) - len(missing)} cached.")
+    else:
+        print("Loading cached centroid distances.")
+    for start in range(0, len(missing), chunk_size):
+        sources = missing[start:start + chunk_size]
+        rows = compiled_graph.distances(sources).astype(np.float32)
+        for source, row in zip(sources, rows):
+            path = row_dir / f"{compiled_graph.nodes[source]}.npy"
+            tmp_path = row_dir / f"{path.stem}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, row)
+            os.replace(tmp_path, path)
+
+    # Assemble: memory-map each row and pick the centroid columns
+    return np.vstack([np.load(path, mmap_mode='r')[node_indices] for path in row_paths]).astype(float)
+
+def normalize_distances(distance_matrix):
+    """ Replace disconnected (inf) distances by the largest finite one and scale to [0, 1] """
+    distance_matrix = np.array(distance_matrix, dtype=float)
 
-def compute_centroid_distances(centroids, g):
-    """ Perform calculations for centroid distances with multiprocessing"""
-    print("Computing...")
-    # Number of centroids
-    n = len(centroids)
-    
-    # Map centroids to nearest node
-    centroid_nodes = [ox.nearest_nodes(g, c[0], c[1]) for c in centroids]
-    
-    # Initialize distance matrix
-    distance_matrix = np.zeros((n, n))
-    
-    def compute_distances_from_source(i):
-        source_node = centroid_nodes[i]
-        lengths = nx.single_source_dijkstra_path_length(g, source_node, weight='length')
-        distances = []
-        for j in range(n):
-            target_node = centroid_nodes[j]
-            distance = lengths.get(target_node, np.inf) # np.inf for disconnected centroids
-            distances.append(distance)
-        return distances
-    
-    # Parallel computation of distances
-    distances_list = Parallel(n_jobs=N_JOBS, backend='loky')(
-        delayed(compute_distances_from_source)(i) for i in range(n)
-    )
-    
-    distance_matrix = np.array(distances_list)
-    
     # Handle disconnected centroids by setting them to the maximum finite distance
     if np.isinf(distance_matrix).any():
         finite_max = np.max(distance_matrix[np.isfinite(distance_matrix)])
@@ -77,3 +114,190 @@ def compute_centroid_distances(centroids, g):
         distance_matrix /= distance_matrix.max()
     
     return distance_matrix
+
+# ====================
+# TRAVEL TIMES BY MODE
+# ====================
+# Car: shortest travel time on the road network (OSMnx speeds from highway tags / maxspeed).
+# Transit: shortest road distance at TRANSIT_SPEED_KPH plus a fixed access/wait penalty per trip.
+# Both are stacked as (modes x centroids x centroids) float32 in MODE_NAMES order and normalized
+# by their common maximum, so transit stays costlier than car for the same trip.
+
+def cached_travel_times(centroids, g, compiled_graph=None, cache_dir=CENTROID_DIST_CACHE_DIR):
+    """ Retrieve stacked car/transit TRAVEL TIMES from cache or calculate for first time """
+    if compiled_graph is None:
+        compiled_graph = compile_graph(g)
+    centroid_nodes = cached_centroid_nodes(centroids, g, cache_dir, compiled_graph=compiled_graph)
+
+    # Car speeds derive from the graph's edge tags, so the road graph's fingerprint covers them
+    cache_key = f"travel_times_{cache_hash(compiled_graph.fingerprint(), tuple(centroid_nodes.tolist()), TRANSIT_SPEED_KPH, TRANSIT_PENALTY_MINUTES, CAR_FALLBACK_SPEED_KPH)}.npy"
+    cache_path = os.path.join(cache_dir, cache_key)
+
+    if os.path.exists(cache_path):
+        print("Loading cached travel times.")
+        return np.load(cache_path)
+
+    car_graph = compile_graph(_with_travel_times(g), weight='travel_time')
+
+    # Rows of both graphs go through the per-source row cache (keyed by each graph's fingerprint)
+    car_times = cached_distance_rows(car_graph, centroid_nodes, cache_dir)
+    transit_times = cached_distance_rows(compiled_graph, centroid_nodes, cache_dir) / (TRANSIT_SPEED_KPH / 3.6)
+    transit_times += TRANSIT_PENALTY_MINUTES * 60
+    np.fill_diagonal(transit_times, 0.0)
+
+    travel_times = normalize_distances(np.stack([car_times, transit_times])).astype(np.float32)
+    np.save(cache_path, travel_times)
+    print("Travel times cached.")
+    return travel_times
+
+def _with_travel_times(g):
+    """ Graph with 'travel_time' (seconds) on every edge - added by OSMnx to a copy where missing """
+    if all('travel_time' in data for _, _, data in g.edges(data=True)):
+        return g
+    g = ox.add_edge_speeds(g.copy(), fallback=CAR_FALLBACK_SPEED_KPH)  # OSMnx edits in place; leave the caller's graph as is
+    return ox.add_edge_travel_times(g)
+
+# =========================
+# REGION-TO-REGION DISTANCE
+# =========================
+# Instead of one node per region (nearest to the centroid), every region is represented by up to
+# k graph nodes inside its polygon (all of them for small regions, a seeded uniform sample for
+# large ones). One Dijkstra per sampled node gives an (S x S) sample distance matrix, S <= k * regions,
+# which is reduced to (regions x regions) by the mean or median over each block of sample pairs.
+# Cost is S shortest-path trees instead of one per graph node.
+
+def region_sample_nodes(gdf, g, k=REGION_SAMPLE_K, seed=0):
+    """ Up to k graph nodes inside each region of the GDF (row order); the nearest node to the centroid if none """
+    nodes = np.array(list(g.nodes))
+    points = gpd.GeoDataFrame(
+        {'node': nodes},
+        geometry=gpd.points_from_xy([g.nodes[node]['x'] for node in nodes], [g.nodes[node]['y'] for node in nodes]),
+        crs=g.graph.get('crs'),
+    ).to_crs(gdf.crs)
+
+    # Graph nodes per region (one spatial join for all regions)
+    regions = gdf[['geometry']].reset_index(drop=True)
+    joined = gpd.sjoin(points, regions, how='inner', predicate='within')
+    members = joined.groupby('index_right')['node'].apply(np.array)
+
+    # Regions too small to contain a node fall back to the node nearest a point inside them
+    empty = [idx for idx in range(len(regions)) if idx not in members.index]
+    fallback = {}
+    if empty:
+        inside = regions.geometry.iloc[empty].representative_point().to_crs(g.graph.get('crs'))
+        fallback = dict(zip(empty, nearest_graph_nodes(g, inside.x.values, inside.y.values)))
+
+    rng = np.random.default_rng(seed)
+    samples = []
+    for idx in range(len(regions)):
+        if idx in fallback:
+            samples.append(np.array([fallback[idx]]))
+        elif len(members[idx]) <= k:
+            samples.append(np.sort(members[idx]))
+        else:
+            samples.append(np.sort(rng.choice(members[idx], k, replace=False)))
+    return samples
+
+def compute_region_distances(compiled_graph, samples, aggregate=REGION_DISTANCE_AGGREGATE, chunk_size=64, n_jobs=1):
+    """
+    (regions x regions) network distance aggregated over the sampled nodes of each region pair.
+
+    Parameters:
+    compiled_graph (CompiledGraph): Road graph
+    samples (list): Sampled graph node ids of each region
+    aggregate (str): 'mean' or 'median' over the sample pairs of two regions (unreachable pairs ignored)
+    chunk_size (int): Sources per Dijkstra call
+    n_jobs (int): Number of processes running chunks of sources in parallel
+
+    Returns:
+    numpy.ndarray: Aggregated (unnormalized) distances, 0 on the diagonal
+    """
+    sample_nodes = np.concatenate(samples)
+    sample_indices = compiled_graph.node_indices(sample_nodes)
+    unique_indices, inverse = np.unique(sample_indices, return_inverse=True)
+
+    # Distances between the unique sampled nodes, one chunk of sources per task
+    chunks = [unique_indices[start:start + chunk_size] for start in range(0, len(unique_indices), chunk_size)]
+    if n_jobs == 1:
+        blocks = [_sample_distances(compiled_graph, chunk, unique_indices) for chunk in chunks]
+    else:
+        blocks = Parallel(n_jobs=n_jobs, backend='loky')(
+            delayed(_sample_distances)(compiled_graph, chunk, unique_indices) for chunk in chunks
+        )
+    sample_distances = np.vstack(blocks)[np.ix_(inverse, inverse)]
+    sample_distances[~np.isfinite(sample_distances)] = np.nan
+
+    counts = np.array([len(sample) for sample in samples])
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    if aggregate == 'mean':
+        # Block sums via two reductions, divided by the number of reachable pairs per block
+        reachable = ~np.isnan(sample_distances)
+        sums = np.add.reduceat(np.add.reduceat(np.nan_to_num(sample_distances), starts, axis=0), starts, axis=1)
+        pairs = np.add.reduceat(np.add.reduceat(reachable.astype(float), starts, axis=0), starts, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distance_matrix = np.where(pairs > 0, sums / pairs, np.inf)
+    elif aggregate == 'median':
+        # Columns padded per region (padding points at an all-NaN column): one nanmedian per row region
+        padded = np.hstack([sample_distances, np.full((len(sample_distances), 1), np.nan)])
+        slots = np.arange(counts.max())
+        columns = np.where(slots < counts[:, None], starts[:, None] + slots, padded.shape[1] - 1)
+        distance_matrix = np.empty((len(samples), len(samples)))
+        for i, (row_start, count) in enumerate(zip(starts, counts)):
+            blocks = padded[row_start:row_start + count][:, columns]  # (rows, regions, slots)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN blocks: unreachable region pairs
+                distance_matrix[i] = np.nanmedian(blocks.transpose(1, 0, 2).reshape(len(samples), -1), axis=1)
+        distance_matrix[np.isnan(distance_matrix)] = np.inf
+    else:
+        raise ValueError(f"Unknown aggregate '{aggregate}' (expected 'mean' or 'median').")
+
+    # A region is at distance 0 from itself, as in the single-node distances
+    np.fill_diagonal(distance_matrix, 0.0)
+    return distance_matrix
+
+def _sample_distances(compiled_graph, sources, targets):
+    """ Distances from a chunk of source node indices to the target node indices """
+    return compiled_graph.distances(sources)[:, targets]
+
+def cached_region_distances(gdf, g, compiled_graph=None, k=REGION_SAMPLE_K, aggregate=REGION_DISTANCE_AGGREGATE,
+                            cache_dir=CENTROID_DIST_CACHE_DIR, n_jobs=1):
+    """ Retrieve normalized region-to-region DISTANCES from cache or calculate for first time """
+    if compiled_graph is None:
+        compiled_graph = compile_graph(g)
+    samples = region_sample_nodes(gdf, g, k)
+    print(f"Number of regions: {len(samples)} ({sum(len(sample) for sample in samples)} sampled nodes, k={k})")
+
+    cache_key = f"region_distances_{cache_hash(compiled_graph.fingerprint(), aggregate, *[tuple(s.tolist()) for s in samples])}.npy"
+    cache_path = os.path.join(cache_dir, cache_key)
+
+    if os.path.exists(cache_path):
+        print("Loading cached region distances.")
+        distance_matrix = np.load(cache_path)
+    else:
+        print("Computing...")
+        distance_matrix = compute_region_distances(compiled_graph, samples, aggregate, n_jobs=n_jobs)
+        np.save(cache_path, distance_matrix)
+        print("Region distances cached.")
+
+    return normalize_distances(distance_matrix)
+
+def benchmark_region_distances(gdf, g, compiled_graph=None, ks=(1, 2, 4, 8, 16, 32), aggregate=REGION_DISTANCE_AGGREGATE,
+                               n_jobs=1):
+    """ Runtime (and deviation from the largest k) of region distances for each sample size k - uncached """
+    if compiled_graph is None:
+        compiled_graph = compile_graph(g)
+
+    results, matrices = [], {}
+    for k in sorted(ks):
+        start_time = time.time()
+        samples = region_sample_nodes(gdf, g, k)
+        matrices[k] = normalize_distances(compute_region_distances(compiled_graph, samples, aggregate, n_jobs=n_jobs))
+        elapsed = time.time() - start_time
+        results.append({'k': k, 'Sampled Nodes': sum(len(sample) for sample in samples), 'Seconds': elapsed})
+        print(f"k={k}: {results[-1]['Sampled Nodes']} sampled nodes [{elapsed:.2f} s]")
+
+    # Convergence of the estimate: mean absolute difference to the largest k
+    reference = matrices[max(ks)]
+    for result in results:
+        result['Mean Abs Diff'] = float(np.abs(matrices[result['k']] - reference).mean())
+    return pd.DataFrame(results)
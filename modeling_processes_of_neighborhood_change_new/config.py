@@ -8,15 +8,47 @@ NUM_AGENTS = 1000 # Number of agents
 HIGH_BLSCORE_METERS = 1000
 LOW_BLSCORE_METERS = 5000
 BENCHMARK_INTERVALS = 500 # Intervals (# timesteps) to capture frames of GIF
+HISTORY_STRIDE = 1 # Record centroid population/community history every N timesteps
+SNAPSHOT_PROBABILITIES = True # Include agents' average probabilities (agents x centroids, float32) in snapshots
+SHARED_INPUTS_MAX_MB = 4096 # Size bound of the memory-mapped worker inputs (cache/shared); least recently used files are deleted beyond it
 
 EPSILON = 1e-3 # Rate of learning
 
+INCREMENTAL_CITY_UPDATE = True # Recompute only centroids that agents entered or left each timestep
+AGENT_ENGINE = 'object' # 'object' (one Agent instance per agent) or 'vectorized' (NumPy arrays for all agents; scales to 100k+ agents)
+
+ENSEMBLE_REPLICATES = 100 # Independent replicates per (rho, alpha) in ensemble mode
+ENSEMBLE_SEED = 0 # Root seed of the ensemble; every replicate gets its own spawned RNG stream
+
+CONVERGENCE_STOP = False # Stop a run early once populations, community scores and agent probabilities stabilise
+CONVERGENCE_WINDOW = 1000 # Timesteps per window; consecutive window averages are compared
+CONVERGENCE_TOLERANCE = 0.02 # Max change between windows (population fraction relocated, community score, probability drift)
+CONVERGENCE_CHECK_INTERVAL = 10 # Timesteps between samples of the state
+
+TRAFFIC_ASSIGNMENT_METHOD = 'conjugate-frank-wolfe' # 'frank-wolfe', 'conjugate-frank-wolfe' or 'msa' (method of successive averages)
+TRAFFIC_MAX_ITERATIONS = 50 # Max equilibrium iterations
+TRAFFIC_GAP_TOLERANCE = 1e-4 # Stop once the relative gap falls below this value
+
+CENTROID_DISTANCE_MODE = 'centroid' # 'centroid' (node nearest each centroid) or 'region' (aggregate over sampled nodes of each region)
+REGION_SAMPLE_K = 16 # Max graph nodes sampled per region in 'region' mode (all nodes if fewer)
+REGION_DISTANCE_AGGREGATE = 'mean' # 'mean' or 'median' over sampled node pairs of two regions
+BENCHMARK_REGION_DISTANCES = False # Print runtime vs. k of region distances ('region' mode) before the run?
+
+TRAVEL_COST_MODE = 'distance' # 'distance' (one length matrix, transit x TRANSIT_COST_FACTOR) or 'travel_time' (car/transit travel-time matrices; 'centroid' distance mode only)
+TRANSIT_COST_FACTOR = 1.5 # Transit cost multiplier in 'distance' mode
+TRANSIT_SPEED_KPH = 20 # Average transit speed along the road network in 'travel_time' mode
+TRANSIT_PENALTY_MINUTES = 10 # Fixed access/wait time added to every transit trip in 'travel_time' mode
+CAR_FALLBACK_SPEED_KPH = 40 # Car speed of roads whose OSM highway type has no known speed
+
 "-----------------------------------------------------------------------------------------------------------------------"
 """ Misc. Settings """
 
 """ Flags """
 RUN_EXPERIMENTS = True  # RUN SIMULATION?
 RUN_CALIBRATION = False # RUN CALIBRATION?
+CALIBRATE_AMENITY_WEIGHTS = False # Also calibrate one weight per AMENITY_TAGS key? (requires per-tag amenity counts)
+RUN_ENSEMBLE = False    # RUN REPLICATED-SEED ENSEMBLE? (per-centroid mean/variance over replicates)
+RUN_TRAFFIC_ASSIGNMENT = False # RUN CAPACITY-CONSTRAINED TRAFFIC ASSIGNMENT? (car link flows)
 PLOT_CITIES = True      # PLOT SIMULATION?
 PLOT_FOLIUM = False        # Create Folium graph of t_max?
 viewData = False        # View GDF info + more?
@@ -113,4 +145,17 @@ AMENITY_TAGS = {
     'tourism': ['museum', 'hotel'],
     'building': ['apartments', 'house', 'service'],
     'landuse': ['residential', 'industrial']
-}
\ No newline at end of file
+}
+AMENITY_FETCH_MODE = 'bulk' # 'bulk' (one OSM query for all regions + spatial join) or 'per_region' (one OSM query per region)
+AMENITY_SOURCE = 'overpass' # 'overpass' (live OSM queries) or 'extract' (local OSM file at OSM_EXTRACT_PATH - works offline)
+OSM_EXTRACT_PATH = 'map.osm' # Local .osm / .osm.bz2 / .osm.gz / .osm.pbf extract covering all regions (.pbf requires pyosmium)
+AMENITY_WEIGHTS = None # Weight per AMENITY_TAGS key in amenity density, e.g. {'amenity': 2.0, 'building': 0.5} (missing keys weigh 1, only ratios matter); None counts every amenity once, weights add up for amenities matching several keys
+AMENITY_CACHE_MAX_MB = 512 # Size bound of the amenity cache; least recently used entries are evicted beyond it
+
+""" OSM query client (Overpass) """
+OVERPASS_URL = 'https://overpass-api.de/api' # Overpass API base URL (a local Overpass instance works too)
+OSM_MAX_WORKERS = 2 # Concurrent Overpass queries
+OSM_REQUESTS_PER_SECOND = 1.0 # Max request rate per endpoint
+OSM_MAX_RETRIES = 5 # Retries of connection errors, timeouts and 429/5xx responses
+OSM_BACKOFF_SECONDS = 2.0 # First retry delay; doubles with every retry (unless the server sends Retry-After)
+OSM_TIMEOUT = 180 # Seconds per request
\ No newline at end of file
@@ -0,0 +1,64 @@
+# convergence.py
+
+from config import CONVERGENCE_WINDOW, CONVERGENCE_TOLERANCE, CONVERGENCE_CHECK_INTERVAL
+import numpy as np
+
+# ====================
+# CONVERGENCE DETECTOR
+# ====================
+# Agents re-draw their location every timestep, so populations keep fluctuating around a
+# steady state and never stop changing outright. Populations and community scores are
+# therefore averaged over consecutive windows (sampled every 'check_interval' timesteps), and
+# a run has converged once two consecutive windows differ by no more than 'tolerance' on:
+#   - population: fraction of agents that would have to relocate to turn one window-mean into the other
+#   - community:  largest change of any centroid's window-mean community score
+#   - drift:      mean total-variation distance between agents' location probabilities at the window ends
+
+
+class ConvergenceMonitor:
+    """ Sliding-window early-stopping test on centroid populations, community scores and agent probabilities """
+
+    def __init__(self, window=CONVERGENCE_WINDOW, tolerance=CONVERGENCE_TOLERANCE, check_interval=CONVERGENCE_CHECK_INTERVAL):
+        self.tolerance = tolerance
+        self.check_interval = max(int(check_interval), 1)
+        self.window = max(int(window) // self.check_interval, 1) * self.check_interval
+
+        self.num_samples = 0
+        self.pop_sum = 0.0  # Sums of the samples in the current window
+        self.cmt_sum = 0.0
+        self.previous = None  # (mean pop, mean cmt, probabilities) of the previous window
+        self.converged_at = None  # Timestep at which convergence was detected
+        self.changes = None  # (population, community, drift) changes at the last window end
+
+    def due(self, timestep):
+        """ Whether the state should be sampled at this timestep """
+        return timestep % self.check_interval == 0
+
+    def window_end(self, timestep):
+        """ Whether this timestep closes a window (agent probabilities are only needed then) """
+        return timestep % self.window == 0
+
+    def update(self, timestep, pop, cmt, probabilities=None):
+        """ Sample the state; returns True once two consecutive windows differ by less than 'tolerance' """
+        self.pop_sum = self.pop_sum + np.asarray(pop, dtype=float)
+        self.cmt_sum = self.cmt_sum + np.asarray(cmt, dtype=float)
+        self.num_samples += 1
+        if not self.window_end(timestep):
+            return False
+
+        current = (self.pop_sum / self.num_samples, self.cmt_sum / self.num_samples, np.array(probabilities, dtype=float))
+        self.pop_sum, self.cmt_sum, self.num_samples = 0.0, 0.0, 0
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return False
+
+        num_agents = max(current[0].sum(), 1.0)
+        self.changes = (
+            np.abs(current[0] - previous[0]).sum() / (2 * num_agents),
+            np.abs(current[1] - previous[1]).max(),
+            0.5 * np.abs(current[2] - previous[2]).sum(axis=1).mean(),
+        )
+        if max(self.changes) <= self.tolerance:
+            self.converged_at = timestep
+            return True
+        return False
@@ -0,0 +1,119 @@
+# ensemble.py
+
+from config import RHO_L, ALPHA_L, NUM_AGENTS, CTY_KEY, N_JOBS, ENSEMBLE_REPLICATES, ENSEMBLE_SEED
+from helper import DATA_DIR
+from simulation import SimulationManager
+from shared_inputs import open_shared
+from route_index import RouteIndex, compile_routes
+from itertools import product
+from joblib import Parallel, delayed
+import numpy as np
+import pandas as pd
+import time
+
+# ========================
+# REPLICATED-SEED ENSEMBLE
+# ========================
+# Every (rho, alpha) is run ENSEMBLE_REPLICATES times with independent RNG streams spawned
+# from one SeedSequence. Replicates stream back as they finish and are folded into running
+# per-centroid means/variances (Welford), so memory does not grow with the number of replicates.
+
+
+class RunningStats:
+    """ Online (Welford) mean and variance of equally-shaped arrays """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)  # Sum of squared deviations from the mean
+
+    def update(self, x):
+        """ Fold one observation into the statistics """
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        """ Sample variance (ddof=1); zero until two observations are seen """
+        if self.count < 2:
+            return np.zeros_like(self.m2)
+        return self.m2 / (self.count - 1)
+
+
+def run_replicate(shared_inputs, centroids, rho, alpha, endowments, geo_id_to_income, seed_seq):
+    """ Worker entry point - one replicate; returns per-benchmark (population, average endowment) arrays """
+    # Agents draw from NumPy's global RNG - seed it from this replicate's independent stream
+    np.random.seed(seed_seq.generate_state(4))
+
+    arrays = open_shared(shared_inputs)
+    manager = SimulationManager(centroids, arrays['node_array'], arrays['amts_dens'], arrays['centroid_distances'])
+    route_index = RouteIndex(arrays['route_indptr'], arrays['route_destinations'], arrays['route_volumes'],
+                             len(centroids))
+
+    population = np.zeros((len(manager.benchmarks), len(centroids)))
+    avg_endowment = np.zeros((len(manager.benchmarks), len(centroids)))
+
+    def on_benchmark(city, timestep):
+        index = manager.benchmarks.index(timestep)
+        population[index] = city.pop_array
+        avg_endowment[index] = city.avg_dow_array
+
+    manager.simulate(rho, alpha, route_index, endowments, geo_id_to_income, on_benchmark)
+    return rho, alpha, population, avg_endowment
+
+
+def run_ensemble(centroids, centroid_nodes, amts_dens, centroid_distances, assigned_routes, endowments, geo_id_to_income,
+                 replicates=ENSEMBLE_REPLICATES, seed=ENSEMBLE_SEED):
+    """ Run 'replicates' independent simulations per (rho, alpha) and save per-centroid mean/variance CSVs """
+    start_time = time.time()
+
+    manager = SimulationManager(centroids, centroid_nodes, amts_dens, centroid_distances)
+    route_index = compile_routes(assigned_routes, centroids)
+    shared_inputs = manager.share_inputs(route_index)
+
+    # Independent streams: one child per parameter set, one grandchild per replicate
+    simulation_params = list(product(RHO_L, ALPHA_L))
+    param_seqs = np.random.SeedSequence(seed).spawn(len(simulation_params))
+
+    shape = (len(manager.benchmarks), len(centroids))
+    stats = {params: (RunningStats(shape), RunningStats(shape)) for params in simulation_params}
+
+    # Results are consumed as soon as any replicate finishes - only in-flight replicates are held in memory
+    results = Parallel(n_jobs=N_JOBS, backend='loky', return_as='generator_unordered')(
+        delayed(run_replicate)(
+            shared_inputs, centroids, rho, alpha, endowments, geo_id_to_income, replicate_seq
+        )
+        for (rho, alpha), param_seq in zip(simulation_params, param_seqs)
+        for replicate_seq in param_seq.spawn(replicates)
+    )
+    for rho, alpha, population, avg_endowment in results:
+        pop_stats, dow_stats = stats[(rho, alpha)]
+        pop_stats.update(population)
+        dow_stats.update(avg_endowment)
+
+    for (rho, alpha), (pop_stats, dow_stats) in stats.items():
+        save_ensemble_stats(manager.benchmarks, centroids, rho, alpha, pop_stats, dow_stats)
+
+    end_time = time.time()
+    print(f"Ensemble of {replicates} replicates x {len(simulation_params)} parameter sets done [{end_time - start_time:.2f} s]")
+    return stats
+
+
+def save_ensemble_stats(benchmarks, centroids, rho, alpha, pop_stats, dow_stats):
+    """ Save per-centroid ensemble statistics to one CSV per benchmark """
+    ids = [c[4] for c in centroids]
+    names = [c[2] for c in centroids]
+    for index, timestep in enumerate(benchmarks):
+        df_data = pd.DataFrame({
+            'Simulation_ID': ids,
+            'Centroid Name': names,
+            'Replicates': pop_stats.count,
+            'Population Mean': pop_stats.mean[index],
+            'Population Variance': pop_stats.variance[index],
+            'Avg Income Mean': dow_stats.mean[index],
+            'Avg Income Variance': dow_stats.variance[index],
+        })
+        csv_filename = f"{CTY_KEY}_{rho}_{alpha}_{NUM_AGENTS}_{timestep}_ensemble.csv"
+        df_data.to_csv(DATA_DIR / csv_filename, index=False)
@@ -1,8 +1,12 @@
 # four_step_model.py
 
-from collections import defaultdict
+from od_matrix import ODMatrix
+from route_index import MODE_NAMES
+from centroid_distances import nearest_graph_nodes
+from graph_handler import compile_graph
 
-import networkx as nx
+from collections import defaultdict
+from joblib import Parallel, delayed, effective_n_jobs
 import numpy as np
 
 
@@ -16,85 +20,100 @@ def generate_trips(centroids, amts_dens, base_trips=100):
     base_trips (int): Base number of trips to scale by amenity scores
 
     Returns:
-    dict: Dictionary mapping geoid to number of generated trips
+    numpy.ndarray: Number of generated trips of each centroid (centroid order)
     """
-    trip_counts = {}
     # Normalize amenity scores to sum to 1 for use as probabilities
-    total_amenity_score = sum(amts_dens)
-    amenity_probabilities = [score / total_amenity_score for score in amts_dens]
+    amts_dens = np.asarray(amts_dens, dtype=float)
+    amenity_probabilities = amts_dens / amts_dens.sum()
 
-    for idx, (_, _, _, _, geoid) in enumerate(centroids):
-        # Generate trips based on amenity score probability
-        trip_counts[geoid] = np.random.poisson(lam=base_trips * amenity_probabilities[idx])
+    # Generate trips based on amenity score probability
+    return np.random.poisson(lam=base_trips * amenity_probabilities)
 
-    return trip_counts
 
-
-def distribute_trips(trip_counts, centroids, amts_dens, centroid_distances):
+def gravity_trip_matrix(productions, amts_dens, centroid_distances, attractions=None, min_distance=0.1,
+                        max_iterations=100, tolerance=1e-6):
     """
-    Distribute trips using a gravity model based on amenity scores and transportation costs.
+    Distribute trips with a gravity model over index-aligned arrays.
+
+    T_ij = P_i * (A_j * F_ij) / Σ_j(A_j * F_ij), with friction factor F_ij = 1 / max(d_ij, min_distance).
+    If 'attractions' is given the matrix is also balanced so that column sums match it (doubly
+    constrained, Furness / iterative proportional fitting).
 
     Parameters:
-    trip_counts (dict): Dictionary of trips generated from each origin zone
-    centroids (list): List of centroid data (lon, lat, region_name, in_beltline, geoid)
-    amts_dens (list): List of amenity scores for each zone
-    centroid_distances (dict): Dictionary of distances between centroids
+    productions (array): Trips produced by each zone (P_i)
+    amts_dens (array): Amenity score of each zone (A_j)
+    centroid_distances (array): (n x n) distance matrix, aligned with the zone order
+    attractions (array): Optional trips attracted by each zone; rescaled to the total productions
+    min_distance (float): Lower bound on distances (avoids division by zero)
+    max_iterations (int): Maximum number of Furness iterations
+    tolerance (float): Furness stops once row and column sums are within this relative error
 
     Returns:
-    dict: Nested dictionary with origin-destination trip counts
+    numpy.ndarray: (n x n) origin-destination trip matrix
     """
-    trip_distribution = {}
+    productions = np.asarray(productions, dtype=float)
+    amts_dens = np.asarray(amts_dens, dtype=float)
+    distances = np.nan_to_num(np.asarray(centroid_distances, dtype=float), nan=np.inf)
 
-    # Create mapping from geoid to index for amenity scores
-    geoid_to_index = {centroid[4]: idx for idx, centroid in enumerate(centroids)}
+    # Singly constrained (production-constrained) gravity model
+    weights = amts_dens[None, :] / np.maximum(distances, min_distance)
+    denominators = weights.sum(axis=1, keepdims=True)
+    trips = np.divide(productions[:, None] * weights, denominators,
+                      out=np.zeros_like(weights), where=denominators > 0)
 
-    for origin_geoid, origin_trips in trip_counts.items():
-        origin_idx = geoid_to_index[origin_geoid]
-        destination_counts = {}
+    if attractions is not None:
+        attractions = np.asarray(attractions, dtype=float)
+        if attractions.sum() > 0:
+            attractions = attractions * productions.sum() / attractions.sum()
+        trips = furness(trips, productions, attractions, max_iterations, tolerance)
 
-        # Calculate denominator (sum of amenity * friction factors for all destinations)
-        denominator = 0
-        for dest_centroid in centroids:
-            dest_geoid = dest_centroid[4]
-            dest_idx = geoid_to_index[dest_geoid]
+    return trips
 
-            # Get transportation cost (distance) between origin and destination
-            try:
-                distance = centroid_distances[origin_geoid, dest_geoid]
-            except IndexError:
-                distance = float('inf')
 
-            # Use distance as friction factor F
-            friction_factor = 1 / max(distance, 0.1)  # Avoid division by zero
+def furness(trips, row_targets, col_targets, max_iterations=100, tolerance=1e-6):
+    """
+    Balance a trip matrix so its row/column sums match the targets (iterative proportional fitting).
 
-            # Sum A_j * F_ij
-            denominator += amts_dens[dest_idx] * friction_factor
+    Returns:
+    numpy.ndarray: Balanced copy of 'trips'
+    """
+    trips = np.array(trips, dtype=float)
+    scale = max(row_targets.sum(), 1e-12)
 
-        # Calculate trips to each destination
-        for dest_centroid in centroids:
-            dest_geoid = dest_centroid[4]
-            dest_idx = geoid_to_index[dest_geoid]
+    for _ in range(max_iterations):
+        col_sums = trips.sum(axis=0)
+        trips *= np.divide(col_targets, col_sums, out=np.zeros_like(col_sums), where=col_sums > 0)[None, :]
+        row_sums = trips.sum(axis=1)
+        trips *= np.divide(row_targets, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)[:, None]
 
-            # Get transportation cost (distance) between origin and destination
-            try:
-                distance = centroid_distances[origin_geoid, dest_geoid]
-            except IndexError:
-                distance = float('inf')
+        # Rows now match exactly - stop once the columns do too
+        if np.abs(trips.sum(axis=0) - col_targets).sum() <= tolerance * scale:
+            break
 
-            friction_factor = 1 / max(distance, 0.1)  # Avoid division by zero
+    return trips
 
-            # Calculate T_ij using the formula:
-            # T_ij = P_i * (A_j * F_ij) / Σ(A_j * F_ij)
-            if denominator > 0:
-                trips = origin_trips * (amts_dens[dest_idx] * friction_factor) / denominator
-            else:
-                trips = 0
 
-            destination_counts[dest_geoid] = trips
+def distribute_trips(trip_counts, centroids, amts_dens, centroid_distances, doubly_constrained=False):
+    """
+    Distribute trips using a gravity model based on amenity scores and transportation costs.
+
+    Parameters:
+    trip_counts (numpy.ndarray): Trips generated from each origin zone (or legacy {geoid: trips} dict)
+    centroids (list): List of centroid data (lon, lat, region_name, in_beltline, geoid)
+    amts_dens (list): List of amenity scores for each zone
+    centroid_distances (numpy.ndarray): (n x n) distance matrix, aligned with 'centroids'
+    doubly_constrained (bool): Also balance attractions (proportional to amenity scores)
 
-        trip_distribution[origin_geoid] = destination_counts
+    Returns:
+    ODMatrix: Origin-destination trips (single 'all' mode)
+    """
+    geoids = [centroid[4] for centroid in centroids]
+    if isinstance(trip_counts, dict):
+        trip_counts = [trip_counts.get(geoid, 0) for geoid in geoids]
+    attractions = np.asarray(amts_dens, dtype=float) if doubly_constrained else None
 
-    return trip_distribution
+    trips = gravity_trip_matrix(trip_counts, amts_dens, centroid_distances, attractions=attractions)
+    return ODMatrix(trips[None], geoids, modes=('all',))
 
 
 def modal_split(trip_distribution, car_ownership_rate=0.7):
@@ -102,66 +121,111 @@ def modal_split(trip_distribution, car_ownership_rate=0.7):
     Perform a modal split on the trip distribution.
 
     Parameters:
-    trip_distribution (dict): Nested dictionary of trips between origins and destinations
+    trip_distribution (ODMatrix): Trips between origins and destinations
     car_ownership_rate (float): Proportion of trips made by car (default 0.7)
 
     Returns:
-    dict: Dictionary containing trips split by mode
+    ODMatrix: Trips split by mode (MODE_NAMES order)
     """
     modes = {
         'car': car_ownership_rate,
         'transit': 1 - car_ownership_rate
     }
+    rates = np.array([modes[mode] for mode in MODE_NAMES])
 
-    split_distribution = defaultdict(lambda: defaultdict(dict))
-    for origin, destinations in trip_distribution.items():
-        for dest, trips in destinations.items():
-            for mode, rate in modes.items():
-                split_distribution[origin][dest][mode] = trips * rate
+    trips = trip_distribution.total()
+    return ODMatrix(rates[:, None, None] * trips[None], trip_distribution.geoids, modes=MODE_NAMES)
 
-    return split_distribution
 
-
-def route_assignment(split_distribution, g):
+def route_assignment(split_distribution, g, centroid_nodes, n_jobs=1, compiled_graph=None):
     """
     Assign routes based on the shortest path in the network.
 
+    One single-source shortest-path tree is grown per origin (scipy csgraph on the compiled
+    CSR graph) and shared by all modes and destinations; paths are reconstructed from its
+    predecessors. Origins are split into one batch per worker.
+
     Parameters:
-    split_distribution (dict): Nested dictionary of trips split by mode
-    g (networkx.Graph): Transportation network graph with edge weights representing distance
+    split_distribution (ODMatrix): Trips split by mode
+    g (networkx.Graph): Transportation network graph with edge lengths
+    centroid_nodes (array): Nearest graph node of each centroid (centroid order)
+    n_jobs (int): Number of processes for the shortest-path trees (joblib convention)
+    compiled_graph (CompiledGraph): CSR form of 'g' (compiled if not given)
 
     Returns:
-    dict: Dictionary of assigned routes with volumes and paths
+    ODMatrix: Assigned route volumes (unroutable trips removed) with the path of each routed entry
     """
-    assigned_routes = defaultdict(lambda: {'volume': 0, 'path': None})
-
-    for origin in split_distribution:
-        for destination in split_distribution[origin]:
-            for mode, trips in split_distribution[origin][destination].items():
-                if trips > 0:
-                    # Find the shortest path for this O-D pair
-                    try:
-                        # Assumes edge weights represent distance
-                        shortest_path = nx.shortest_path(g, origin, destination, weight='distance')
-
-                        # Create a route key that includes origin, destination, and mode
-                        route_key = (origin, destination, mode)
-
-                        # Update assigned routes with volume and path
-                        assigned_routes[route_key]['volume'] += trips
-                        assigned_routes[route_key]['path'] = shortest_path
-
-                    except nx.NetworkXNoPath:
-                        # Handle cases where no path exists between origin and destination
-                        print(f"No path found between {origin} and {destination}")
-                    except nx.NodeNotFound:
-                        # Handle cases where origin or destination nodes are not in the graph
-                        print(f"Node not found for route from {origin} to {destination}")
-
-    return dict(assigned_routes)
-
-
-def run_four_step_model(centroids, g, amts_dens, centroid_distances, base_trips=100, car_ownership_rate=0.7):
+    geoids = split_distribution.geoids
+    if compiled_graph is None:
+        compiled_graph = compile_graph(g)
+
+    # O-D pairs with trips in any mode share one path
+    pair_origins, pair_destinations = np.nonzero(split_distribution.total() > 0)
+    requests = defaultdict(list)
+    for i, j in zip(pair_origins.tolist(), pair_destinations.tolist()):
+        requests[i].append(j)
+
+    origins = list(requests)
+    num_batches = max(min(effective_n_jobs(n_jobs), len(origins)), 1)
+    batches = [origins[k::num_batches] for k in range(num_batches)]
+    if num_batches == 1:
+        results = [_shortest_path_batch(compiled_graph, centroid_nodes, batch, requests) for batch in batches]
+    else:
+        results = Parallel(n_jobs=num_batches, backend='loky')(
+            delayed(_shortest_path_batch)(compiled_graph, centroid_nodes, batch, {i: requests[i] for i in batch})
+            for batch in batches
+        )
+    pair_paths = {pair: path for result in results for pair, path in result.items()}
+
+    volumes = np.zeros_like(split_distribution.trips)
+    paths = {}
+    modes, origins, destinations, trips = split_distribution.nonzero()
+    for m, i, j, mode_trips in zip(modes.tolist(), origins.tolist(), destinations.tolist(), trips.tolist()):
+        shortest_path = pair_paths.get((i, j))
+        if shortest_path is None:
+            # No path exists (or a centroid node is missing from the graph) - reported by the batch
+            continue
+
+        # Update assigned routes with volume and path
+        volumes[m, i, j] = mode_trips
+        paths[(m, i, j)] = shortest_path
+
+    return ODMatrix(volumes, geoids, modes=split_distribution.modes, paths=paths)
+
+
+def _shortest_path_batch(compiled_graph, centroid_nodes, origins, requests, chunk_size=64):
+    """ Shortest paths {(origin, destination): nodes} from one tree per origin in 'origins' """
+    pair_paths = {}
+
+    # Graph node index of each centroid (-1 if its node is not in the graph)
+    node_indices = np.array([compiled_graph.node_index.get(node, -1) for node in np.asarray(centroid_nodes).tolist()])
+    for i in origins:
+        if node_indices[i] < 0:
+            # Handle cases where origin node is not in the graph
+            print(f"Node not found for routes from centroid {i}")
+    origins = [i for i in origins if node_indices[i] >= 0]
+
+    for start in range(0, len(origins), chunk_size):
+        # Single-source trees of a chunk of origins: predecessors of every reachable node
+        chunk = origins[start:start + chunk_size]
+        _, predecessors = compiled_graph.shortest_paths(node_indices[chunk])
+
+        for row, i in enumerate(chunk):
+            for j in requests[i]:
+                path = None
+                if node_indices[j] >= 0:
+                    path = compiled_graph.path(predecessors[row], node_indices[i], node_indices[j])
+                if path is None:
+                    # Handle cases where no path exists between origin and destination
+                    print(f"No path found between centroids {i} and {j}")
+                    continue
+                pair_paths[(i, j)] = path
+
+    return pair_paths
+
+
+def run_four_step_model(centroids, g, amts_dens, centroid_distances, base_trips=100, car_ownership_rate=0.7,
+                        centroid_nodes=None, n_jobs=1, compiled_graph=None):
     """
     Run the complete four-step transportation model.
 
@@ -169,13 +233,20 @@ def run_four_step_model(centroids, g, amts_dens, centroid_distances, base_trips=
     centroids (list): List of centroid data
     g (networkx.Graph): Transportation network graph
     amts_dens (list): List of amenity scores for each zone
-    centroid_distances (dict): Dictionary of distances between centroids
+    centroid_distances (numpy.ndarray): (n x n) distance matrix, aligned with 'centroids'
     base_trips (int): Base number of trips to scale by amenity scores
     car_ownership_rate (float): Proportion of trips made by car
+    centroid_nodes (array): Nearest graph node of each centroid (computed if not given)
+    n_jobs (int): Number of processes for route assignment
+    compiled_graph (CompiledGraph): CSR form of 'g', shared with the distance computation (compiled if not given)
 
     Returns:
-    tuple: (trip_counts, trip_distribution, split_distribution, assigned_routes)
+    tuple: (trip_counts, trip_distribution, split_distribution, assigned_routes) - trip counts
+           per centroid and ODMatrix objects (see ODMatrix.to_dict / to_assigned_routes for dicts)
     """
+    if centroid_nodes is None:
+        centroid_nodes = nearest_graph_nodes(g, [c[0] for c in centroids], [c[1] for c in centroids])
+
     # Step 1: Trip Generation
     trip_counts = generate_trips(centroids, amts_dens, base_trips)
 
@@ -186,6 +257,6 @@ def run_four_step_model(centroids, g, amts_dens, centroid_distances, base_trips=
     split_distribution = modal_split(trip_distribution, car_ownership_rate)
 
     # Step 4: Route Assignment
-    assigned_routes = route_assignment(split_distribution, g)
+    assigned_routes = route_assignment(split_distribution, g, centroid_nodes, n_jobs=n_jobs, compiled_graph=compiled_graph)
 
     return trip_counts, trip_distribution, split_distribution, assigned_routes
\ No newline at end of file
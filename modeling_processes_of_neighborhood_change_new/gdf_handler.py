@@ -4,7 +4,7 @@ import geopandas as gpd
 import pandas as pd
 from config import IDENTIFIER_COLUMNS, NAME_COLUMNS, ID_LIST, viewData
 from helper import GDF_CACHE_FILENAME, GDF_NUM_GEOMETRIES_FILE, GDF_NUM_GEOMETRIES_INDIVIDUAL_FILE, GDF_CACHE_DIR
-from beltline_score import get_beltline_score
+from beltline_score import corridor_scores
 from pathlib import Path
 import matplotlib.pyplot as plt
 import matplotlib
@@ -121,13 +121,16 @@ def create_Sqkm_column(gdf):
     gdf = gdf.to_crs(epsg=4326)
     return gdf
 
-# TODO
 def create_Beltline_column(gdf, beltline_geom):
     """ Helper function to create 'Beltline Score' column """
     print("Updating 'Beltline Score'...")
+    return create_corridor_column(gdf, beltline_geom, 'Beltline Score')
+
+def create_corridor_column(gdf, corridor_geom, column):
+    """ Helper function to create a corridor score column (vectorized; corridor_geom in lat/lon) """
     gdf = gdf.to_crs(epsg=32616) # Meter-based projection
-    reprojected_beltline_geom = reproject_geometry(beltline_geom)
-    gdf['Beltline Score'] = gdf['geometry'].apply(lambda poly: get_beltline_score(poly, reprojected_beltline_geom))
+    reprojected_corridor_geom = reproject_geometry(corridor_geom)
+    gdf[column] = corridor_scores(gdf['geometry'].values, reprojected_corridor_geom)
     gdf = gdf.to_crs(epsg=4326)
     return gdf
 
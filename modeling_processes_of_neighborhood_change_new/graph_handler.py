@@ -2,8 +2,13 @@
 
 import osmnx as ox
 import networkx as nx
+import numpy as np
+import hashlib
+import os
 import pickle
-from helper import GRAPH_FILE
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from helper import GRAPH_FILE, GRAPH_CSR_FILE
 
 # =========================
 # GRAPH FILE INITIALIZATION
@@ -40,4 +45,106 @@ def load_graph(file_path=GRAPH_FILE):
     """ Load graph from cache """
     with open(file_path, 'rb') as file:
         g = pickle.load(file)
-    return g
\ No newline at end of file
+    return g
+
+# ==============
+# COMPILED GRAPH
+# ==============
+
+class CompiledGraph:
+    """ Road graph as CSR adjacency arrays (int32 indices, float32 lengths) for scipy.sparse.csgraph """
+
+    def __init__(self, nodes, indptr, indices, lengths, num_edges):
+        self.nodes = nodes  # Graph node id of each node index
+        self.indptr = indptr  # (N + 1,) row offsets
+        self.indices = indices  # Head node index of each edge
+        self.lengths = lengths  # Edge lengths (meters)
+        self.num_edges = num_edges  # Edge count of the source graph (before merging parallel edges)
+        self.node_index = {node: idx for idx, node in enumerate(nodes.tolist())}
+        self.n = len(nodes)
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """ Content hash of the graph (node ids, adjacency, lengths) - identifies caches derived from it """
+        if self._fingerprint is None:
+            hasher = hashlib.md5()
+            for array in (self.nodes, self.indptr, self.indices, self.lengths):
+                hasher.update(np.ascontiguousarray(array).tobytes())
+            self._fingerprint = hasher.hexdigest()
+        return self._fingerprint
+
+    def csr(self):
+        """ (N x N) sparse adjacency matrix of edge lengths """
+        return csr_matrix((self.lengths, self.indices, self.indptr), shape=(self.n, self.n))
+
+    def node_indices(self, nodes):
+        """ Node indices of graph node ids """
+        return np.array([self.node_index[node] for node in np.asarray(nodes).tolist()], dtype=np.int64)
+
+    def distances(self, sources, limit=np.inf):
+        """ Distances from each source node index to every node (np.inf if unreachable or beyond 'limit') """
+        return dijkstra(self.csr(), indices=sources, limit=limit)
+
+    def shortest_paths(self, sources, limit=np.inf):
+        """ Distances (and predecessors) from each source node index to every node; search stops beyond 'limit' """
+        return dijkstra(self.csr(), indices=sources, return_predecessors=True, limit=limit)
+
+    def path(self, predecessors, source, target):
+        """ Node ids of the path source -> target from one predecessor row (None if unreachable) """
+        if source != target and predecessors[target] < 0:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(predecessors[path[-1]])
+        return self.nodes[path[::-1]].tolist()
+
+def compile_graph(g, weight='length'):
+    """ Compile a networkx graph into CSR arrays (shortest of any parallel edges) """
+    nodes = np.array(list(g.nodes))
+    node_index = {node: idx for idx, node in enumerate(nodes.tolist())}
+
+    edges = np.array([(node_index[u], node_index[v], length) for u, v, length in g.edges(data=weight, default=0.0)],
+                     dtype=float).reshape(-1, 3)
+    tails, heads, lengths = edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64), edges[:, 2]
+
+    # Sort by (tail, head, length) and keep the shortest of each parallel group
+    keys = tails.astype(np.int64) * len(nodes) + heads
+    order = np.lexsort((lengths, keys))
+    keys, lengths = keys[order], lengths[order]
+    unique_keys, first = np.unique(keys, return_index=True)
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(unique_keys // len(nodes), minlength=len(nodes)), out=indptr[1:])
+    return CompiledGraph(nodes, indptr, (unique_keys % len(nodes)).astype(np.int32),
+                         lengths[first].astype(np.float32), len(edges))
+
+def save_compiled_graph(compiled, g, file_path=GRAPH_CSR_FILE):
+    """ Save compiled graph to cache, with the edge-length checksum of its source graph 'g' """
+    tmp_path = f"{file_path}.tmp.npz"
+    np.savez(tmp_path, nodes=compiled.nodes, indptr=compiled.indptr, indices=compiled.indices,
+             lengths=compiled.lengths, num_edges=compiled.num_edges, length_sum=edge_length_sum(g))
+    os.replace(tmp_path, file_path)
+
+def edge_length_sum(g, weight='length'):
+    """ Sum of all edge lengths - cheap checksum of a graph's edge weights """
+    return np.fromiter((length for _, _, length in g.edges(data=weight, default=0.0)), dtype=float,
+                       count=g.number_of_edges()).sum()
+
+def load_compiled_graph(g, file_path=GRAPH_CSR_FILE, regenerate=False):
+    """ Load compiled graph from cache (if it matches 'g') or compile and cache it """
+    if not regenerate and os.path.exists(file_path):
+        with np.load(file_path) as data:
+            compiled = CompiledGraph(data['nodes'], data['indptr'], data['indices'], data['lengths'],
+                                     int(data['num_edges']))
+            length_sum = float(data['length_sum']) if 'length_sum' in data else None
+
+        # Same node ids in the same order, same edge count and same total edge length
+        if (compiled.num_edges == g.number_of_edges()
+                and np.array_equal(compiled.nodes, np.fromiter(g.nodes, dtype=compiled.nodes.dtype,
+                                                               count=g.number_of_nodes()))
+                and length_sum is not None and np.isclose(length_sum, edge_length_sum(g))):
+            return compiled
+
+    compiled = compile_graph(g)
+    save_compiled_graph(compiled, g, file_path)
+    return compiled
@@ -2,6 +2,7 @@
 from config import ZIP_URLS, T_MAX_RANGE, BENCHMARK_INTERVALS
 from pathlib import Path
 import os
+import hashlib
 import numpy as np
 import osmnx as ox
 import pickle
@@ -15,9 +16,12 @@ PLT_DIR = FIGURES_DIR / 'matplotlib'
 GIFS_CACHE_DIR = FIGURES_DIR / 'gifs'
 CACHE_DIR = BASE_DIR / 'cache'
 AMTS_DENS_CACHE_DIR = CACHE_DIR / 'amts_dens'
+AMENITY_CACHE_DIR = CACHE_DIR / 'amenities'
+BELTLINE_CACHE_DIR = CACHE_DIR / 'beltline'
 CENTROID_DIST_CACHE_DIR = CACHE_DIR / 'centroid_distances'
 OSMNX_CACHE_DIR = CACHE_DIR / 'osmnx_cache'
-FIGURE_PKL_CACHE_DIR = CACHE_DIR / 'pkl_figures'
+SNAPSHOT_CACHE_DIR = CACHE_DIR / 'snapshots'
+SHARED_CACHE_DIR = CACHE_DIR / 'shared'
 GDF_CACHE_DIR = CACHE_DIR / 'gdfs'
 LAYER_CACHE_DIR = CACHE_DIR / 'layers'
 SAVED_IDS_CACHE_DIR = CACHE_DIR / 'saved_ids'
@@ -26,10 +30,21 @@ CENSUS_DATA_CACHE_DIR = CACHE_DIR / 'census_data'
 for directory in [
     FOLIUM_DIR, PLT_DIR, SAVED_IDS_CACHE_DIR, GIFS_CACHE_DIR, 
     LAYER_CACHE_DIR, GDF_CACHE_DIR, CACHE_DIR, DATA_DIR, FIGURES_DIR, AMTS_DENS_CACHE_DIR, 
-    CENTROID_DIST_CACHE_DIR, OSMNX_CACHE_DIR, FIGURE_PKL_CACHE_DIR, CENSUS_DATA_CACHE_DIR
+    CENTROID_DIST_CACHE_DIR, OSMNX_CACHE_DIR, CENSUS_DATA_CACHE_DIR, SNAPSHOT_CACHE_DIR,
+    SHARED_CACHE_DIR, AMENITY_CACHE_DIR, BELTLINE_CACHE_DIR
     ]:
     os.makedirs(directory, exist_ok=True)
     
+""" Cache keys """
+def cache_hash(*args, **kwargs):
+    """ Hash function """
+    hasher = hashlib.md5()
+    for arg in args:
+        hasher.update(pickle.dumps(arg))
+    for key, value in sorted(kwargs.items()):
+        hasher.update(pickle.dumps((key, value)))
+    return hasher.hexdigest()
+
 """ Create T_MAX_L """
 num_benchmarks = int(T_MAX_RANGE/BENCHMARK_INTERVALS)
 T_MAX_L = np.linspace(BENCHMARK_INTERVALS, T_MAX_RANGE, num_benchmarks, dtype=int)
@@ -43,6 +58,7 @@ GDF_CACHE_FILENAME = GDF_CACHE_DIR / "gdf.gpkg"
 GDF_NUM_GEOMETRIES_FILE = GDF_CACHE_DIR / "num_geometries"
 GDF_NUM_GEOMETRIES_INDIVIDUAL_FILE = GDF_CACHE_DIR / "num_geometries_individual"
 GRAPH_FILE = CACHE_DIR / f"graph.pkl"
+GRAPH_CSR_FILE = CACHE_DIR / f"graph_csr.npz"
 ECONOMIC_DATA_FILENAME = CENSUS_DATA_CACHE_DIR / f"economic_data.xlsx"
 POPULATION_DATA_FILENAME = CENSUS_DATA_CACHE_DIR / f"population_data.xlsx"
 
@@ -0,0 +1,80 @@
+# history.py
+
+import numpy as np
+import pandas as pd
+
+
+class HistoryRecorder:
+    """ Per-centroid population / community score history in preallocated (records x centroids) arrays """
+
+    def __init__(self, num_centroids, t_max, stride=1):
+        self.num_centroids = num_centroids
+        self.stride = max(int(stride), 1)  # Record every 'stride' updates (decimation)
+        capacity = t_max // self.stride + 2  # Initial state + one record per stride (+ slack)
+
+        self.step = 0  # Number of updates seen so far
+        self.size = 0  # Number of records stored
+        self._timesteps = np.zeros(capacity, dtype=np.int32)
+        self._population = np.zeros((capacity, num_centroids), dtype=np.int32)
+        self._community = np.zeros((capacity, num_centroids), dtype=np.float32)
+
+    def record(self, pop, cmt):
+        """ Record one update of all centroids (kept only every 'stride' updates) """
+        if self.step % self.stride == 0:
+            if self.size == len(self._timesteps):
+                self._grow()
+            self._timesteps[self.size] = self.step
+            self._population[self.size] = pop
+            self._community[self.size] = cmt
+            self.size += 1
+        self.step += 1
+
+    def _grow(self):
+        """ Double capacity if more updates arrive than t_max anticipated """
+        capacity = max(2 * len(self._timesteps), 1)  # Unpickled recorders may have been trimmed to 0 records
+        self._timesteps = np.resize(self._timesteps, capacity)
+        self._population = np.resize(self._population, (capacity, self.num_centroids))
+        self._community = np.resize(self._community, (capacity, self.num_centroids))
+
+    @classmethod
+    def from_arrays(cls, timesteps, population, community, stride=1):
+        """ Recorder holding an existing history (e.g. loaded from a snapshot) """
+        recorder = cls(population.shape[1], 0, stride=stride)
+        recorder._timesteps = np.asarray(timesteps, dtype=np.int32)
+        recorder._population = np.asarray(population, dtype=np.int32)
+        recorder._community = np.asarray(community, dtype=np.float32)
+        recorder.size = len(recorder._timesteps)
+        recorder.step = int(recorder._timesteps[-1]) + 1 if recorder.size else 0
+        return recorder
+
+    @property
+    def timesteps(self):
+        """ Timestep of each record (0 = initial state) """
+        return self._timesteps[:self.size]
+
+    @property
+    def population(self):
+        """ (records x centroids) population history """
+        return self._population[:self.size]
+
+    @property
+    def community(self):
+        """ (records x centroids) community score history """
+        return self._community[:self.size]
+
+    def to_frame(self, ids):
+        """ Long-format DataFrame: one row per (timestep, centroid) """
+        return pd.DataFrame({
+            'Timestep': np.repeat(self.timesteps, self.num_centroids),
+            'Simulation_ID': np.tile(np.asarray(ids), self.size),
+            'Population': self.population.ravel(),
+            'Community Score': self.community.ravel(),
+        })
+
+    def __getstate__(self):
+        """ Pickle only the filled part of the buffers """
+        state = self.__dict__.copy()
+        state['_timesteps'] = self.timesteps.copy()
+        state['_population'] = self.population.copy()
+        state['_community'] = self.community.copy()
+        return state
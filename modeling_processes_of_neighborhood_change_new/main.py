@@ -1,25 +1,28 @@
 # main.py
 
 from collections import defaultdict
-from helper import gdf_cache_filenames, GRAPH_FILE, GDF_CACHE_FILENAME, GIFS_CACHE_DIR, PLT_DIR, T_MAX_L, SAVED_IDS_FILE
-from config import RUN_CALIBRATION, CTY_KEY, NUM_AGENTS, T_MAX_RANGE, PLOT_CITIES, RHO_L, ALPHA_L, AMENITY_TAGS, N_JOBS, GIF_NUM_PAUSE_FRAMES, GIF_FRAME_DURATION, ID_LIST, RELATION_IDS, viewData
+from helper import gdf_cache_filenames, GRAPH_FILE, GDF_CACHE_FILENAME, GIFS_CACHE_DIR, PLT_DIR, T_MAX_L, SAVED_IDS_FILE, DATA_DIR
+from config import RUN_CALIBRATION, CALIBRATE_AMENITY_WEIGHTS, RUN_ENSEMBLE, RUN_TRAFFIC_ASSIGNMENT, TRAFFIC_ASSIGNMENT_METHOD, TRAFFIC_MAX_ITERATIONS, TRAFFIC_GAP_TOLERANCE, CENTROID_DISTANCE_MODE, BENCHMARK_REGION_DISTANCES, TRAVEL_COST_MODE, CTY_KEY, NUM_AGENTS, T_MAX_RANGE, PLOT_CITIES, RHO_L, ALPHA_L, AMENITY_TAGS, N_JOBS, GIF_NUM_PAUSE_FRAMES, GIF_FRAME_DURATION, ID_LIST, RELATION_IDS, viewData
 from file_download_manager import download_and_extract_layers_all
 from economic_distribution import economic_distribution
 from gdf_handler import load_gdf, create_gdf, print_overlaps
-from graph_handler import load_graph, create_graph, save_graph
-from amtdens import compute_amts_dens
-from centroid_distances import cached_centroid_distances
+from graph_handler import load_graph, create_graph, save_graph, load_compiled_graph
+from amtdens import compute_amts_dens, amenity_count_matrix
+from centroid_distances import cached_centroid_distances, cached_centroid_nodes, cached_region_distances, benchmark_region_distances, cached_travel_times
 from simulation import run_simulation
+from ensemble import run_ensemble
 from visualization import plot_city
 from gif import process_pdfs_to_gifs
 from centroids import create_centroids
 from save_IDS import save_current_IDS, load_previous_IDS
-from calibration import Calibration, MyRepair
-from beltline_score import fetch_beltline_nodes
+from calibration import Calibration, MyRepair, amenity_weights
+from beltline_score import LazyBeltline
 from pathlib import Path
 from itertools import product
 from joblib import Parallel, delayed
 from four_step_model import run_four_step_model
+from route_index import MODE_CAR
+from traffic_assignment import LinkNetwork, assign_od_matrix, link_flows_frame
 from pymoo.algorithms.soo.nonconvex.ga import GA
 from pymoo.termination import get_termination
 from pymoo.optimize import minimize
@@ -34,6 +37,11 @@ import matplotlib
 OVERALL_START_TIME = time.time()
 
 def main():
+    if TRAVEL_COST_MODE == 'travel_time' and CENTROID_DISTANCE_MODE == 'region':
+        # Travel times are computed between centroid nodes only
+        raise ValueError("TRAVEL_COST_MODE 'travel_time' does not support CENTROID_DISTANCE_MODE 'region'; "
+                         "use CENTROID_DISTANCE_MODE 'centroid' or TRAVEL_COST_MODE 'distance'.")
+
     # ===================================================
     # DOWNLOAD/EXTRACT ZIP & CREATE ECONOMIC DISTRIBUTION
     # ===================================================
@@ -73,18 +81,17 @@ def main():
     gdf_start_time = time.time()
     print("Processing Geodataframe(s)...")    
     
-    beltline_geom = fetch_beltline_nodes(RELATION_IDS)
-    if beltline_geom is None:
-        print("Failed to fetch BeltLine geometries.")
+    # Beltline geometry - loaded (from cache, else OSM) only if the GDF is regenerated or it is plotted
+    beltline = LazyBeltline(RELATION_IDS)
         
     # Create or load GDF
     if Path(GDF_CACHE_FILENAME).exists():
         if regen_gdf_and_graph:
-            gdf, num_geometries, num_geometries_individual = create_gdf(shapefile_paths, gdf_cache_filenames, beltline_geom)
+            gdf, num_geometries, num_geometries_individual = create_gdf(shapefile_paths, gdf_cache_filenames, beltline.geom)
         else:
             gdf, num_geometries, num_geometries_individual = load_gdf()
     else:
-        gdf, num_geometries, num_geometries_individual = create_gdf(shapefile_paths, gdf_cache_filenames, beltline_geom)
+        gdf, num_geometries, num_geometries_individual = create_gdf(shapefile_paths, gdf_cache_filenames, beltline.geom)
         
     print(f"[GDF] created w/ {num_geometries} regions.")
     for i in range(len(num_geometries_individual)):
@@ -106,7 +113,7 @@ def main():
     if viewData:
         matplotlib.use('TkAgg')
         gdf.plot()
-        beltline_gdf = gpd.GeoDataFrame(geometry=[beltline_geom], crs="EPSG:4326")
+        beltline_gdf = gpd.GeoDataFrame(geometry=[beltline.geom], crs="EPSG:4326")
         fig, ax = plt.subplots()
         beltline_gdf.plot(ax=ax, color="red")
         plt.show()
@@ -134,6 +141,9 @@ def main():
         g = create_graph(gdf)
         save_graph(g, GRAPH_FILE)
 
+    # Compact CSR form of the graph - shared by centroid distances and route assignment
+    compiled_graph = load_compiled_graph(g, regenerate=regen_gdf_and_graph)
+
     graph_end_time = time.time()
     print(f"Graph generation complete after {graph_end_time - graph_start_time:.2f} seconds.\n")
 
@@ -178,7 +188,18 @@ def main():
     distances_start_time = time.time()
     print("Processing centroid distances...")
 
-    centroid_distances = cached_centroid_distances(centroids, g)
+    centroid_nodes = cached_centroid_nodes(centroids, g, compiled_graph=compiled_graph)
+    if TRAVEL_COST_MODE == 'travel_time':
+        # Stacked (car, transit) travel times - agents index the layer of their mode
+        centroid_distances = cached_travel_times(centroids, g, compiled_graph=compiled_graph)
+    elif CENTROID_DISTANCE_MODE == 'region':
+        if BENCHMARK_REGION_DISTANCES:
+            # Runtime vs. sample size k (uncached)
+            print(benchmark_region_distances(gdf, g, compiled_graph=compiled_graph, n_jobs=N_JOBS).to_string(index=False))
+        # Aggregate over sampled nodes of each region pair (GDF rows are in centroid order)
+        centroid_distances = cached_region_distances(gdf, g, compiled_graph=compiled_graph, n_jobs=N_JOBS)
+    else:
+        centroid_distances = cached_centroid_distances(centroids, g, compiled_graph=compiled_graph)
 
     distances_end_time = time.time()
     print(f"Completed distance initialization after {distances_end_time - distances_start_time:.2f} seconds.\n")
@@ -193,25 +214,60 @@ def main():
         centroids=centroids,
         g=g,
         amts_dens=amts_dens,
-        centroid_distances=centroid_distances,
+        centroid_distances=centroid_distances if centroid_distances.ndim == 2 else centroid_distances[MODE_CAR], # Car travel times as trip impedance
         base_trips=100,
-        car_ownership_rate=0.7
+        car_ownership_rate=0.7,
+        centroid_nodes=centroid_nodes,
+        n_jobs=N_JOBS,
+        compiled_graph=compiled_graph
     )
 
     transport_end_time = time.time()
     print(f"Completed transportation model after {transport_end_time - transport_start_time:.2f} seconds.\n")
 
+    # ======================================
+    # RUN CAPACITY-CONSTRAINED TRAFFIC MODEL
+    # ======================================
+    if RUN_TRAFFIC_ASSIGNMENT:
+        traffic_start_time = time.time()
+        print("Running traffic assignment...")
+
+        network = LinkNetwork.from_graph(g)
+        link_flows, link_times, gaps = assign_od_matrix(
+            network, split_distribution, centroid_nodes, mode='car',
+            method=TRAFFIC_ASSIGNMENT_METHOD,
+            max_iterations=TRAFFIC_MAX_ITERATIONS,
+            tolerance=TRAFFIC_GAP_TOLERANCE,
+            n_jobs=N_JOBS
+        )
+        link_flows_frame(network, link_flows, link_times).to_csv(DATA_DIR / f"{CTY_KEY}_link_flows.csv", index=False)
+
+        traffic_end_time = time.time()
+        print(f"Completed traffic assignment ({len(gaps)} iterations, relative gap {gaps[-1] if gaps else 0:.2e}) after {traffic_end_time - traffic_start_time:.2f} seconds.\n")
+
     # ==============
     # RUN SIMULATION
     # ==============
     simulation_start_time = time.time()
     print("Simulating...")
 
-    run_simulation(centroids, g, amts_dens, centroid_distances, assigned_routes, endowments, geo_id_to_income)
+    run_simulation(centroids, centroid_nodes, amts_dens, centroid_distances, assigned_routes, endowments, geo_id_to_income)
 
     simulation_end_time = time.time()
     print(f"Completed simulation(s) after {simulation_end_time - simulation_start_time:.2f} seconds.\n")
 
+    # ============================
+    # RUN REPLICATED-SEED ENSEMBLE
+    # ============================
+    if RUN_ENSEMBLE:
+        ensemble_start_time = time.time()
+        print("Running ensemble...")
+
+        run_ensemble(centroids, centroid_nodes, amts_dens, centroid_distances, assigned_routes, endowments, geo_id_to_income)
+
+        ensemble_end_time = time.time()
+        print(f"Completed ensemble after {ensemble_end_time - ensemble_start_time:.2f} seconds.\n")
+
     # ==============================
     # VISUALIZATION LOGIC (PLOTTING)
     # ==============================
@@ -223,7 +279,7 @@ def main():
 
         Parallel(n_jobs=N_JOBS, backend='loky')(
             delayed(plot_city)(
-                rho, alpha, t_max, centroids, beltline_geom
+                rho, alpha, t_max, centroids, beltline
             )
             for rho, alpha, t_max in simulation_params
         )
@@ -248,14 +304,18 @@ def main():
     if RUN_CALIBRATION:
         calibration_start_time = time.time()
         print("Running calibration...")
+        # Per-tag amenity counts (cached) - lets the calibration re-weight amenity densities without new queries
+        amenity_counts = amenity_count_matrix(gdf, AMENITY_TAGS) if CALIBRATE_AMENITY_WEIGHTS else None
         problem = Calibration(
             geo_id_to_income,
             centroids,
-            g,
+            centroid_nodes,
             amts_dens,
             centroid_distances,
             assigned_routes,
             endowments,
+            amenity_counts=amenity_counts,
+            areas_sqkm=gdf['Sqkm'].values,
         )
         algorithm = GA(
             pop_size=50,  # Number of parameter combinations to test
@@ -300,6 +360,7 @@ def main():
                     "figkey": figkey,
                     "rho": rho_val,
                     "alpha": alpha_val,
+                    "amenity_weights": amenity_weights(pop_X[i, 2:]).tolist() if pop_X.shape[1] > 2 else None,
                     "tot_difference": tot_diff_val
                 })    
                 
@@ -342,17 +403,13 @@ if __name__ == "__main__":
     # No difference between graphs when extracting strongly connected component vs. not
 
 """ Enhancement """
-#TODO: Add weights to amenity types
-#TODO: Change centroid distance to be avg of: shortest paths between every node in a region A to every node in region B
 #TODO: Beltline attribute -  Beltline attribute: 1 if less than 1km, until 5 km decreases linearly to 0
 
 """ Optimization """
 #TODO: In calibration CSV, order parameters from least to greatest
 #TODO: check if gif already exists before re-creating it
-#TODO: Make amenity queries faster [!!!]
 #TODO: Address approach of: loading GDF and GRAPH from cache for every simulation iteration, instead of passing as parameter
 #TODO: Address: Creating 'Beltline' column every time a graph is generated [gdf_handler]
-#TODO: cache individual centroid distances [?]
 
 # Devam:
 #TODO: make random, make thresholds for car ownership, integrate demographic data with prices.
\ No newline at end of file
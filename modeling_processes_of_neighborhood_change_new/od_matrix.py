@@ -0,0 +1,84 @@
+# od_matrix.py
+
+from route_index import MODE_NAMES
+import numpy as np
+
+
+class ODMatrix:
+    """
+    Origin-destination trips by mode, aligned with the centroid order.
+
+    trips[m, i, j] is the number of trips from centroid i to centroid j by modes[m]
+    (a single 'all' mode before the modal split). Passed between the four steps of
+    the transportation model instead of nested dicts keyed by GEOID.
+    """
+
+    def __init__(self, trips, geoids, modes=MODE_NAMES, paths=None):
+        self.trips = np.asarray(trips, dtype=float)  # (modes x origins x destinations)
+        self.geoids = list(geoids)  # GEOID of each centroid (row / column order)
+        self.modes = tuple(modes)  # Mode names (first axis)
+        self.paths = paths if paths is not None else {}  # {(mode, origin, destination) indices: graph node path}
+
+    @property
+    def n(self):
+        """ Number of zones """
+        return len(self.geoids)
+
+    def total(self):
+        """ (origins x destinations) trips summed over all modes """
+        return self.trips.sum(axis=0)
+
+    def productions(self):
+        """ Trips produced by each origin (all modes) """
+        return self.trips.sum(axis=(0, 2))
+
+    def nonzero(self):
+        """ Positive entries as parallel arrays: (modes, origins, destinations, trips) """
+        modes, origins, destinations = np.nonzero(self.trips > 0)
+        return modes, origins, destinations, self.trips[modes, origins, destinations]
+
+    # Conversion helpers for legacy dict consumers
+
+    @classmethod
+    def from_dict(cls, distribution, geoids):
+        """ Build from {origin: {destination: trips}} or {origin: {destination: {mode: trips}}} """
+        geoids = list(geoids)
+        geoid_to_index = {geoid: idx for idx, geoid in enumerate(geoids)}
+
+        # Modes present in the dict (split distribution) or a single 'all' mode (trip distribution)
+        first = next((trips for destinations in distribution.values() for trips in destinations.values()), None)
+        modes = tuple(first.keys()) if isinstance(first, dict) else ('all',)
+
+        trips = np.zeros((len(modes), len(geoids), len(geoids)))
+        for origin, destinations in distribution.items():
+            for destination, value in destinations.items():
+                i, j = geoid_to_index[origin], geoid_to_index[destination]
+                if isinstance(value, dict):
+                    for mode, mode_trips in value.items():
+                        trips[modes.index(mode), i, j] = mode_trips
+                else:
+                    trips[0, i, j] = value
+        return cls(trips, geoids, modes)
+
+    def to_dict(self):
+        """ Legacy nested dict: {origin: {destination: trips}} for one mode, else {origin: {destination: {mode: trips}}} """
+        if len(self.modes) == 1:
+            return {
+                origin: dict(zip(self.geoids, self.trips[0, i].tolist()))
+                for i, origin in enumerate(self.geoids)
+            }
+        return {
+            origin: {
+                destination: {mode: float(self.trips[m, i, j]) for m, mode in enumerate(self.modes)}
+                for j, destination in enumerate(self.geoids)
+            }
+            for i, origin in enumerate(self.geoids)
+        }
+
+    def to_assigned_routes(self):
+        """ Legacy route dict: {(origin, destination, mode): {'volume': trips, 'path': nodes}} for routed entries """
+        modes, origins, destinations, trips = self.nonzero()
+        return {
+            (self.geoids[i], self.geoids[j], self.modes[m]): {'volume': float(volume), 'path': self.paths.get((m, i, j))}
+            for m, i, j, volume in zip(modes.tolist(), origins.tolist(), destinations.tolist(), trips.tolist())
+        }
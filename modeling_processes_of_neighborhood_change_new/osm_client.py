@@ -0,0 +1,123 @@
+# osm_client.py
+
+from config import OVERPASS_URL, OSM_MAX_WORKERS, OSM_REQUESTS_PER_SECOND, OSM_MAX_RETRIES, OSM_BACKOFF_SECONDS, OSM_TIMEOUT
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+import osmnx as ox
+import requests
+import threading
+import time
+
+# ================
+# OSM QUERY CLIENT
+# ================
+# One client for every Overpass query of the pipeline (amenities, Beltline relations):
+#   - a bounded thread pool runs independent queries concurrently (they are network-bound)
+#   - requests to an endpoint are spaced by a shared per-endpoint rate limiter; OSMnx queries (which may be
+#     split into many sub-requests for large polygons) also keep OSMnx's own per-request Overpass pacing
+#   - connection errors, timeouts and 429/5xx responses are retried with exponential backoff;
+#     anything still failing is raised - never turned into an empty result
+# The endpoint is configurable (OVERPASS_URL), e.g. to point at a local Overpass instance.
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# OSMnx settings are global - set once: OSMnx queries go to OVERPASS_URL (overpass_rate_limit stays on)
+ox.settings.overpass_url = OVERPASS_URL.rstrip('/')
+ox.settings.requests_timeout = OSM_TIMEOUT
+
+
+class OSMQueryError(RuntimeError):
+    """ An Overpass query that still failed after all retries """
+
+
+class RateLimiter:
+    """ Thread-safe minimum interval between consecutive request starts """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """ Block until the next request may start """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+_limiters = {}  # Endpoint -> RateLimiter, shared by all clients of that endpoint
+_limiters_lock = threading.Lock()
+
+
+def _limiter(endpoint, requests_per_second):
+    """ The shared rate limiter of an endpoint """
+    with _limiters_lock:
+        if endpoint not in _limiters:
+            _limiters[endpoint] = RateLimiter(requests_per_second)
+        return _limiters[endpoint]
+
+
+class OSMClient:
+    """ Rate-limited, retrying Overpass client with a bounded worker pool """
+
+    def __init__(self, endpoint=OVERPASS_URL, max_workers=OSM_MAX_WORKERS, requests_per_second=OSM_REQUESTS_PER_SECOND,
+                 max_retries=OSM_MAX_RETRIES, backoff=OSM_BACKOFF_SECONDS, timeout=OSM_TIMEOUT):
+        self.endpoint = endpoint.rstrip('/')  # Overpass API base URL (".../api")
+        self.max_workers = max(int(max_workers), 1)
+        self.max_retries = int(max_retries)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = _limiter(self.endpoint, requests_per_second)
+
+    def query(self, query):
+        """ Run an Overpass QL query; returns the JSON response """
+        def post():
+            response = requests.post(f"{self.endpoint}/interpreter", data={'data': query}, timeout=self.timeout)
+            if response.status_code in RETRY_STATUS_CODES:
+                raise _RetryableResponse(response)
+            response.raise_for_status()
+            return response.json()
+        return self._with_retries(post, "Overpass query")
+
+    def features_from_polygon(self, polygon, tags):
+        """ ox.features_from_polygon (to OVERPASS_URL) through the limiter and retries (no matches still raise InsufficientResponseError) """
+        return self._with_retries(lambda: ox.features_from_polygon(polygon, tags=tags), "OSM features query")
+
+    def map(self, function, items, desc=None):
+        """ function(item) for every item on the worker pool, in order; the first failure is raised """
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(tqdm(executor.map(function, items), total=len(items), desc=desc, disable=desc is None))
+
+    def _with_retries(self, request, description):
+        """ Call request() after the rate limiter, retrying transient failures with exponential backoff """
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            try:
+                return request()
+            except ox._errors.InsufficientResponseError:
+                raise  # A valid answer: nothing matches
+            except (requests.ConnectionError, requests.Timeout, _RetryableResponse,
+                    ox._errors.ResponseStatusCodeError) as e:
+                if attempt == self.max_retries:
+                    raise OSMQueryError(f"{description} failed after {attempt + 1} attempt(s): {e}") from e
+                time.sleep(self._retry_delay(e, attempt))
+
+    def _retry_delay(self, error, attempt):
+        """ Seconds to wait before the next attempt (the server's Retry-After if it sent one) """
+        retry_after = error.response.headers.get('Retry-After') if isinstance(error, _RetryableResponse) else None
+        try:
+            return max(float(retry_after), 0.0)
+        except (TypeError, ValueError):
+            return self.backoff * 2 ** attempt
+
+
+class _RetryableResponse(Exception):
+    """ HTTP response with a transient status code (rate limited / server busy) """
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
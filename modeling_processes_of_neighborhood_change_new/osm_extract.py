@@ -0,0 +1,174 @@
+# osm_extract.py
+
+from helper import AMTS_DENS_CACHE_DIR, cache_hash
+from pathlib import Path
+from shapely import points
+import xml.etree.ElementTree as ET
+import geopandas as gpd
+import numpy as np
+import bz2
+import gzip
+import os
+import tempfile
+
+# ========================
+# LOCAL OSM EXTRACT READER
+# ========================
+# Amenities are read from a local OpenStreetMap extract instead of live Overpass queries:
+#   - .osm / .osm.bz2 / .osm.gz: streamed twice with ElementTree.iterparse, freeing each element once read -
+#     first for matching nodes and the node references of matching ways, then for the locations of those
+#     nodes only (kept in numpy arrays)
+#   - .osm.pbf: streamed with pyosmium (optional dependency, only imported for .pbf files), with the node
+#     locations in a sparse on-disk index rather than in memory
+# Nodes and ways matching the tag filters become one point each (ways: mean of their node locations),
+# and the result is persisted as GeoParquet with a bounding-box covering column, so loading only the
+# features of the regions' bounding box skips the row groups outside it.
+# Unlike Overpass (OSMnx), relations are NOT read: multipolygon landuse / building / amenity relations
+# are dropped, so counts from an extract can be lower than live counts for the same tags.
+
+def load_osm_amenities(path, tags, bbox=None, cache_dir=AMTS_DENS_CACHE_DIR):
+    """ Amenity points from a local OSM extract (only those in 'bbox' (EPSG:4326) if given) - read once, then loaded from a GeoParquet cache """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"OSM extract '{path}' not found.")
+
+    # Keyed by the extract's name, size and modification time, and the tag filters
+    stat = path.stat()
+    cache_key = f"amenities_{cache_hash(path.name, stat.st_size, stat.st_mtime_ns, tags=tags)}.parquet"
+    cache_path = Path(cache_dir) / cache_key
+
+    if cache_path.exists():
+        print("Loading cached amenities from OSM extract.")
+        return gpd.read_parquet(cache_path, bbox=bbox)
+
+    print(f"Reading amenities from OSM extract '{path}'...")
+    if path.name.endswith('.pbf'):
+        records = _read_pbf(path, tags)
+    else:
+        records = _read_xml(path, tags)
+    features = _to_geodataframe(records, tags)
+
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    features.to_parquet(tmp_path, write_covering_bbox=True)
+    os.replace(tmp_path, cache_path)
+    print(f"{len(features)} amenities cached.")
+    if bbox is not None:
+        minx, miny, maxx, maxy = bbox
+        features = features.cx[minx:maxx, miny:maxy].reset_index(drop=True)
+    return features
+
+def tag_filter(tags):
+    """ Function testing whether an OSM tag dict matches any of the filters (OSMnx 'tags' semantics) """
+    wanted = {
+        key: True if values is True else {values} if isinstance(values, str) else set(values)
+        for key, values in tags.items()
+    }
+
+    def matches(element_tags):
+        for key, values in wanted.items():
+            value = element_tags.get(key)
+            if value is not None and (values is True or value in values):
+                return True
+        return False
+    return matches
+
+def _read_xml(path, tags):
+    """ Stream an .osm XML file; returns [(osm type, osm id, lon, lat, {tag key: value})] of matching elements """
+    matches = tag_filter(tags)
+
+    # Pass 1: matching nodes, and the node references of matching ways
+    records = []
+    ways = []  # (way id, node refs, tags) of matching ways
+    for elem in _iter_elements(path):
+        if elem.tag not in ('node', 'way'):
+            continue
+        element_tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+        if not (element_tags and matches(element_tags)):
+            continue
+        if elem.tag == 'node':
+            records.append(('node', int(elem.get('id')), float(elem.get('lon')), float(elem.get('lat')), element_tags))
+        else:
+            refs = np.array([int(nd.get('ref')) for nd in elem.iter('nd')], dtype=np.int64)
+            ways.append((int(elem.get('id')), refs, element_tags))
+    if not ways:
+        return records
+
+    # Pass 2: locations of the referenced nodes only, as sorted id / coordinate arrays
+    wanted = np.unique(np.concatenate([refs for _, refs, _ in ways]))
+    coords = np.full((len(wanted), 2), np.nan)
+    for elem in _iter_elements(path):
+        if elem.tag == 'node':
+            idx = np.searchsorted(wanted, int(elem.get('id')))
+            if idx < len(wanted) and wanted[idx] == int(elem.get('id')):
+                coords[idx] = float(elem.get('lon')), float(elem.get('lat'))
+
+    # Ways: one point at the mean of their located nodes
+    for way_id, refs, element_tags in ways:
+        way_coords = coords[np.searchsorted(wanted, refs)]
+        way_coords = way_coords[~np.isnan(way_coords[:, 0])]
+        if len(way_coords):
+            lon, lat = way_coords.mean(axis=0)
+            records.append(('way', way_id, lon, lat, element_tags))
+    return records
+
+def _iter_elements(path):
+    """ Top-level elements (node / way / relation / ...) of an .osm XML file, each freed once processed """
+    opener = bz2.open if path.name.endswith('.bz2') else gzip.open if path.name.endswith('.gz') else open
+    with opener(path, 'rb') as file:
+        context = ET.iterparse(file, events=('start', 'end'))
+        _, root = next(context)  # <osm> - cleared after every child so the tree never grows
+        depth = 0
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    yield elem
+                    root.clear()
+
+def _read_pbf(path, tags):
+    """ Stream an .osm.pbf file with pyosmium; same records as _read_xml """
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Reading .osm.pbf extracts requires pyosmium ('pip install osmium'); "
+                          "use an .osm XML extract otherwise.") from e
+
+    matches = tag_filter(tags)
+
+    class AmenityHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def node(self, n):
+            element_tags = {tag.k: tag.v for tag in n.tags}
+            if element_tags and matches(element_tags):
+                self.records.append(('node', n.id, n.location.lon, n.location.lat, element_tags))
+
+        def way(self, w):
+            element_tags = {tag.k: tag.v for tag in w.tags}
+            if element_tags and matches(element_tags):
+                coords = [(nd.lon, nd.lat) for nd in w.nodes if nd.location.valid()]
+                if coords:
+                    lon, lat = np.mean(coords, axis=0)
+                    self.records.append(('way', w.id, lon, lat, element_tags))
+
+    # Node locations (needed for the ways) in a sparse file index - the default in-memory index outgrows RAM on large extracts
+    handler = AmenityHandler()
+    with tempfile.TemporaryDirectory(prefix="osm_locations_") as index_dir:
+        handler.apply_file(str(path), locations=True, idx=f"sparse_file_array,{os.path.join(index_dir, 'locations.idx')}")
+    return handler.records
+
+def _to_geodataframe(records, tags):
+    """ Records -> GeoDataFrame of points (EPSG:4326) with one column per filtered tag key """
+    columns = {
+        'osm_type': [record[0] for record in records],
+        'osm_id': np.array([record[1] for record in records], dtype=np.int64),
+    }
+    for key in tags:
+        columns[key] = [record[4].get(key) for record in records]
+
+    coords = np.array([(record[2], record[3]) for record in records], dtype=float).reshape(-1, 2)
+    return gpd.GeoDataFrame(columns, geometry=points(coords), crs="EPSG:4326")
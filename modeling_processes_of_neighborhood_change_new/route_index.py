@@ -0,0 +1,103 @@
+# route_index.py
+
+import numpy as np
+
+# Integer codes for transportation modes
+MODE_CAR = 0
+MODE_TRANSIT = 1
+MODE_NAMES = ('car', 'transit')
+
+
+class RouteIndex:
+    """
+    Compiled FSM route assignments, built once per run.
+
+    Routes are stored CSR-style: row (mode * n + origin) spans
+    destinations[indptr[row]:indptr[row + 1]], with integer route volumes
+    (one unit of volume = one entry in the legacy expanded routes list).
+    """
+
+    def __init__(self, indptr, destinations, volumes, n):
+        self.indptr = indptr  # (modes * n + 1,) row offsets
+        self.destinations = destinations  # Destination centroid indices
+        self.volumes = volumes  # Route volumes (weights)
+        self.n = n  # num centroids
+
+    @classmethod
+    def from_assigned_routes(cls, assigned_routes, centroids):
+        """ Compile {(o_geoid, d_geoid, mode): volume or {'volume': ...}} into CSR arrays """
+        n = len(centroids)
+        geoid_to_index = {c[4]: idx for idx, c in enumerate(centroids)}
+
+        rows, destinations, volumes = [], [], []
+        for (o_geoid, d_geoid, mode), route in assigned_routes.items():
+            volume = int(route['volume'] if isinstance(route, dict) else route)
+            if volume <= 0 or o_geoid not in geoid_to_index or d_geoid not in geoid_to_index:
+                continue
+            rows.append(MODE_NAMES.index(mode) * n + geoid_to_index[o_geoid])
+            destinations.append(geoid_to_index[d_geoid])
+            volumes.append(volume)
+
+        return cls.from_rows(np.array(rows, dtype=np.int64), np.array(destinations, dtype=np.int64),
+                             np.array(volumes, dtype=float), n)
+
+    @classmethod
+    def from_od_matrix(cls, od_matrix):
+        """ Compile the routed volumes of an ODMatrix (modes x origins x destinations) into CSR arrays """
+        n = od_matrix.n
+        modes, origins, destinations, trips = od_matrix.nonzero()
+        codes = np.array([MODE_NAMES.index(mode) for mode in od_matrix.modes], dtype=np.int64)
+
+        # Integer volumes, as for the legacy dicts (one unit = one expanded route entry)
+        volumes = np.floor(trips)
+        keep = volumes > 0
+        rows = codes[modes[keep]] * n + origins[keep]
+        return cls.from_rows(rows, destinations[keep].astype(np.int64), volumes[keep], n)
+
+    @classmethod
+    def from_rows(cls, rows, destinations, volumes, n):
+        """ Build from parallel (row, destination, volume) arrays, merging duplicate entries """
+        num_rows = len(MODE_NAMES) * n
+        if len(rows):
+            keys, inverse = np.unique(rows * n + destinations, return_inverse=True)
+            volumes = np.bincount(inverse, weights=volumes)
+            rows, destinations = keys // n, keys % n
+        indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+        return cls(indptr, destinations.astype(np.int32), volumes.astype(float), n)
+
+    def routes(self, origin, mode):
+        """ Destination indices and volumes for one origin index and mode (name or code) - O(1) slice """
+        if isinstance(mode, str):
+            mode = MODE_NAMES.index(mode)
+        row = mode * self.n + origin
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.destinations[start:end], self.volumes[start:end]
+
+    def gather(self, origins, modes):
+        """
+        Vectorized lookup for many (origin, mode) pairs.
+
+        Returns:
+        tuple: (owners, destinations, volumes, lengths) - owners[k] is the position in 'origins'
+               that entry k belongs to; entries of each owner are contiguous, lengths[i] per owner
+        """
+        rows = modes * self.n + origins
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        owners = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+        return owners, self.destinations[positions], self.volumes[positions], lengths
+
+    def __len__(self):
+        return len(self.destinations)
+
+
+def compile_routes(assigned_routes, centroids):
+    """ RouteIndex from an ODMatrix, a legacy {(o_geoid, d_geoid, mode): ...} dict or an already compiled RouteIndex """
+    if isinstance(assigned_routes, RouteIndex):
+        return assigned_routes
+    if isinstance(assigned_routes, dict):
+        return RouteIndex.from_assigned_routes(assigned_routes, centroids)
+    return RouteIndex.from_od_matrix(assigned_routes)
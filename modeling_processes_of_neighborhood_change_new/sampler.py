@@ -0,0 +1,109 @@
+# sampler.py
+
+import numpy as np
+
+# =======================================
+# CUMULATIVE (FENWICK TREE) DISTRIBUTIONS
+# =======================================
+# A Fenwick (binary indexed) tree keeps the prefix sums of a weight vector so that
+# changing one weight and drawing a sample both cost O(log n), instead of the O(n)
+# normalise + cumsum that np.random.choice(n, p=...) performs on every call.
+
+
+class FenwickSampler:
+    """ Cumulative distribution over one weight vector (pure Python - cheap per-agent draws) """
+
+    def __init__(self, weights):
+        self.n = len(weights)
+        self.tree = [0.0] + [float(w) for w in weights]
+        for i in range(1, self.n + 1):
+            parent = i + (i & -i)
+            if parent <= self.n:
+                self.tree[parent] += self.tree[i]
+        self.total = float(np.sum(weights))
+        self.top = 1 << (self.n.bit_length() - 1)  # Highest power of two <= n
+
+    def add(self, index, delta):
+        """ Add 'delta' to the weight at 'index' """
+        self.total += delta
+        i = index + 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def sample(self, draw=None):
+        """ Draw an index proportional to its weight; 'draw' is an optional uniform [0, 1) number """
+        if draw is None:
+            draw = np.random.random()
+        target = draw * self.total
+        pos = 0
+        step = self.top
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.n - 1)
+
+
+class BatchedFenwickSampler:
+    """ One cumulative distribution per row of a (rows x n) weight matrix - updates and draws for all rows at once """
+
+    def __init__(self, weights):
+        weights = np.atleast_2d(np.asarray(weights))
+        if not np.issubdtype(weights.dtype, np.floating):
+            weights = weights.astype(float)
+        self.num_rows, self.n = weights.shape
+        self.tree = np.zeros((self.num_rows, self.n + 1), dtype=weights.dtype)  # Same precision as the weights
+        self.tree[:, 1:] = weights
+        for i in range(1, self.n + 1):
+            parent = i + (i & -i)
+            if parent <= self.n:
+                self.tree[:, parent] += self.tree[:, i]
+        self.totals = weights.sum(axis=1, dtype=float)  # One float64 total per row
+        self.top = 1 << (self.n.bit_length() - 1)  # Highest power of two <= n
+
+    def add(self, rows, cols, deltas):
+        """ Add deltas[k] to weight (rows[k], cols[k]); each row may appear at most once per call """
+        self.totals[rows] += deltas
+        index = np.asarray(cols) + 1
+        while True:
+            active = index <= self.n
+            if not active.any():
+                break
+            rows, index, deltas = rows[active], index[active], deltas[active]
+            self.tree[rows, index] += deltas
+            index = index + (index & -index)
+
+    def sample(self, rows=None, draws=None):
+        """ Draw one column per row (all rows by default); 'draws' are optional uniform [0, 1) numbers """
+        if rows is None:
+            rows = np.arange(self.num_rows)
+        if draws is None:
+            draws = np.random.random(len(rows))
+        target = draws * self.totals[rows]
+        pos = np.zeros(len(rows), dtype=np.int64)
+        step = self.top
+        while step:
+            nxt = pos + step
+            valid = nxt <= self.n
+            values = self.tree[rows, np.minimum(nxt, self.n)]
+            go = valid & (values <= target)
+            pos[go] = nxt[go]
+            target[go] -= values[go]
+            step >>= 1
+        return np.minimum(pos, self.n - 1)
+
+
+def sample_segments(weights, lengths, draws=None):
+    """ Draw one position per contiguous segment of 'weights', proportional to the weights within that segment """
+    if draws is None:
+        draws = np.random.random(len(lengths))
+    cum_weights = np.cumsum(weights)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    before = np.concatenate(([0.0], cum_weights))[starts]
+    targets = before + draws * (cum_weights[ends - 1] - before)
+    picks = np.searchsorted(cum_weights, targets, side='right')
+    return np.clip(picks, starts, ends - 1)
@@ -0,0 +1,68 @@
+# shared_inputs.py
+
+from config import SHARED_INPUTS_MAX_MB
+from helper import SHARED_CACHE_DIR
+from pathlib import Path
+import hashlib
+import os
+import numpy as np
+
+# ==================================
+# READ-ONLY INPUTS SHARED BY WORKERS
+# ==================================
+# Large read-only arrays are written once to .npy files and every worker memory-maps
+# them, so the OS shares one copy of the pages. Workers receive a small handle
+# ({name: path}) instead of a pickled copy of the arrays. Files are content-addressed, so
+# unchanged inputs are reused across runs; the least recently used ones are deleted once the
+# directory exceeds SHARED_INPUTS_MAX_MB (never those of the handle just created).
+
+
+def share_arrays(arrays, directory=SHARED_CACHE_DIR, max_mb=SHARED_INPUTS_MAX_MB):
+    """ Write arrays to memory-mappable .npy files (content-addressed) and return a picklable handle """
+    handle = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        hasher = hashlib.md5(f"{array.dtype.str}{array.shape}".encode())
+        hasher.update(array.tobytes())
+        path = directory / f"{name}_{hasher.hexdigest()}.npy"
+
+        if path.exists():
+            os.utime(path)  # Reused - mark as recently used
+        else:
+            tmp_path = directory / f"{path.stem}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+
+        handle[name] = str(path)
+
+    evict_shared(directory, max_mb, keep=handle.values())
+    return handle
+
+
+def evict_shared(directory=SHARED_CACHE_DIR, max_mb=SHARED_INPUTS_MAX_MB, keep=()):
+    """ Delete least recently used shared files until the directory fits in max_mb (never those in 'keep') """
+    keep = {str(path) for path in keep}
+    entries = []
+    for path in Path(directory).glob("*.npy"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # Removed by another process
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_mb * 2 ** 20:
+            break
+        if str(path) in keep or '.tmp' in path.name:
+            continue
+        try:
+            path.unlink()  # Workers that already mapped it keep their mapping
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def open_shared(handle):
+    """ Memory-map (read-only) every array of a handle created by share_arrays """
+    return {name: np.load(path, mmap_mode='r') for name, path in handle.items()}
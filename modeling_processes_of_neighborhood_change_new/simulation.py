@@ -1,21 +1,25 @@
 # simulation.py
 
-from config import RHO_L, ALPHA_L, NUM_AGENTS, RUN_EXPERIMENTS, CTY_KEY, N_JOBS, T_MAX_RANGE
-from helper import DATA_DIR, FIGURE_PKL_CACHE_DIR, T_MAX_L
+from config import RHO_L, ALPHA_L, NUM_AGENTS, RUN_EXPERIMENTS, CTY_KEY, N_JOBS, T_MAX_RANGE, AGENT_ENGINE, CONVERGENCE_STOP
+from helper import DATA_DIR, SNAPSHOT_CACHE_DIR, T_MAX_L
 from Agent import Agent
+from agent_population import AgentPopulation
+from route_index import RouteIndex, MODE_NAMES, compile_routes
+from snapshot import save_snapshot
+from convergence import ConvergenceMonitor
+from shared_inputs import share_arrays, open_shared
 from City import City
 from itertools import product
 from joblib import Parallel, delayed
 import numpy as np
-import pickle
 import time
 
 class SimulationManager:
     """Manages the execution of multiple simulation runs"""
 
-    def __init__(self, centroids, g, amts_dens, centroid_distances):
+    def __init__(self, centroids, node_array, amts_dens, centroid_distances):
         self.centroids = centroids
-        self.g = g
+        self.node_array = np.asarray(node_array)  # Nearest graph node of each centroid (precomputed once)
         self.amts_dens = amts_dens
         self.centroid_distances = centroid_distances
         self.simulation_params = list(product(RHO_L, ALPHA_L))
@@ -27,6 +31,8 @@ class SimulationManager:
         agt_dows = endowments
 
         # Create agents with initial sampling distributions
+        if AGENT_ENGINE == 'vectorized':
+            return AgentPopulation(agt_dows, city, alpha=alpha)
         agents = [Agent(i, dow, city, alpha=alpha) for i, dow in enumerate(agt_dows)]
         return agents
 
@@ -35,14 +41,29 @@ class SimulationManager:
         if not RUN_EXPERIMENTS:
             return
 
+        # Share read-only inputs once; workers receive only file handles (no graph, no dense matrices)
+        route_index = compile_routes(assigned_routes, self.centroids)
+        shared_inputs = self.share_inputs(route_index)
+
         # Run parallel processing using all available CPUs
         Parallel(n_jobs=N_JOBS, backend='loky')(
-            delayed(self.run_single_simulation)(
-                rho, alpha, assigned_routes, endowments, geo_id_to_income
+            delayed(run_shared_simulation)(
+                shared_inputs, self.centroids, rho, alpha, endowments, geo_id_to_income
             )
             for rho, alpha in self.simulation_params
         )
 
+    def share_inputs(self, route_index):
+        """Place distances, amenity densities, centroid nodes and compiled routes in memory-mapped files"""
+        return share_arrays({
+            'centroid_distances': self.centroid_distances,
+            'amts_dens': self.amts_dens,
+            'node_array': self.node_array,
+            'route_indptr': route_index.indptr,
+            'route_destinations': route_index.destinations,
+            'route_volumes': route_index.volumes,
+        })
+
     def run_single_simulation(self, rho, alpha, assigned_routes, endowments, geo_id_to_income):
         """Execute a single simulation with given parameters"""
         start_time = time.time()
@@ -51,33 +72,67 @@ class SimulationManager:
         seed = int(rho * 1000 + alpha * 100)
         np.random.seed(seed)
 
+        # Run, saving the city state at every benchmark
+        def on_benchmark(city, timestep):
+            self.save_simulation_state(city, rho, alpha, timestep)
+
+        city = self.simulate(rho, alpha, assigned_routes, endowments, geo_id_to_income, on_benchmark)
+
+        # Log completion
+        simulation_name = f"{rho}_{alpha}_{NUM_AGENTS}_{self.benchmarks[-1]}"
+        end_time = time.time()
+        converged = f", converged at t={city.converged_at}" if city.converged_at is not None else ""
+        print(f"Simulation {simulation_name} done [{end_time - start_time:.2f} s{converged}]")
+
+    def simulate(self, rho, alpha, assigned_routes, endowments, geo_id_to_income, on_benchmark):
+        """Run one simulation from the current global RNG state; on_benchmark(city, timestep) is called at each benchmark"""
+        # Compile FSM routes once per run (unless already compiled)
+        route_index = compile_routes(assigned_routes, self.centroids)
+
         # Step 1: Initialize city and agents
-        city = City(self.centroids, self.g, self.amts_dens, self.centroid_distances, rho=rho, geo_id_to_income=geo_id_to_income)
+        city = City(self.centroids, self.node_array, self.amts_dens, self.centroid_distances, rho=rho,
+                    geo_id_to_income=geo_id_to_income)
         agents = self.initialize_agents(city, alpha, endowments)
-        city.set_agts(agents)
-        city.update()
+        if AGENT_ENGINE == 'vectorized':
+            agents.set_routes(route_index)
+            city.set_population(agents)
+            city.update_from_arrays(agents.u, agents.dows)
+        else:
+            city.set_agts(agents)
+            city.update()
 
         # Track current benchmark for saving data
         benchmark_index = 0
+        monitor = ConvergenceMonitor() if CONVERGENCE_STOP else None
 
         # Main simulation loop
         for t in range(T_MAX_RANGE):
-            self.execute_simulation_step(city, assigned_routes)
+            self.execute_simulation_step(city, route_index)
 
-            if (t + 1) == self.benchmarks[benchmark_index]:
-                self.save_simulation_state(city, rho, alpha, t + 1)
+            if benchmark_index < len(self.benchmarks) and (t + 1) == self.benchmarks[benchmark_index]:
+                on_benchmark(city, t + 1)
                 benchmark_index += 1
-        
-        # Log completion
-        simulation_name = f"{rho}_{alpha}_{NUM_AGENTS}_{self.benchmarks[benchmark_index-1]}"
-        end_time = time.time()
-        print(f"Simulation {simulation_name} done [{end_time - start_time:.2f} s]")
 
-    def execute_simulation_step(self, city, assigned_routes):
+            # Early stopping - the remaining benchmarks all record the converged state
+            if monitor is not None and monitor.due(t + 1):
+                probabilities = self.agent_probabilities(city) if monitor.window_end(t + 1) else None
+                if monitor.update(t + 1, city.pop_array, city.cmt_array, probabilities):
+                    city.converged_at = t + 1
+                    for timestep in self.benchmarks[benchmark_index:]:
+                        on_benchmark(city, timestep)
+                    break
+
+        return city
+
+    def execute_simulation_step(self, city, route_index):
         """Execute one step of the simulation"""
-        # Step 2: Modify routes and positions
+        if AGENT_ENGINE == 'vectorized':
+            self.execute_vectorized_step(city)
+            return
+
+        # Step 2: Modify routes and positions (only agents whose origin changed re-query the index)
         for agent in city.agts:
-            agent.assign_routes(assigned_routes)
+            agent.assign_routes(route_index)
 
         # Step 3: Update positions and calculate costs
         for agent in city.agts:
@@ -86,23 +141,49 @@ class SimulationManager:
         for agent in city.agts:
             agent.learn()
 
+    def execute_vectorized_step(self, city):
+        """Execute one step of the simulation for an AgentPopulation (routes compiled once per run)"""
+        population = city.agts
+        population.act()
+        city.update_from_arrays(population.u, population.dows, population.prev_u)
+        population.learn()
+
+    def agent_probabilities(self, city):
+        """Current location probabilities of all agents - (agents x centroids) array"""
+        if AGENT_ENGINE == 'vectorized':
+            return city.agts.probabilities
+        return np.array([agent.probabilities for agent in city.agts])
+
     def save_simulation_state(self, city, rho, alpha, timestep):
         """Save simulation results to files"""
-        # Update average probabilities for each agent
-        for agent in city.agts:
-            agent.avg_probabilities = agent.tot_probabilities / timestep
+        # Update average probabilities for each agent (over the steps actually run if the run converged early)
+        steps = city.converged_at if city.converged_at is not None else timestep
+        if AGENT_ENGINE == 'vectorized':
+            city.agts.avg_probabilities = city.agts.average_probabilities(steps)
+        else:
+            for agent in city.agts:
+                agent.avg_probabilities = agent.tot_probabilities / steps
 
         # Save city state
-        self._save_pickle(city, rho, alpha, timestep)
+        self._save_snapshot(city, rho, alpha, timestep)
 
         # Save centroid data
         self._save_csv(city, rho, alpha, timestep)
 
-    def _save_pickle(self, city, rho, alpha, timestep):
-        """Save city state to pickle file"""
-        pickle_filename = f"{CTY_KEY}_{rho}_{alpha}_{NUM_AGENTS}_{timestep}.pkl"
-        with open(FIGURE_PKL_CACHE_DIR / pickle_filename, 'wb') as file:
-            pickle.dump(city, file, protocol=pickle.HIGHEST_PROTOCOL)
+    def _save_snapshot(self, city, rho, alpha, timestep):
+        """Save city and agent state to a compact .npz snapshot"""
+        if AGENT_ENGINE == 'vectorized':
+            population = city.agts
+            agent_u, agent_modes = population.u, population.modes
+            agent_avg_probabilities = population.avg_probabilities
+        else:
+            agent_u = [agent.u for agent in city.agts]
+            agent_modes = [MODE_NAMES.index(agent.mode) for agent in city.agts]
+            agent_avg_probabilities = [agent.avg_probabilities for agent in city.agts]
+
+        snapshot_filename = f"{CTY_KEY}_{rho}_{alpha}_{NUM_AGENTS}_{timestep}.npz"
+        save_snapshot(SNAPSHOT_CACHE_DIR / snapshot_filename, city, agent_u, city.agt_dows, agent_modes,
+                      agent_avg_probabilities, rho, alpha, timestep)
 
     def _save_csv(self, city, rho, alpha, timestep):
         """Save centroid data to CSV"""
@@ -112,13 +193,16 @@ class SimulationManager:
         df_data.to_csv(csv_path, index=False)
 
 
-def run_simulation(centroids, g, amts_dens, centroid_distances, assigned_routes, endowments, geo_id_to_income):
+def run_shared_simulation(shared_inputs, centroids, rho, alpha, endowments, geo_id_to_income):
+    """Worker entry point - memory-maps the shared inputs instead of receiving them pickled"""
+    arrays = open_shared(shared_inputs)
+    manager = SimulationManager(centroids, arrays['node_array'], arrays['amts_dens'], arrays['centroid_distances'])
+    route_index = RouteIndex(arrays['route_indptr'], arrays['route_destinations'], arrays['route_volumes'],
+                             len(centroids))
+    manager.run_single_simulation(rho, alpha, route_index, endowments, geo_id_to_income)
+
+
+def run_simulation(centroids, centroid_nodes, amts_dens, centroid_distances, assigned_routes, endowments, geo_id_to_income):
     """Main entry point for running simulations"""
-    manager = SimulationManager(centroids, g, amts_dens, centroid_distances)
+    manager = SimulationManager(centroids, centroid_nodes, amts_dens, centroid_distances)
     manager.run_parallel_simulations(assigned_routes, endowments, geo_id_to_income)
-    
-def run_single_simulation_calibration(rho, alpha, centroids, g, amts_dens, centroid_distances, 
-                                      assigned_routes, endowments, geo_id_to_income
-                                      ):
-    manager = SimulationManager(centroids, g, amts_dens, centroid_distances)
-    manager.run_single_simulation(rho, alpha, assigned_routes, endowments, geo_id_to_income)
\ No newline at end of file
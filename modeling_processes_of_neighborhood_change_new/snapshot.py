@@ -0,0 +1,88 @@
+# snapshot.py
+
+from config import SNAPSHOT_PROBABILITIES
+from City import City
+from history import HistoryRecorder
+import numpy as np
+import os
+
+# ====================
+# SIMULATION SNAPSHOTS
+# ====================
+# Only the state needed downstream (plotting, calibration, CSVs) is persisted - as plain
+# arrays in an uncompressed .npz - instead of pickling the City with its graph and agents.
+
+CENTROID_FIELDS = [
+    'lon_array', 'lat_array', 'beltline_score_array', 'amts_dens',
+    'pop_array', 'avg_dow_array', 'cmt_array', 'dow_thr_array', 'upk_array'
+]
+
+
+def save_snapshot(path, city, agent_u, agent_dows, agent_modes, agent_avg_probabilities, rho, alpha, timestep):
+    """ Write one simulation snapshot to 'path' (.npz) """
+    arrays = {field: np.asarray(getattr(city, field)) for field in CENTROID_FIELDS}
+
+    # Centroid identifiers
+    arrays['id_array'] = np.array(city.id_array, dtype=str)
+    arrays['name_array'] = np.array(city.name_array, dtype=str)
+
+    # Expected incomes (GEO_ID -> income)
+    arrays['income_ids'] = np.array(list(city.geo_id_to_income.keys()), dtype=str)
+    arrays['income_values'] = np.array(list(city.geo_id_to_income.values()), dtype=float)
+
+    # Agents
+    arrays['agent_u'] = np.asarray(agent_u, dtype=np.int32)
+    arrays['agent_dows'] = np.asarray(agent_dows, dtype=float)
+    arrays['agent_modes'] = np.asarray(agent_modes, dtype=np.int8)
+    if SNAPSHOT_PROBABILITIES:
+        arrays['agent_avg_probabilities'] = np.asarray(agent_avg_probabilities, dtype=np.float32)
+
+    # Histories
+    arrays['hist_timesteps'] = city.history.timesteps
+    arrays['hist_population'] = city.history.population
+    arrays['hist_community'] = city.history.community
+
+    # Parameters (converged_at = -1 if the run did not stop early)
+    arrays['params'] = np.array([rho, alpha, timestep], dtype=float)
+    arrays['converged_at'] = np.array(-1 if city.converged_at is None else city.converged_at, dtype=np.int64)
+
+    # Write to a temporary file first so readers never see a partial snapshot
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+class CitySnapshot:
+    """ Read-only City state loaded from a snapshot - exposes the attributes plotting and calibration use """
+
+    # Same DataFrame as a live City
+    get_data = City.get_data
+
+    def __init__(self, arrays):
+        for field in CENTROID_FIELDS:
+            setattr(self, field, arrays[field])
+        self.id_array = arrays['id_array'].tolist()
+        self.name_array = arrays['name_array'].tolist()
+        self.n = len(self.id_array)
+        self.geo_id_to_income = dict(zip(arrays['income_ids'].tolist(), arrays['income_values'].tolist()))
+
+        self.agent_u = arrays['agent_u']
+        self.agent_dows = arrays['agent_dows']
+        self.agent_modes = arrays['agent_modes']
+        self.agent_avg_probabilities = arrays.get('agent_avg_probabilities')
+
+        # Same history API as a live City (city.history)
+        self.history = HistoryRecorder.from_arrays(arrays['hist_timesteps'], arrays['hist_population'],
+                                                   arrays['hist_community'])
+
+        rho, alpha, timestep = arrays['params']
+        self.rho, self.alpha, self.timestep = int(rho), alpha, int(timestep)
+        converged_at = int(arrays['converged_at']) if 'converged_at' in arrays else -1
+        self.converged_at = converged_at if converged_at >= 0 else None
+
+
+def load_snapshot(path):
+    """ Load a snapshot written by save_snapshot """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {key: data[key] for key in data.files}
+    return CitySnapshot(arrays)
@@ -0,0 +1,42 @@
+# conftest.py
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+import pytest
+
+# Modules are flat and import each other by name; helper.py creates its cache directories under the cwd
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.chdir(tempfile.mkdtemp(prefix="mponc_tests_"))
+
+
+@pytest.fixture
+def small_world():
+    """ Small fixed city: projected road graph, centroids, amenity densities, distances, endowments, incomes """
+    n = 20
+    rng = np.random.default_rng(0)
+    g = nx.MultiDiGraph(crs='EPSG:32616')
+    points = rng.random((n, 2)) * 1000
+    for i, (x, y) in enumerate(points):
+        g.add_node(i, x=x, y=y)
+    for i in range(n):
+        for j in range(n):
+            if i != j and rng.random() < 0.3:
+                g.add_edge(i, j, length=float(np.hypot(*(points[i] - points[j]))))
+
+    centroids = [(x, y, f"r{i}", float(rng.random()), f"{1000 + i}") for i, (x, y) in enumerate(points)]
+    amts_dens = rng.random(n)
+    amts_dens /= amts_dens.max()
+    distances = rng.random((n, n))
+    distances = (distances + distances.T) / 2
+    np.fill_diagonal(distances, 0)
+    endowments = rng.random(500)
+    geo_id_to_income = {centroid[4]: float(rng.random()) for centroid in centroids}
+    return {
+        'g': g, 'centroids': centroids, 'amts_dens': amts_dens, 'centroid_distances': distances,
+        'endowments': endowments, 'geo_id_to_income': geo_id_to_income,
+    }
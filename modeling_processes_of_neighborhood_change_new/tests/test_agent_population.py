@@ -0,0 +1,80 @@
+# test_agent_population.py
+
+import numpy as np
+
+import Agent
+import agent_population
+import simulation
+from City import City
+from route_index import compile_routes
+
+
+def run(world, engine, seed, t_max, monkeypatch):
+    """ One simulation with the given engine; returns the city """
+    monkeypatch.setattr(simulation, 'AGENT_ENGINE', engine)
+    monkeypatch.setattr(simulation, 'T_MAX_RANGE', t_max)
+    monkeypatch.setattr(simulation, 'CONVERGENCE_STOP', False)
+    for module in (Agent, agent_population):
+        monkeypatch.setattr(module, 'EPSILON', 0.05)  # Fast learning - distributions move far from the initial one
+    manager = simulation.SimulationManager(world['centroids'], np.arange(len(world['centroids'])),
+                                           world['amts_dens'], world['centroid_distances'])
+    np.random.seed(seed)
+    return manager.simulate(4, 0.25, {}, world['endowments'], world['geo_id_to_income'], lambda city, t: None)
+
+
+def test_engines_match_statistically(small_world, monkeypatch):
+    """ Object and vectorized engines give the same time-averaged population distribution (over seeds) """
+    shares = {}
+    for engine in ('object', 'vectorized'):
+        histories = [run(small_world, engine, seed, 300, monkeypatch).history.population for seed in range(6)]
+        shares[engine] = np.mean([history.mean(axis=0) for history in histories], axis=0) / len(small_world['endowments'])
+
+    # Total variation distance between the two average distributions
+    assert 0.5 * np.abs(shares['object'] - shares['vectorized']).sum() < 0.01
+
+
+def test_tot_probabilities_is_running_sum(small_world, monkeypatch):
+    """ The lazy per-agent accumulator equals the explicit sum of every step's probabilities """
+    monkeypatch.setattr(simulation, 'AGENT_ENGINE', 'vectorized')
+    world = small_world
+    manager = simulation.SimulationManager(world['centroids'], np.arange(20), world['amts_dens'],
+                                           world['centroid_distances'])
+    city = City(world['centroids'], np.arange(20), world['amts_dens'], world['centroid_distances'], rho=4,
+                geo_id_to_income=world['geo_id_to_income'])
+    np.random.seed(0)
+    population = manager.initialize_agents(city, 0.25, world['endowments'])
+    population.set_routes(compile_routes({}, world['centroids']))
+    city.set_population(population)
+    city.update_from_arrays(population.u, population.dows)
+
+    total = population.probabilities.copy()
+    for _ in range(200):
+        manager.execute_vectorized_step(city)
+        total += population.probabilities
+
+    assert population.weights.dtype == np.float32
+    np.testing.assert_allclose(population.tot_probabilities, total, rtol=1e-5, atol=1e-6)
+
+
+def test_agent_tot_probabilities_is_running_sum(small_world, monkeypatch):
+    """ Same lazy accumulation for the object engine's Agent """
+    monkeypatch.setattr(simulation, 'AGENT_ENGINE', 'object')
+    world = small_world
+    manager = simulation.SimulationManager(world['centroids'], np.arange(20), world['amts_dens'],
+                                           world['centroid_distances'])
+    city = City(world['centroids'], np.arange(20), world['amts_dens'], world['centroid_distances'], rho=4,
+                geo_id_to_income=world['geo_id_to_income'])
+    np.random.seed(0)
+    agents = manager.initialize_agents(city, 0.25, world['endowments'][:50])
+    city.set_agts(agents)
+    city.update()
+    route_index = compile_routes({}, world['centroids'])
+
+    totals = [agent.probabilities.copy() for agent in agents]
+    for _ in range(200):
+        manager.execute_simulation_step(city, route_index)
+        for total, agent in zip(totals, agents):
+            total += agent.probabilities
+
+    for total, agent in zip(totals, agents):
+        np.testing.assert_allclose(agent.tot_probabilities, total, rtol=1e-9)
@@ -0,0 +1,28 @@
+# test_amenity_cache.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from amenity_cache import AmenityCache
+
+
+def disk_size(cache):
+    return sum(path.stat().st_size for path in cache.cache_dir.glob("*.pkl"))
+
+
+def test_concurrent_puts_of_one_key(tmp_path):
+    cache = AmenityCache(tmp_path)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda value: cache.put('total_same', value), range(200)))
+    assert cache.get('total_same') in range(200)
+    assert not list(tmp_path.glob("*.tmp"))
+    assert cache.size == disk_size(cache)
+
+
+def test_eviction_keeps_size_bound(tmp_path):
+    cache = AmenityCache(tmp_path, max_mb=0.01)  # ~10 KB
+    for idx in range(50):
+        cache.put(f"counts_{idx}", bytes(1000))
+        os.utime(tmp_path / f"counts_{idx}.pkl", (idx, idx))  # Distinct modification times, oldest first
+    assert cache.size == disk_size(cache) <= cache.max_bytes
+    assert cache.get('counts_49') is not None and cache.get('counts_0') is None
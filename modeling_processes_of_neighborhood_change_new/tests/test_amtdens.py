@@ -0,0 +1,46 @@
+# test_amtdens.py
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, box
+
+from amtdens import count_amenities, tag_matches, weighted_amts_dens
+
+TAGS = {'amenity': ['cafe', 'school'], 'shop': True}
+
+
+def tiny_features():
+    """ Five features in two unit squares (EPSG:4326) """
+    return gpd.GeoDataFrame({
+        'amenity': ['cafe', 'school', 'bank', None, 'cafe'],
+        'shop': [None, None, None, 'bakery', 'kiosk'],
+    }, geometry=[Point(0.5, 0.5), Point(0.2, 0.8), Point(0.5, 0.2), Point(1.5, 0.5), Point(1.5, 0.8)], crs='EPSG:4326')
+
+
+def test_tag_matches():
+    matches = tag_matches(tiny_features(), {**TAGS, 'leisure': True})
+    assert matches['amenity'].tolist() == [True, True, False, False, True]
+    assert matches['shop'].tolist() == [False, False, False, True, True]
+    assert not matches['leisure'].any()  # Key absent from the features
+
+
+def test_count_amenities():
+    regions = gpd.GeoDataFrame({'Simulation_ID': ['a', 'b', 'c']},
+                               geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(5, 5, 6, 6)], crs='EPSG:4326')
+    counts = count_amenities(regions, tiny_features(), TAGS)
+    # The bank matches no tag but is still a feature; the cafe-kiosk counts once in Total
+    assert counts.loc[0].to_dict() == {'amenity': 2, 'shop': 0, 'Total': 3}
+    assert counts.loc[1].to_dict() == {'amenity': 1, 'shop': 2, 'Total': 2}
+    assert counts.loc[2].to_dict() == {'amenity': 0, 'shop': 0, 'Total': 0}
+
+
+def test_weighted_amts_dens():
+    counts = pd.DataFrame({'amenity': [2, 1, 0], 'shop': [0, 2, 0], 'Total': [2, 2, 0]})
+    areas = np.array([1.0, 2.0, 0.0])
+    np.testing.assert_allclose(weighted_amts_dens(counts, areas), [1.0, 0.5, 0.0])
+    np.testing.assert_allclose(weighted_amts_dens(counts, areas, {'shop': 3.0}), [2 / 3.5, 1.0, 0.0])
+    # Weights multiply the per-key counts: the region-1 feature matching both keys counts twice
+    np.testing.assert_allclose(weighted_amts_dens(counts, areas, {}), [1.0, 0.75, 0.0])
+    np.testing.assert_allclose(weighted_amts_dens(counts, areas, {'amenity': 2.0, 'shop': 2.0}),
+                               weighted_amts_dens(counts, areas, {}))
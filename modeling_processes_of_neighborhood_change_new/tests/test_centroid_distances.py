@@ -0,0 +1,28 @@
+# test_centroid_distances.py
+
+import numpy as np
+import pytest
+
+from centroid_distances import compute_region_distances
+from graph_handler import compile_graph
+
+
+@pytest.mark.parametrize('aggregate', ['mean', 'median'])
+def test_region_distances_match_pairwise(small_world, aggregate):
+    g = small_world['g']
+    compiled_graph = compile_graph(g)
+    rng = np.random.default_rng(1)
+    samples = [rng.choice(list(g.nodes), size, replace=False) for size in (1, 3, 2, 4, 1)]
+    result = compute_region_distances(compiled_graph, samples, aggregate)
+
+    # Reference: aggregate each block of sampled-node distances on its own
+    reduce = np.mean if aggregate == 'mean' else np.median
+    expected = np.empty((len(samples), len(samples)))
+    for i, sources in enumerate(samples):
+        rows = compiled_graph.distances(compiled_graph.node_indices(sources))
+        for j, targets in enumerate(samples):
+            block = rows[:, compiled_graph.node_indices(targets)]
+            block = block[np.isfinite(block)]
+            expected[i, j] = reduce(block) if len(block) else np.inf
+    np.fill_diagonal(expected, 0.0)
+    np.testing.assert_allclose(result, expected)
@@ -0,0 +1,73 @@
+# test_city.py
+
+import numpy as np
+import pytest
+
+from City import City
+
+
+class Inhabitant:
+    """ Minimal agent: an endowment and a location """
+
+    def __init__(self, i, dow):
+        self.i = i
+        self.dow = dow
+        self.u = None
+
+
+def make_city(world, incremental):
+    city = City(world['centroids'], np.arange(20), world['amts_dens'], world['centroid_distances'], rho=4,
+                geo_id_to_income=world['geo_id_to_income'])
+    city.incremental = incremental
+    return city
+
+
+def assert_same_state(city, reference):
+    np.testing.assert_array_equal(city.pop_array, reference.pop_array)
+    np.testing.assert_allclose(city.cmt_array, reference.cmt_array, rtol=1e-12)
+    np.testing.assert_allclose(city.avg_dow_array, reference.avg_dow_array, rtol=1e-12)
+    np.testing.assert_array_equal(city.dow_thr_array, reference.dow_thr_array)
+    np.testing.assert_array_equal(city.upk_array, reference.upk_array)
+
+
+def test_update_dirty_matches_update_all(small_world):
+    """ Incremental (_update_dirty) and full (_update_all) updates agree after many random moves """
+    rng = np.random.default_rng(1)
+    dirty_city, full_city = make_city(small_world, True), make_city(small_world, False)
+    agents = [Inhabitant(i, dow) for i, dow in enumerate(small_world['endowments'])]
+    for agent in agents:
+        agent.u = int(rng.integers(20))
+        dirty_city.add_agent(agent, agent.u)
+        full_city.add_agent(agent, agent.u)
+
+    for _ in range(50):
+        for agent in rng.choice(agents, size=100, replace=False):
+            prev_u, agent.u = agent.u, int(rng.integers(20))
+            dirty_city.move_agent(agent, prev_u, agent.u)
+            full_city.move_agent(agent, prev_u, agent.u)
+        dirty_city.update()
+        full_city.update()
+        assert_same_state(dirty_city, full_city)
+
+
+def test_update_moves_matches_update_all_from_arrays(small_world):
+    """ Vectorized incremental update agrees with the full vectorized update after many random moves """
+    rng = np.random.default_rng(2)
+    dows = small_world['endowments']
+    moves_city, full_city = make_city(small_world, True), make_city(small_world, True)
+    u = rng.integers(20, size=len(dows))
+    moves_city.update_from_arrays(u, dows)
+
+    for _ in range(50):
+        prev_u, u = u, np.where(rng.random(len(dows)) < 0.2, rng.integers(20, size=len(dows)), u)
+        moves_city.update_from_arrays(u, dows, prev_u)
+        full_city.update_from_arrays(u, dows)
+        assert_same_state(moves_city, full_city)
+
+
+def test_diagonal_distance_of_one_rejected(small_world):
+    distances = small_world['centroid_distances'].copy()
+    distances[3, 3] = 1.0
+    with pytest.raises(ValueError):
+        City(small_world['centroids'], np.arange(20), small_world['amts_dens'], distances, rho=4,
+             geo_id_to_income=small_world['geo_id_to_income'])
@@ -0,0 +1,46 @@
+# test_history.py
+
+import pickle
+
+import numpy as np
+
+from City import City
+from history import HistoryRecorder
+from snapshot import save_snapshot, load_snapshot
+
+
+def test_unpickled_empty_recorder_keeps_recording():
+    recorder = pickle.loads(pickle.dumps(HistoryRecorder(3, t_max=10)))
+    for step in range(5):
+        recorder.record(np.full(3, step), np.full(3, step / 10))
+    np.testing.assert_array_equal(recorder.timesteps, np.arange(5))
+    np.testing.assert_array_equal(recorder.population[:, 0], np.arange(5))
+
+
+def test_stride_and_frame():
+    recorder = HistoryRecorder(2, t_max=10, stride=3)
+    for step in range(10):
+        recorder.record([step, 2 * step], [0.5, 0.25])
+    np.testing.assert_array_equal(recorder.timesteps, [0, 3, 6, 9])
+
+    frame = recorder.to_frame(['a', 'b'])
+    assert len(frame) == 8
+    assert frame[frame['Simulation_ID'] == 'b']['Population'].tolist() == [0, 6, 12, 18]
+
+
+def test_snapshot_exposes_history(small_world, tmp_path):
+    """ A loaded snapshot has the same history API as the live City """
+    city = City(small_world['centroids'], np.arange(20), small_world['amts_dens'],
+                small_world['centroid_distances'], rho=4, geo_id_to_income=small_world['geo_id_to_income'])
+    rng = np.random.default_rng(0)
+    dows = small_world['endowments']
+    for _ in range(5):
+        city.update_from_arrays(rng.integers(20, size=len(dows)), dows)
+
+    path = tmp_path / 'snapshot.npz'
+    save_snapshot(path, city, np.zeros(len(dows)), dows, np.zeros(len(dows)), None, 4, 0.25, 5)
+    snapshot = load_snapshot(path)
+
+    np.testing.assert_array_equal(snapshot.history.population, city.history.population)
+    np.testing.assert_array_equal(snapshot.history.to_frame(snapshot.id_array)['Population'],
+                                  city.history.to_frame(city.id_array)['Population'])
@@ -0,0 +1,61 @@
+# test_osm_client.py
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from osm_client import OSMClient, OSMQueryError
+
+
+@pytest.fixture
+def overpass():
+    """ Local Overpass stand-in: answers each request with the next (status, headers) of its 'script' """
+    class Handler(BaseHTTPRequestHandler):
+        script, requests = [], []
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            Handler.requests.append(self.rfile.read(int(self.headers['Content-Length'])))
+            status, headers = Handler.script.pop(0) if Handler.script else (200, {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if status == 200:
+                self.wfile.write(json.dumps({'elements': [{'type': 'node', 'id': 1}]}).encode())
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/api", Handler
+    server.shutdown()
+
+
+def test_query_retries_transient_failures(overpass):
+    url, handler = overpass
+    handler.script = [(429, {'Retry-After': '0'}), (503, {}), (502, {})]
+    client = OSMClient(url, requests_per_second=100, max_retries=3, backoff=0.01)
+    assert client.query('node(1);out;') == {'elements': [{'type': 'node', 'id': 1}]}
+    assert len(handler.requests) == 4
+
+
+def test_query_raises_after_retries(overpass):
+    url, handler = overpass
+    handler.script = [(503, {})] * 3
+    client = OSMClient(url, requests_per_second=100, max_retries=2, backoff=0.01)
+    with pytest.raises(OSMQueryError):
+        client.query('node(1);out;')
+    assert len(handler.requests) == 3
+
+
+def test_query_does_not_retry_client_errors(overpass):
+    url, handler = overpass
+    handler.script = [(400, {})]
+    client = OSMClient(url, requests_per_second=100, max_retries=3, backoff=0.01)
+    with pytest.raises(requests.HTTPError):
+        client.query('bad query')
+    assert len(handler.requests) == 1
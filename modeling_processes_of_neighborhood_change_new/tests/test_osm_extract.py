@@ -0,0 +1,29 @@
+# test_osm_extract.py
+
+import bz2
+
+from osm_extract import _read_xml, _to_geodataframe
+
+EXTRACT = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lon="0.0" lat="0.0"><tag k="amenity" v="cafe"/></node>
+  <node id="2" lon="1.0" lat="0.0"/>
+  <node id="3" lon="1.0" lat="2.0"/>
+  <node id="4" lon="5.0" lat="5.0"><tag k="highway" v="crossing"/></node>
+  <way id="10"><nd ref="2"/><nd ref="3"/><tag k="shop" v="bakery"/></way>
+  <way id="11"><nd ref="2"/><nd ref="4"/><tag k="highway" v="residential"/></way>
+  <relation id="20"><member type="way" ref="11" role="outer"/><tag k="amenity" v="school"/></relation>
+</osm>
+"""
+
+
+def test_read_xml(tmp_path):
+    path = tmp_path / "map.osm.bz2"
+    path.write_bytes(bz2.compress(EXTRACT.encode()))
+    tags = {'amenity': True, 'shop': ['bakery']}
+    features = _to_geodataframe(_read_xml(path, tags), tags)
+
+    # Matching node and way (at the mean of its nodes); the relation is not read
+    assert features[['osm_type', 'osm_id']].values.tolist() == [['node', 1], ['way', 10]]
+    assert features.geometry.x.tolist() == [0.0, 1.0] and features.geometry.y.tolist() == [0.0, 1.0]
+    assert features['amenity'].notna().tolist() == [True, False] and features['shop'].notna().tolist() == [False, True]
@@ -0,0 +1,29 @@
+# test_shared_inputs.py
+
+import os
+
+import numpy as np
+
+from shared_inputs import share_arrays, open_shared
+
+
+def test_unchanged_inputs_are_reused(tmp_path):
+    array = np.arange(1000.0)
+    first = share_arrays({'a': array}, directory=tmp_path)
+    second = share_arrays({'a': array.copy()}, directory=tmp_path)
+    assert first == second
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+    np.testing.assert_array_equal(open_shared(first)['a'], array)
+
+
+def test_directory_is_bounded(tmp_path):
+    """ Older inputs are deleted beyond max_mb; the ones just shared are always kept """
+    handles = []
+    for i in range(5):
+        handles.append(share_arrays({'d': np.full((512, 512), float(i))}, directory=tmp_path, max_mb=5))  # 2 MB each
+        os.utime(handles[-1]['d'], (i, i))  # Distinct access order
+
+    remaining = sorted(path.name for path in tmp_path.glob("*.npy"))
+    assert len(remaining) == 2
+    assert os.path.basename(handles[-1]['d']) in remaining
+    assert not os.path.exists(handles[0]['d'])
@@ -0,0 +1,46 @@
+# test_traffic_assignment.py
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from traffic_assignment import LinkNetwork, all_or_nothing, assign_traffic
+
+
+@pytest.fixture
+def grid():
+    """ Two-way 6 x 6 grid of residential streets with O-D volumes between random corners """
+    g = nx.MultiDiGraph()
+    rng = np.random.default_rng(0)
+    for (u, v) in nx.convert_node_labels_to_integers(nx.grid_2d_graph(6, 6)).edges:
+        length = float(rng.uniform(80, 120))
+        g.add_edge(u, v, length=length, highway='residential')
+        g.add_edge(v, u, length=length, highway='residential')
+    network = LinkNetwork.from_graph(g)
+    origins = rng.integers(0, network.num_nodes, 40)
+    destinations = rng.integers(0, network.num_nodes, 40)
+    volumes = rng.uniform(100, 400, 40)
+    return network, origins, destinations, volumes
+
+
+def test_pool_matches_serial(grid):
+    network, origins, destinations, volumes = grid
+    costs = network.free_flow_times
+    serial = all_or_nothing(network, costs, origins, destinations, volumes, chunk_size=4)
+    pooled = all_or_nothing(network, costs, origins, destinations, volumes, chunk_size=4, n_jobs=2)
+    np.testing.assert_allclose(pooled, serial)
+
+    serial_flows, _, serial_gaps = assign_traffic(network, origins, destinations, volumes, max_iterations=5)
+    pooled_flows, _, pooled_gaps = assign_traffic(network, origins, destinations, volumes, max_iterations=5, n_jobs=2)
+    np.testing.assert_allclose(pooled_flows, serial_flows)
+    np.testing.assert_allclose(pooled_gaps, serial_gaps)
+
+
+def test_conjugate_frank_wolfe_converges(grid):
+    network, origins, destinations, volumes = grid
+    _, _, fw_gaps = assign_traffic(network, origins, destinations, volumes, method='frank-wolfe',
+                                   max_iterations=30, tolerance=0)
+    _, _, cfw_gaps = assign_traffic(network, origins, destinations, volumes, method='conjugate-frank-wolfe',
+                                    max_iterations=30, tolerance=0)
+    assert cfw_gaps[-1] < 1e-2
+    assert cfw_gaps[-1] <= fw_gaps[-1]
@@ -0,0 +1,324 @@
+# traffic_assignment.py
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from shared_inputs import share_arrays, open_shared
+from joblib import Parallel, delayed
+import numpy as np
+import pandas as pd
+
+# =======================================
+# CAPACITY-CONSTRAINED TRAFFIC ASSIGNMENT
+# =======================================
+# O-D volumes are loaded onto the road network's links (arrays indexed by link id) and
+# iterated to user equilibrium with Frank-Wolfe (or the method of successive averages):
+#   1. link costs from the BPR volume-delay function at the current flows
+#   2. all-or-nothing loading on shortest-path trees (scipy csgraph, one batch of origins at a time)
+#   3. move the flows towards the all-or-nothing flows (line search / 1 / k step)
+# until the relative gap falls below the tolerance. Conjugate Frank-Wolfe (Mitradjieva & Lindberg, 2013)
+# instead moves towards a mix of the all-or-nothing flows and the previous target that is conjugate to
+# the previous direction, which needs far fewer all-or-nothing loadings (the dominant cost) for the same gap.
+
+# Free-flow speed (km/h) and capacity per lane (vehicles/h) by OSM highway class
+DEFAULT_SPEEDS = {
+    'motorway': 100, 'trunk': 80, 'primary': 65, 'secondary': 55, 'tertiary': 45,
+    'motorway_link': 60, 'trunk_link': 50, 'primary_link': 45, 'secondary_link': 40, 'tertiary_link': 35,
+    'residential': 35, 'living_street': 15, 'unclassified': 35,
+}
+DEFAULT_LANE_CAPACITIES = {
+    'motorway': 2000, 'trunk': 1800, 'primary': 1600, 'secondary': 1200, 'tertiary': 1000,
+    'motorway_link': 1500, 'trunk_link': 1400, 'primary_link': 1200, 'secondary_link': 1000, 'tertiary_link': 800,
+    'residential': 600, 'living_street': 300, 'unclassified': 600,
+}
+FALLBACK_SPEED = 40
+FALLBACK_LANE_CAPACITY = 600
+
+
+class LinkNetwork:
+    """
+    Road network as flat link arrays, one link per directed node pair.
+
+    Links are sorted by (tail, head), so they are also the CSR order of the graph; parallel
+    OSM edges are merged into one link (shortest length, summed capacity).
+    """
+
+    def __init__(self, nodes, tails, heads, lengths, free_flow_times, capacities):
+        self.nodes = np.asarray(nodes)  # Graph node id of each node index
+        self.node_index = {node: idx for idx, node in enumerate(self.nodes.tolist())}
+        self.tails = tails  # Link tail node indices (int32)
+        self.heads = heads  # Link head node indices (int32)
+        self.lengths = lengths  # Link lengths (meters)
+        self.free_flow_times = free_flow_times  # Link travel times without traffic (seconds)
+        self.capacities = capacities  # Link capacities (vehicles)
+
+        self.num_nodes = len(self.nodes)
+        self.indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=self.num_nodes), out=self.indptr[1:])
+
+        # Incoming links of each node, padded to the largest in-degree (fast (tail, head) -> link lookups)
+        order = np.argsort(heads, kind='stable')
+        in_degrees = np.bincount(heads, minlength=self.num_nodes)
+        slots = np.arange(len(order)) - np.repeat(np.cumsum(in_degrees) - in_degrees, in_degrees)
+        self.in_tails = np.full((self.num_nodes, max(in_degrees.max(initial=0), 1)), -1, dtype=np.int32)
+        self.in_links = np.zeros(self.in_tails.shape, dtype=np.int64)
+        self.in_tails[heads[order], slots] = tails[order]
+        self.in_links[heads[order], slots] = order
+
+    @classmethod
+    def from_graph(cls, g):
+        """ Compile an OSMnx graph into link arrays """
+        nodes = np.array(list(g.nodes))
+        node_index = {node: idx for idx, node in enumerate(nodes.tolist())}
+
+        tails, heads, lengths, speeds, capacities = [], [], [], [], []
+        for u, v, data in g.edges(data=True):
+            highway = _first(data.get('highway'))
+            lanes = _lanes(data.get('lanes'))
+            tails.append(node_index[u])
+            heads.append(node_index[v])
+            lengths.append(float(data.get('length', 0.0)))
+            speeds.append(float(data.get('speed_kph') or DEFAULT_SPEEDS.get(highway, FALLBACK_SPEED)))
+            capacities.append(lanes * DEFAULT_LANE_CAPACITIES.get(highway, FALLBACK_LANE_CAPACITY))
+
+        tails = np.array(tails, dtype=np.int64)
+        heads = np.array(heads, dtype=np.int64)
+        lengths = np.array(lengths)
+        times = lengths / (np.array(speeds) / 3.6)
+        capacities = np.array(capacities, dtype=float)
+
+        # Merge parallel edges: fastest edge's length/time, summed capacity
+        keys = tails * len(nodes) + heads
+        order = np.lexsort((times, keys))
+        keys, lengths, times, capacities = keys[order], lengths[order], times[order], capacities[order]
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        capacities = np.bincount(inverse, weights=capacities)
+
+        return cls(nodes, (unique_keys // len(nodes)).astype(np.int32), (unique_keys % len(nodes)).astype(np.int32),
+                   lengths[first], times[first], capacities)
+
+    def __len__(self):
+        return len(self.tails)
+
+    def csr(self, costs):
+        """ (N x N) sparse graph with the given link costs """
+        return csr_matrix((costs, self.heads, self.indptr), shape=(self.num_nodes, self.num_nodes))
+
+    def link_ids(self, tails, heads):
+        """ Link id of each (tail, head) node index pair (the pairs must be links) """
+        slots = np.argmax(self.in_tails[heads] == tails[:, None], axis=1)
+        return self.in_links[heads, slots]
+
+    def node_indices(self, nodes):
+        """ Node indices of graph node ids """
+        return np.array([self.node_index[node] for node in np.asarray(nodes).tolist()], dtype=np.int64)
+
+    def share(self):
+        """ Write the link arrays to memory-mappable files (once per content) - picklable handle for workers """
+        return share_arrays({
+            'network_nodes': self.nodes, 'network_tails': self.tails, 'network_heads': self.heads,
+            'network_lengths': self.lengths, 'network_free_flow_times': self.free_flow_times,
+            'network_capacities': self.capacities,
+        })
+
+    @classmethod
+    def open_shared(cls, handle):
+        """ Network from a handle created by share() - memory-mapped, built once per process """
+        key = tuple(sorted(handle.values()))
+        if key not in _shared_networks:
+            arrays = open_shared(handle)
+            _shared_networks[key] = cls(arrays['network_nodes'], arrays['network_tails'], arrays['network_heads'],
+                                        arrays['network_lengths'], arrays['network_free_flow_times'],
+                                        arrays['network_capacities'])
+        return _shared_networks[key]
+
+
+_shared_networks = {}  # Networks opened by this (worker) process, by handle
+
+
+def _first(value):
+    """ First element of OSM list-valued tags """
+    return value[0] if isinstance(value, list) else value
+
+
+def _lanes(value):
+    """ Number of lanes from an OSM 'lanes' tag (1 if missing or malformed) """
+    try:
+        return max(int(float(_first(value))), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def bpr(free_flow_times, flows, capacities, alpha=0.15, beta=4):
+    """ BPR volume-delay function: t = t0 * (1 + alpha * (flow / capacity) ^ beta) """
+    return free_flow_times * (1 + alpha * (flows / capacities) ** beta)
+
+
+def all_or_nothing(network, costs, origins, destinations, volumes, chunk_size=64, n_jobs=1, parallel=None):
+    """
+    Load every O-D volume onto its shortest path at the given link costs.
+
+    Parameters:
+    network (LinkNetwork): Compiled road network
+    costs (array): Cost of each link
+    origins, destinations (array): Node indices of each O-D pair
+    volumes (array): Volume of each O-D pair
+    chunk_size (int): Origins per shortest-path batch (bounds the predecessor matrix memory)
+    n_jobs (int): Number of processes loading batches of origins in parallel
+    parallel (joblib.Parallel): Open worker pool to run batches on (default: a new pool if n_jobs != 1)
+
+    Returns:
+    numpy.ndarray: Flow on each link
+    """
+    sources = np.unique(origins)
+    chunks = [sources[start:start + chunk_size] for start in range(0, len(sources), chunk_size)]
+    pairs = [np.isin(origins, chunk) for chunk in chunks]
+
+    if n_jobs == 1 and parallel is None:
+        results = (
+            _load_chunk(network, costs, chunk, origins[in_chunk], destinations[in_chunk], volumes[in_chunk])
+            for chunk, in_chunk in zip(chunks, pairs)
+        )
+    else:
+        # Workers memory-map the network (written once) instead of receiving it pickled with every batch
+        handle = network.share()
+        parallel = parallel if parallel is not None else Parallel(n_jobs=n_jobs, backend='loky')
+        results = parallel(
+            delayed(_load_chunk)(handle, costs, chunk, origins[in_chunk], destinations[in_chunk], volumes[in_chunk])
+            for chunk, in_chunk in zip(chunks, pairs)
+        )
+
+    flows = np.zeros(len(network))
+    for chunk_flows in results:
+        flows += chunk_flows
+    return flows
+
+
+def _load_chunk(network, costs, chunk, origins, destinations, volumes):
+    """ Link flows of the O-D pairs whose origins are in 'chunk' (one shortest-path tree per origin) """
+    if not isinstance(network, LinkNetwork):
+        network = LinkNetwork.open_shared(network)  # Worker: memory-mapped handle
+    _, predecessors = dijkstra(network.csr(costs), indices=chunk, return_predecessors=True)
+    predecessors = predecessors.ravel()
+
+    # O-D pairs as flat positions (row * N + node) in the predecessor matrix
+    offsets = np.searchsorted(chunk, origins) * network.num_nodes
+    current = destinations
+
+    # Walk all paths back towards their origins at once, one link per pass
+    # (the origin is the only node of a tree without a predecessor)
+    keep = (predecessors[offsets + current] >= 0) & (volumes > 0)
+    offsets, current, volumes = offsets[keep], current[keep], volumes[keep]
+    link_chunks, volume_chunks = [], []
+    while len(current):
+        previous = predecessors[offsets + current]
+        link_chunks.append(network.link_ids(previous, current))
+        volume_chunks.append(volumes)
+        active = predecessors[offsets + previous] >= 0
+        offsets, current, volumes = offsets[active], previous[active], volumes[active]
+
+    if not link_chunks:
+        return np.zeros(len(network))
+    return np.bincount(np.concatenate(link_chunks), weights=np.concatenate(volume_chunks), minlength=len(network))
+
+
+def assign_traffic(network, origins, destinations, volumes, method='frank-wolfe', max_iterations=50, tolerance=1e-4,
+                   alpha=0.15, beta=4, n_jobs=1):
+    """
+    Capacity-constrained (user equilibrium) traffic assignment.
+
+    Parameters:
+    network (LinkNetwork): Compiled road network
+    origins, destinations (array): Node indices of each O-D pair
+    volumes (array): Volume of each O-D pair
+    method (str): 'frank-wolfe' (line search), 'conjugate-frank-wolfe' or 'msa' (method of successive averages)
+    max_iterations (int): Maximum number of iterations
+    tolerance (float): Stop once the relative gap is below this value
+    alpha, beta (float): BPR parameters
+    n_jobs (int): Number of processes for all-or-nothing loading (one pool for all iterations)
+
+    Returns:
+    tuple: (link flows, link travel times, relative gap of each iteration)
+    """
+    origins = np.asarray(origins, dtype=np.int64)
+    destinations = np.asarray(destinations, dtype=np.int64)
+    volumes = np.asarray(volumes, dtype=float)
+    t0, capacities = network.free_flow_times, network.capacities
+
+    # One worker pool for all iterations (workers keep the memory-mapped network between them)
+    with Parallel(n_jobs=n_jobs, backend='loky') as parallel:
+        parallel = parallel if n_jobs != 1 else None
+
+        def load(costs):
+            return all_or_nothing(network, costs, origins, destinations, volumes, n_jobs=n_jobs, parallel=parallel)
+
+        # Initial solution: all-or-nothing at free-flow times
+        flows = load(t0)
+        previous_target = None
+        gaps = []
+
+        for iteration in range(max_iterations):
+            costs = bpr(t0, flows, capacities, alpha, beta)
+            target = load(costs)
+
+            # Relative gap: total travel time on current flows vs. on the shortest paths
+            total_time = costs @ flows
+            gap = (total_time - costs @ target) / total_time if total_time > 0 else 0.0
+            gaps.append(float(gap))
+            if gap < tolerance:
+                break
+
+            if method == 'conjugate-frank-wolfe' and previous_target is not None:
+                target = _conjugate_target(t0, flows, target, previous_target, capacities, alpha, beta)
+            direction = target - flows
+            if method == 'msa':
+                step = 1 / (iteration + 2)
+            else:
+                step = _line_search(t0, flows, direction, capacities, alpha, beta)
+            flows = flows + step * direction
+            previous_target = target
+
+    return flows, bpr(t0, flows, capacities, alpha, beta), gaps
+
+
+def _line_search(t0, flows, direction, capacities, alpha, beta, iterations=30):
+    """ Step in [0, 1] minimizing the Beckmann objective along 'direction' (bisection on its derivative) """
+    low, high = 0.0, 1.0
+    for _ in range(iterations):
+        step = (low + high) / 2
+        if bpr(t0, flows + step * direction, capacities, alpha, beta) @ direction > 0:
+            high = step
+        else:
+            low = step
+    return (low + high) / 2
+
+
+def _conjugate_target(t0, flows, target, previous_target, capacities, alpha, beta, max_weight=0.99999):
+    """ Mix of the all-or-nothing flows and the previous target conjugate to the previous direction """
+    # Diagonal Hessian of the Beckmann objective (BPR derivative)
+    hessian = t0 * alpha * beta * (flows / capacities) ** (beta - 1) / capacities
+    previous_direction = hessian * (previous_target - flows)
+    denominator = previous_direction @ (target - previous_target)
+    weight = (previous_direction @ (target - flows)) / denominator if denominator != 0 else 0.0
+    weight = min(max(weight, 0.0), max_weight)
+    return weight * previous_target + (1 - weight) * target
+
+
+def assign_od_matrix(network, od_matrix, centroid_nodes, mode='car', **kwargs):
+    """ Assign one mode of an ODMatrix between the centroids' graph nodes (see assign_traffic) """
+    modes, origins, destinations, volumes = od_matrix.nonzero()
+    keep = modes == od_matrix.modes.index(mode)
+    nodes = network.node_indices(centroid_nodes)
+    return assign_traffic(network, nodes[origins[keep]], nodes[destinations[keep]], volumes[keep], **kwargs)
+
+
+def link_flows_frame(network, flows, times):
+    """ DataFrame of assigned link flows (one row per link) """
+    return pd.DataFrame({
+        'u': network.nodes[network.tails],
+        'v': network.nodes[network.heads],
+        'Length': network.lengths,
+        'Capacity': network.capacities,
+        'Flow': flows,
+        'Free-flow Time': network.free_flow_times,
+        'Congested Time': times,
+    })
@@ -1,9 +1,10 @@
 # visualization.py
 
 from config import CTY_KEY, NUM_AGENTS, COLORBAR_NUM_INTERVALS, DPI, T_MAX_RANGE, PLOT_FOLIUM
-from helper import FIGURE_PKL_CACHE_DIR, FIGURES_DIR, GRAPH_FILE, gdf_cache_filenames, PLT_DIR, FOLIUM_DIR
+from helper import SNAPSHOT_CACHE_DIR, FIGURES_DIR, GRAPH_FILE, gdf_cache_filenames, PLT_DIR, FOLIUM_DIR
 from gdf_handler import load_gdf
 from graph_handler import load_graph
+from snapshot import load_snapshot
 import matplotlib.pyplot as plt
 import time
 import folium
@@ -15,7 +16,6 @@ from pathlib import Path
 from branca.colormap import linear
 import osmnx as ox
 import numpy as np
-import pickle
 
 # =============================
 # VISUALIZATION EXECUTION LOGIC
@@ -26,17 +26,16 @@ def plot_city(rho, alpha, t_max, centroids, beltline_geom):
     # Define graph title, file name, and file path
     figkey = f"{CTY_KEY}_{rho}_{alpha}_{NUM_AGENTS}_{t_max}"
     title = f"Timestep: {t_max}"
-    pickle_filename = f"{figkey}.pkl"
-    pickle_path = FIGURE_PKL_CACHE_DIR / pickle_filename
+    snapshot_filename = f"{figkey}.npz"
+    snapshot_path = SNAPSHOT_CACHE_DIR / snapshot_filename
     
     # Don't pass large items as parameters - avoid pickling issues during multiprocessing (too big)
     g = load_graph(GRAPH_FILE)
     gdf, _, _ = load_gdf()
     
     # Graphing logic
-    if pickle_path.exists():
-        with open(pickle_path, 'rb') as file:
-            city = pickle.load(file)
+    if snapshot_path.exists():
+        city = load_snapshot(snapshot_path)
             
         # Retrieve city data for plotting:
         df_data = city.get_data()
@@ -57,6 +56,9 @@ def plot_city(rho, alpha, t_max, centroids, beltline_geom):
             graph=g,
             gdf=gdf,
             )
+        if t_max == T_MAX_RANGE:
+            # Population of every centroid over the whole run
+            plot_history(city=city, title=title, figkey=figkey)
         if PLOT_FOLIUM == True and t_max == T_MAX_RANGE:
             # Plot with Folium
             gdf = gdf.to_crs(epsg=32616)
@@ -69,7 +71,7 @@ def plot_city(rho, alpha, t_max, centroids, beltline_geom):
                 gdf=gdf
             )
     else:
-        print(f"Pickle file '{pickle_filename}' does not exist. Skipping plotting.")
+        print(f"Snapshot file '{snapshot_filename}' does not exist. Skipping plotting.")
     
 
 # ================
@@ -146,7 +148,7 @@ def plot_matplotlib(centroids, city, title, figkey='city', graph=None, gdf=None)
     for ID in range(len(centroids)):
         lon = city.lon_array[ID]
         lat = city.lat_array[ID]
-        inhabitants = len(city.inh_array[ID])
+        inhabitants = city.pop_array[ID]
         ax.text(lon, lat, str(inhabitants), fontsize=9, ha='center', va='center', color='black')
         
     # Use the global ScalarMappable for consistent colorbar
@@ -168,6 +170,28 @@ def plot_matplotlib(centroids, city, title, figkey='city', graph=None, gdf=None)
     print(f"Plotted and saved {DIR.name} [{end_time - start_time:.2f} s]")
     
     
+def plot_history(city, title, figkey='city'):
+    """ Population history of every centroid (from city.history) """
+    start_time = time.time()
+
+    history = city.history.to_frame(city.id_array).pivot(index='Timestep', columns='Simulation_ID', values='Population')
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+    history.plot(ax=ax, legend=False, linewidth=0.8, alpha=0.7)
+    ax.set_xlabel('Timestep', fontsize=12)
+    ax.set_ylabel('Population', fontsize=12)
+    ax.set_title(f"Population history - {title}", fontsize=14)
+
+    # Save graph to 'figures/matplotlib' folder
+    plt.tight_layout()
+    DIR = Path(PLT_DIR) / f"{figkey}_history.pdf"
+    plt.savefig(DIR, format='pdf', bbox_inches='tight', dpi=DPI)
+    plt.close()
+
+    end_time = time.time()
+    print(f"Plotted and saved {DIR.name} [{end_time - start_time:.2f} s]")
+
+
 # ============    
 # FOLIUM GRAPH
 # ============
@@ -222,7 +246,7 @@ def plot_folium(centroids, city, title, figkey='city', graph=None, gdf = None):
         # name
         name = city.name_array[i]
         # pop
-        inhabitants = len(city.inh_array[i])
+        inhabitants = city.pop_array[i]
         # amenity density
         amenity_density = city.amts_dens[i]
         # num amenities